@@ -0,0 +1,293 @@
+'''
+Offline statistics over captured PRT3 traffic, computed with NumPy.
+
+Captures are text files with one "<unix time> <message>" line per message
+received (gzipped or not); journals written by ParadoxEventJournal can be
+read as well. The system events are decoded in bulk into a structured array
+(EVENT_DTYPE) and every statistic is computed on whole arrays at once, with
+the same meaning of the event groups as ParadoxAlarmPanel.decode_system_event.
+
+Usage: python -m pyparadox_alarm.alarm_analytics [--report ...] capture|journal_dir ...
+
+NumPy is an optional dependency: pip install numpy (or pyparadox_alarm[analytics]).
+'''
+
+import argparse
+import gzip
+import os
+import sys
+from pyparadox_alarm.paradox_defaults import EVENT_GROUP_COUNT, EVENT_GROUPS
+from pyparadox_alarm.alarm_panel import EVENT_ACTIONS
+from pyparadox_alarm.alarm_journal import RECORD, SEGMENT_PREFIX, SEGMENT_SUFFIX
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHATTER_COUNT = 10 #Opens of one zone...
+CHATTER_WINDOW = 60.0 #...within this many seconds make a chattering sensor
+REPORTS = ('durations', 'triggers', 'chatter', 'timeline')
+
+def _groups(action, args):
+    '''Returns the event groups that trigger an event action with the arguments.'''
+    return sorted(group for group, actions in EVENT_ACTIONS.items() if (action, args) in actions)
+
+ZONE_OPEN_GROUPS = _groups('_event_zone_status', ('O',))
+ZONE_CLOSE_GROUPS = _groups('_event_zone_status', ('C',))
+AREA_ARM_GROUPS = _groups('_event_area_status', ('A',))
+AREA_DISARM_GROUPS = _groups('_event_area_status', ('D',))
+
+if np is not None:
+    EVENT_DTYPE = np.dtype([('time', 'f8'), ('group', 'u1'), ('number', 'u2'), ('area', 'u2')])
+    #A journal record as packed by alarm_journal.RECORD
+    JOURNAL_DTYPE = np.dtype([('time', '<f8'), ('type', 'S2'), ('group', 'u1'), ('pad', 'V1'),
+                              ('number', '<u2'), ('zone', '<u2'), ('area', '<u2'),
+                              ('status', 'S8')])
+    assert JOURNAL_DTYPE.itemsize == RECORD.size
+
+def _require_numpy():
+    '''Raises a clear error when NumPy is missing.'''
+    if np is None:
+        raise ImportError('pyparadox_alarm.alarm_analytics needs NumPy: pip install numpy')
+
+def _parse_time(field):
+    '''Returns the time in a capture line, None if it is not a number.'''
+    try:
+        return float(field)
+    except ValueError:
+        return None
+
+def parse_capture(data):
+    '''
+    Decodes the system events in capture data (bytes of "<time> <message>" lines,
+    a line without time gets NaN) into an EVENT_DTYPE array. Replies and
+    malformed lines, including a time that is not a number, are skipped.
+    '''
+    _require_numpy()
+    _lines = np.array(data.replace(b'\r', b'\n').split(b'\n'))
+    _parts = np.char.rpartition(_lines, b' ')
+    _messages = _parts[:, 2]
+    _mask = np.char.startswith(_messages, b'G') & (np.char.str_len(_messages) >= 12)
+    _bytes = _messages[_mask].astype('S12').view(np.uint8).reshape(-1, 12)
+    _digits = _bytes.astype(np.int16) - ord('0')
+    _valid = ((_bytes[:, 4] == ord('N')) & (_bytes[:, 8] == ord('A')) &
+              np.all((_digits[:, [1, 2, 3, 5, 6, 7, 9, 10, 11]] >= 0) &
+                     (_digits[:, [1, 2, 3, 5, 6, 7, 9, 10, 11]] <= 9), axis=1))
+    _digits = _digits[_valid]
+    _group = _digits[:, 1] * 100 + _digits[:, 2] * 10 + _digits[:, 3]
+    _known = _group < EVENT_GROUP_COUNT
+    _digits = _digits[_known]
+    _group = _group[_known]
+    _times = _parts[:, 0][_mask][_valid][_known]
+    _times = np.where(_times == b'', b'nan', _times)
+    try:
+        _times = _times.astype(np.float64)
+    except ValueError: #Only for captures with a malformed time, line by line
+        _times = [_parse_time(_time) for _time in _times]
+        _timed = np.array([_time is not None for _time in _times], bool)
+        _times = np.array([_time for _time in _times if _time is not None], np.float64)
+        _digits = _digits[_timed]
+        _group = _group[_timed]
+    _events = np.empty(len(_digits), EVENT_DTYPE)
+    _events['time'] = _times
+    _events['group'] = _group
+    _events['number'] = _digits[:, 5] * 100 + _digits[:, 6] * 10 + _digits[:, 7]
+    _events['area'] = _digits[:, 9] * 100 + _digits[:, 10] * 10 + _digits[:, 11]
+    return _events
+
+def load_capture(path):
+    '''Reads and decodes a capture file, see parse_capture().'''
+    _open = gzip.open if path.endswith('.gz') else open
+    with _open(path, 'rb') as _file:
+        return parse_capture(_file.read())
+
+def load_journal(directory):
+    '''Reads the system events of a journal written by ParadoxEventJournal.'''
+    _require_numpy()
+    _records = [np.fromfile(os.path.join(directory, name), JOURNAL_DTYPE,
+                            os.path.getsize(os.path.join(directory, name)) // RECORD.size)
+                for name in sorted(os.listdir(directory))
+                if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+    _records = np.concatenate(_records) if _records else np.empty(0, JOURNAL_DTYPE)
+    _records = _records[(_records['type'] == b'G ') & (_records['group'] < EVENT_GROUP_COUNT)]
+    _events = np.empty(len(_records), EVENT_DTYPE)
+    for _field in EVENT_DTYPE.names:
+        _events[_field] = _records[_field]
+    return _events
+
+def load(paths):
+    '''Loads and concatenates captures and journal directories, sorted by time.'''
+    _require_numpy()
+    _events = [load_journal(path) if os.path.isdir(path) else load_capture(path)
+               for path in paths]
+    _events = np.concatenate(_events) if _events else np.empty(0, EVENT_DTYPE)
+    return _events[np.argsort(_events['time'], kind='stable')]
+
+def _zone_opens_closes(events):
+    '''Returns the zone open/close events sorted by zone, then time.'''
+    _events = events[np.isin(events['group'], ZONE_OPEN_GROUPS + ZONE_CLOSE_GROUPS)]
+    return _events[np.lexsort((_events['time'], _events['number']))]
+
+def open_durations(events):
+    '''
+    Returns how long zones were open as an array of (zone, start, duration):
+    from the event that opened a closed zone to the next close of that zone.
+    Repeated opens count from the first, as in the alarm state.
+    '''
+    _require_numpy()
+    _events = _zone_opens_closes(events)
+    _zones = _events['number']
+    _open = np.isin(_events['group'], ZONE_OPEN_GROUPS)
+    _same_zone = np.concatenate(([False], _zones[1:] == _zones[:-1]))
+    _was_open = np.concatenate(([False], _open[:-1])) & _same_zone
+    _starts = np.flatnonzero(_open & ~_was_open)
+    _closes = np.flatnonzero(~_open)
+    _next = np.searchsorted(_closes, _starts)
+    _closed = _next < len(_closes) #Still open at the end of the capture otherwise
+    _starts = _starts[_closed]
+    _ends = _closes[_next[_closed]]
+    _paired = _zones[_ends] == _zones[_starts]
+    _starts = _starts[_paired]
+    _ends = _ends[_paired]
+    _durations = np.empty(len(_starts), [('zone', 'u2'), ('start', 'f8'), ('duration', 'f8')])
+    _durations['zone'] = _zones[_starts]
+    _durations['start'] = _events['time'][_starts]
+    _durations['duration'] = _events['time'][_ends] - _events['time'][_starts]
+    return _durations
+
+def duration_stats(durations, percentiles=(50, 90, 99)):
+    '''
+    Returns per zone the number of times it was open with the mean, maximum and
+    percentiles of the open durations, as an array with fields zone, count,
+    mean, max and p<percentile>.
+    '''
+    _require_numpy()
+    _order = np.lexsort((durations['duration'], durations['zone']))
+    _zones = durations['zone'][_order]
+    _values = durations['duration'][_order]
+    _unique, _first, _counts = np.unique(_zones, return_index=True, return_counts=True)
+    _stats = np.zeros(len(_unique), [('zone', 'u2'), ('count', 'i8'), ('mean', 'f8'),
+                                     ('max', 'f8')] +
+                      [('p' + str(percentile), 'f8') for percentile in percentiles])
+    _stats['zone'] = _unique
+    _stats['count'] = _counts
+    if len(_unique):
+        _stats['mean'] = np.add.reduceat(_values, _first) / _counts
+        _stats['max'] = _values[_first + _counts - 1] #Sorted by duration within a zone
+        for percentile in percentiles:
+            #Nearest rank within each zone's (sorted) durations
+            _rank = np.ceil(percentile / 100.0 * _counts).astype(np.int64) - 1
+            _stats['p' + str(percentile)] = _values[_first + np.maximum(_rank, 0)]
+    return _stats
+
+def triggers_per_hour(events, utc_offset=0.0):
+    '''
+    Returns (zones, counts): the zones that opened and, per zone, the number of
+    opens in each hour of the day (24 columns), utc_offset hours from UTC.
+    '''
+    _require_numpy()
+    _events = events[np.isin(events['group'], ZONE_OPEN_GROUPS) & ~np.isnan(events['time'])]
+    _zones, _index = np.unique(_events['number'], return_inverse=True)
+    _hours = ((_events['time'] + utc_offset * 3600) // 3600 % 24).astype(np.int64)
+    _counts = np.bincount(_index * 24 + _hours, minlength=len(_zones) * 24)
+    return _zones, _counts.reshape(len(_zones), 24)
+
+def chattering_zones(events, count=CHATTER_COUNT, window=CHATTER_WINDOW):
+    '''
+    Returns the zones that opened count times within window seconds, as an array
+    of (zone, bursts, first, last): the number of such runs of opens and the
+    start of the first and the last one.
+    '''
+    _require_numpy()
+    _events = events[np.isin(events['group'], ZONE_OPEN_GROUPS)]
+    _events = _events[np.lexsort((_events['time'], _events['number']))]
+    _chatter = np.empty(0, [('zone', 'u2'), ('bursts', 'i8'), ('first', 'f8'), ('last', 'f8')])
+    if count < 1 or len(_events) < count:
+        return _chatter
+    _zones = _events['number']
+    _times = _events['time']
+    _span = slice(count - 1, None)
+    _bursts = np.flatnonzero((_zones[_span] == _zones[:len(_zones) - count + 1]) &
+                             (_times[_span] - _times[:len(_times) - count + 1] <= window))
+    _unique, _first, _counts = np.unique(_zones[_bursts], return_index=True,
+                                         return_counts=True)
+    _chatter = np.empty(len(_unique), _chatter.dtype)
+    _chatter['zone'] = _unique
+    _chatter['bursts'] = _counts
+    _chatter['first'] = _times[_bursts[_first]]
+    _chatter['last'] = _times[_bursts[_first + _counts - 1]]
+    return _chatter
+
+def area_timeline(events):
+    '''
+    Returns when areas were armed and disarmed as an array of (area, time, armed,
+    group), sorted by area and time. Events that did not change the state (a
+    second arm of an armed area) are left out.
+    '''
+    _require_numpy()
+    _events = events[np.isin(events['group'], AREA_ARM_GROUPS + AREA_DISARM_GROUPS)]
+    _events = _events[np.lexsort((_events['time'], _events['area']))]
+    _armed = np.isin(_events['group'], AREA_ARM_GROUPS)
+    _areas = _events['area']
+    _changed = np.ones(len(_events), bool)
+    _changed[1:] = (_areas[1:] != _areas[:-1]) | (_armed[1:] != _armed[:-1])
+    _timeline = np.empty(int(_changed.sum()), [('area', 'u2'), ('time', 'f8'), ('armed', '?'),
+                                                ('group', 'u1')])
+    _timeline['area'] = _areas[_changed]
+    _timeline['time'] = _events['time'][_changed]
+    _timeline['armed'] = _armed[_changed]
+    _timeline['group'] = _events['group'][_changed]
+    return _timeline
+
+def _print_report(report, events, args):
+    '''Prints one report to stdout.'''
+    if report == 'durations':
+        print('zone  opens     mean      p50      p90      p99      max  (seconds)')
+        for _row in duration_stats(open_durations(events)):
+            print(str.format('{0:4d} {1:6d} {2:8.1f} {3:8.1f} {4:8.1f} {5:8.1f} {6:8.1f}',
+                             _row['zone'], _row['count'], _row['mean'], _row['p50'],
+                             _row['p90'], _row['p99'], _row['max']))
+    elif report == 'triggers':
+        print('zone  opens per hour of the day 00..23')
+        _zones, _counts = triggers_per_hour(events, args.utc_offset)
+        for _zone, _row in zip(_zones, _counts):
+            print(str.format('{0:4d} {1}', _zone, ' '.join(str(count) for count in _row)))
+    elif report == 'chatter':
+        print(str.format('zones opening {0} times within {1:g} s', args.chatter_count,
+                         args.chatter_window))
+        for _row in chattering_zones(events, args.chatter_count, args.chatter_window):
+            print(str.format('{0:4d} {1:6d} bursts from {2:.0f} to {3:.0f}', _row['zone'],
+                             _row['bursts'], _row['first'], _row['last']))
+    elif report == 'timeline':
+        print('area      time  state     event')
+        for _row in area_timeline(events):
+            print(str.format('{0:4d} {1:9.0f}  {2:8}  {3}', _row['area'], _row['time'],
+                             'armed' if _row['armed'] else 'disarmed',
+                             EVENT_GROUPS.get(int(_row['group']), '')))
+
+def main(argv=None):
+    '''Command line interface, prints the requested reports.'''
+    _parser = argparse.ArgumentParser(prog='python -m pyparadox_alarm.alarm_analytics',
+                                      description='Statistics over captured PRT3 traffic.')
+    _parser.add_argument('sources', nargs='+',
+                         help='capture files ("<time> <message>" lines) or journal directories')
+    _parser.add_argument('--report', choices=REPORTS, action='append',
+                         help='report to print (repeatable, all by default)')
+    _parser.add_argument('--utc-offset', type=float, default=0.0,
+                         help='hours from UTC for the hour of the day')
+    _parser.add_argument('--chatter-count', type=int, default=CHATTER_COUNT)
+    _parser.add_argument('--chatter-window', type=float, default=CHATTER_WINDOW)
+    _args = _parser.parse_args(argv)
+    try:
+        _events = load(_args.sources)
+    except ImportError as err:
+        _parser.exit(2, str(err) + '\n')
+    print(str.format('{0} events', len(_events)))
+    for _report in _args.report or REPORTS:
+        print()
+        _print_report(_report, _events, _args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+'''
+Handles asyncio based communication to/from the Paradox alarm panel.
+
+The threaded ParadoxSerialComms/ParadoxAlarmPanel pair hands every message over
+three threads and two queues. The classes in here run the same decoding on the
+event loop of the host application instead. Requests wait in the same priority
+scheduler as those of the threaded panel, which wakes the writer task on the
+loop when a request is queued; requests are written through asyncio transports,
+so no executor thread is kept busy per panel.
+'''
+
+import asyncio
+import functools
+import logging
+from queue import Empty
+import serial
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel, COMMAND_ERR
+from pyparadox_alarm.alarm_discovery import discover, probe_speed, PRT3_SPEEDS
+from pyparadox_alarm.alarm_framing import ParadoxFramer
+from pyparadox_alarm.alarm_transport import parse_socket_port
+
+_LOGGER = logging.getLogger(__name__)
+
+class ParadoxAsyncProtocol(asyncio.Protocol):
+    '''
+    Splits the byte stream received from the panel into messages.
+    Every complete message is handed to the message callback as soon as its
+    terminating carriage return has been received.
+    '''
+    def __init__(self, message_callback, connection_lost_callback=None):
+        self._message_callback = message_callback
+        self._connection_lost_callback = connection_lost_callback
+        self._framer = ParadoxFramer()
+        self.transport = None
+
+    def connection_made(self, transport):
+        '''Keeps track of the transport once the connection is open.'''
+        self.transport = transport
+        _LOGGER.debug('Async connection to Paradox made.')
+
+    def data_received(self, data):
+        '''Splits the received bytes on carriage returns and passes messages on.'''
+        _LOGGER.debug('RX > %s', data)
+        for _frame in self._framer.feed(data):
+            self._message_callback(_frame)
+
+    def eof_received(self):
+        '''Close the transport when the panel closes its side.'''
+        return False
+
+    def connection_lost(self, exc):
+        '''Notifies the owner that the connection is gone.'''
+        _LOGGER.debug('Async connection to Paradox lost: %s', exc)
+        self.transport = None
+        if self._connection_lost_callback is not None:
+            self._connection_lost_callback(exc)
+
+
+class AsyncParadoxAlarmPanel(ParadoxAlarmPanel):
+    '''
+    This class represents a Paradox alarm panel driven by an asyncio event loop.
+    Decoding and client callbacks run on the event loop, requests are paced by
+    a single writer task. submit_request() queues a request from any thread, as
+    for ParadoxAlarmPanel; async_submit_request() does the same for coroutines.
+    The port may be a serial device or a "socket://host:port" url to reach a
+    serial-to-TCP bridge. A prt_speed of None is probed and a paradox_model of
+    None (or discover_enrolled) discovered by start(), as for ParadoxAlarmPanel.
+    A message handler replaces decode_response as receiver of the messages, which
+    allows ParadoxPanelManager to schedule the decoding of many panels.
+    '''
+
+    def __init__(self, paradox_model='EVO48', comm_module='PRT3',
+                 prt_port='/dev/ttyUSB0', prt_speed=57600, request_interval=2, loop=None,
+                 message_handler=None, discover_enrolled=False):
+        super().__init__(paradox_model, comm_module, prt_port, prt_speed,
+                         request_interval=request_interval, discover_enrolled=discover_enrolled)
+        self._loop = loop
+        self._message_handler = message_handler or self.decode_response
+        self._transport = None
+        self._write_transport = None
+        self._serial = None
+        self._writer_task = None
+        self._requests_queued = None
+        self._to_alarm.on_put = self._request_queued
+
+    @property
+    def loop(self):
+        '''Returns the event loop the panel runs on, None until it is known.'''
+        return self._loop
+
+    @loop.setter
+    def loop(self, value):
+        '''Sets the event loop the panel runs on, before start().'''
+        self._loop = value
+
+    @property
+    def is_connected(self):
+        '''Returns True while the connection to the panel is open.'''
+        return self._transport is not None
+
+    async def start(self):
+        '''
+        Connect to the Paradox Alarm and start listening for events to occur.
+        Probing the speed and discovering the panel block on replies, they run
+        once in the default executor while the loop writes and decodes.
+        '''
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if self._prt_speed is None:
+            self._prt_speed = (await self._loop.run_in_executor(None, probe_speed, self._prt_port)
+                               or PRT3_SPEEDS[0])
+        _LOGGER.info("Connecting to Paradox on host: %s, port: %d",
+                     self._prt_port, self._prt_speed)
+        self._request_tracker.open() #In case of a restart
+        self._shutdown = False
+        factory = lambda: ParadoxAsyncProtocol(self._message_handler, self._connection_lost)
+        _address = parse_socket_port(self._prt_port)
+        if _address is not None:
+            self._transport, _ = await self._loop.create_connection(factory, *_address)
+            self._write_transport = self._transport
+        else:
+            self._serial = serial.Serial(self._prt_port, self._prt_speed, timeout=0)
+            self._serial.reset_input_buffer()
+            self._transport, _ = await self._loop.connect_read_pipe(factory, self._serial)
+            self._write_transport, _ = await self._loop.connect_write_pipe(asyncio.Protocol,
+                                                                           self._serial)
+        self._requests_queued = asyncio.Event()
+        self._writer_task = self._loop.create_task(self._write_requests())
+        if self._discover:
+            try:
+                _result = await self._loop.run_in_executor(None, functools.partial(
+                    discover, self.request, self._paradox_model,
+                    interval=self._request_interval, cancel=self.cancel_requests))
+            except Exception:
+                await self.stop() #Nothing left running, start() can be retried
+                raise
+            self._apply_discovery(_result)
+        _LOGGER.debug('Async panel started.')
+
+    async def stop(self):
+        '''Shut down and close our connection to the Paradox Alarm.'''
+        self._shutdown = True
+        self._request_tracker.close()
+        if self._writer_task is None:
+            _LOGGER.error(COMMAND_ERR)
+            return
+        _LOGGER.info("Disconnecting from the Paradox Alarm...")
+        #The writer only waits between requests, cancelling it never loses one
+        self._writer_task.cancel()
+        try:
+            await self._writer_task
+        except asyncio.CancelledError:
+            pass
+        self._writer_task = None
+        for _transport in {self._transport, self._write_transport} - {None}:
+            _transport.close()
+        self._transport = None
+        self._write_transport = None
+        self._serial = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def async_submit_request(self, request, priority=None):
+        '''
+        Places a request on the request queue, see submit_request(). Returns
+        False if the same request was already waiting.
+        '''
+        return self.submit_request(request, priority)
+
+    async def _write_requests(self):
+        '''Writes queued requests to the panel, pacing them by the request interval.'''
+        _LOGGER.debug('Waiting for requests...')
+        while not self._shutdown:
+            try:
+                request, priority = self._to_alarm.take(False)
+            except Empty:
+                self._requests_queued.clear() #Set again by the next put(), on the loop
+                await self._requests_queued.wait()
+                continue
+            if request is None: #Wake-up sentinel
+                continue
+            if self._transport is None or self._write_transport.is_closing():
+                self._to_alarm.requeue(request, priority) #Kept for the next start()
+                break
+            data = (request + "\r").encode('ascii')
+            _LOGGER.debug('TX > %s', data)
+            self._write_transport.write(data)
+            self._to_alarm.task_done()
+            await asyncio.sleep(self._request_interval)
+
+    def _request_queued(self):
+        '''Wakes the writer task when a request is queued (from any thread).'''
+        _loop = self._loop
+        _requests_queued = self._requests_queued
+        if _loop is None or _requests_queued is None:
+            return #Not started yet, the writer looks at the queue first
+        try:
+            _loop.call_soon_threadsafe(_requests_queued.set)
+        except RuntimeError: #Loop closed
+            pass
+
+    def _schedule_later(self, delay, function):
+        '''Calls the function after the delay on the event loop.'''
+        self._loop.call_soon_threadsafe(self._loop.call_later, delay, function)
+
+    def _connection_lost(self, exc):
+        '''Called by the protocol when the connection to the panel is gone.'''
+        self._transport = None
+        if self._requests_queued is not None:
+            self._requests_queued.set() #The writer stops, requests stay queued
+        if not self._shutdown:
+            _LOGGER.error('Connection to Paradox lost: %s', exc)
@@ -0,0 +1,79 @@
+'''
+Coalesces alarm state changes into batches for clients that prefer one callback
+per time window over one callback per message.
+'''
+
+import logging
+import threading
+from pyparadox_alarm.alarm_state import status_dict
+
+_LOGGER = logging.getLogger(__name__)
+
+COALESCE_WINDOW = 0.25 #Seconds
+
+class ParadoxChangeBatcher:
+    '''
+    Collects status changes of zones and partitions and delivers them as one list
+    of (entity, old status, new status) deltas per window, where entity is
+    ('zone', number) or ('partition', number) and the statuses are dictionaries.
+    Repeated changes of an entity within the window are folded into one delta
+    from its status before the window to its latest status, and an entity that
+    ends the window as it started is left out. The alarm state itself is always
+    updated straight away, only the notification is delayed.
+    A window of 0 delivers every change on its own, straight away.
+    The schedule function is called with (delay, function) to flush the window.
+    '''
+    def __init__(self, callback, window, schedule):
+        self._callback = callback
+        self._window = window
+        self._schedule = schedule
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._scheduled = False
+        self.batches = 0
+
+    @property
+    def callback(self):
+        '''Returns the function the batches are delivered to.'''
+        return self._callback
+
+    @property
+    def window(self):
+        '''Returns the time changes are collected before they are delivered.'''
+        return self._window
+
+    def changed(self, kind, number, old_flags, new_flags):
+        '''Notes a status change, as CompactAlarmState.on_change.'''
+        if self._window <= 0:
+            self._deliver([((kind, number), old_flags, new_flags)])
+            return
+        _key = (kind, number)
+        with self._lock:
+            _delta = self._pending.get(_key)
+            if _delta is None:
+                self._pending[_key] = [old_flags, new_flags]
+            else:
+                _delta[1] = new_flags
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._schedule(self._window, self.flush)
+
+    def flush(self):
+        '''Delivers the changes collected so far.'''
+        with self._lock:
+            _pending = self._pending
+            self._pending = {}
+            self._scheduled = False
+        _deltas = [(key, old, new) for key, (old, new) in _pending.items() if old != new]
+        if _deltas:
+            self._deliver(_deltas)
+
+    def _deliver(self, deltas):
+        '''Calls the client with the deltas as dictionaries.'''
+        self.batches += 1
+        try:
+            self._callback([(key, status_dict(key[0], old), status_dict(key[0], new))
+                            for key, old, new in deltas])
+        except Exception: #pylint: disable=broad-except
+            _LOGGER.exception('State change callback failed.')
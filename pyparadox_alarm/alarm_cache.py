@@ -0,0 +1,87 @@
+'''
+Keeps a snapshot of the alarm state on disk so a restart does not have to wait
+for every label and status to be requested from the panel again.
+'''
+
+import json
+import logging
+import os
+import re
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+CACHE_FORMAT = 1
+LABEL_TTL = 7 * 24 * 3600 #Revalidate labels older than a week
+
+class ParadoxStateCache:
+    '''
+    Saves and loads the alarm state of a panel as a JSON dictionary.
+    A snapshot is only used for the port and model it was taken from. The time
+    every label was last confirmed by the panel is kept with it, so labels can
+    be revalidated once they are older than the time to live.
+    '''
+    def __init__(self, cache_dir, port, paradox_model, label_ttl=LABEL_TTL):
+        _port = re.sub(r'[^A-Za-z0-9]+', '_', str(port)).strip('_')
+        self._path = os.path.join(cache_dir,
+                                  str.format('pyparadox_{0}_{1}.json', paradox_model, _port))
+        self._port = port
+        self._paradox_model = paradox_model
+        self._label_ttl = label_ttl
+        self._label_times = {'zone': {}, 'partition': {}}
+
+    @property
+    def path(self):
+        '''Returns the file the snapshot is kept in.'''
+        return self._path
+
+    def label_updated(self, kind, number):
+        '''Notes that a zone or partition label was just received from the panel.'''
+        self._label_times[kind][number] = time.time()
+
+    def stale_labels(self, kind, numbers):
+        '''Returns the zone or partition numbers whose label needs revalidating.'''
+        _oldest = time.time() - self._label_ttl
+        _times = self._label_times[kind]
+        return [number for number in numbers if _times.get(number, 0) < _oldest]
+
+    def load(self, alarm_state):
+        '''
+        Copies the cached labels and statuses into the (compact) alarm state.
+        Returns True if a snapshot for this panel was found.
+        '''
+        try:
+            with open(self._path, 'r') as cache_file:
+                _snapshot = json.load(cache_file)
+        except (OSError, ValueError) as err:
+            _LOGGER.debug('No usable state snapshot in %s: %s', self._path, err)
+            return False
+        if (_snapshot.get('format') != CACHE_FORMAT or _snapshot.get('port') != self._port
+                or _snapshot.get('model') != self._paradox_model):
+            _LOGGER.info('Ignoring state snapshot %s taken from another panel.', self._path)
+            return False
+        alarm_state.load_dict(_snapshot['alarm_state'])
+        for kind in ['zone', 'partition']:
+            self._label_times[kind] = {int(number): label_time for number, label_time
+                                       in _snapshot['label_times'].get(kind, {}).items()}
+        _LOGGER.info('Alarm state loaded from snapshot %s.', self._path)
+        return True
+
+    def save(self, alarm_state):
+        '''Writes the alarm state to the snapshot file (atomically).'''
+        _snapshot = {'format': CACHE_FORMAT,
+                     'port': self._port,
+                     'model': self._paradox_model,
+                     'saved': time.time(),
+                     'label_times': self._label_times,
+                     'alarm_state': alarm_state.to_dict()}
+        _temp_path = self._path + '.tmp'
+        try:
+            with open(_temp_path, 'w') as cache_file:
+                json.dump(_snapshot, cache_file)
+            os.replace(_temp_path, self._path)
+        except (OSError, TypeError, ValueError) as err:
+            _LOGGER.error('Unable to save state snapshot %s: %s', self._path, err)
+            return False
+        _LOGGER.debug('Alarm state saved to snapshot %s.', self._path)
+        return True
@@ -0,0 +1,220 @@
+'''
+Runs client callbacks on a pool of worker threads instead of the decoding thread.
+
+Callbacks of the same zone or area run one at a time, in the order they were
+submitted; callbacks of different entities run in parallel. Every entity has a
+bounded queue and an overflow policy decides what happens when it is full:
+block the decoder until there is room, drop the oldest callback waiting, or
+coalesce the callback with an identical one already waiting (the callbacks get
+the zone/area number and read its current status, so one call brings the
+client up to date).
+'''
+
+import logging
+import threading
+import time
+from collections import deque
+
+_LOGGER = logging.getLogger(__name__)
+
+CALLBACK_WORKERS = 4
+CALLBACK_QUEUE_SIZE = 64 #Callbacks waiting per zone/area
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_COALESCE = 'coalesce'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
+
+class _PendingCallback:
+    '''A callback waiting for a worker.'''
+    __slots__ = ['slot', 'callback', 'number', 'queued']
+
+    def __init__(self, slot, callback, number, queued):
+        self.slot = slot
+        self.callback = callback
+        self.number = number
+        self.queued = queued
+
+class ParadoxCallbackExecutor:
+    '''
+    Calls callback(number) on worker threads, in order per key (an entity such
+    as ('zone', 5)). With the coalesce policy a callback is not queued again
+    while the same callback of the entity is still waiting; when an entity's
+    queue is full anyway the oldest callback is dropped. The lag (time from
+    submit() until the callback starts) is kept and, given metrics, observed as
+    callback_lag_seconds.
+    '''
+    def __init__(self, workers=CALLBACK_WORKERS, queue_size=CALLBACK_QUEUE_SIZE,
+                 overflow=OVERFLOW_BLOCK, metrics=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(str.format('Unknown overflow policy {0}, use one of {1}.',
+                                        overflow, ', '.join(OVERFLOW_POLICIES)))
+        self._workers = max(1, workers)
+        self._queue_size = max(1, queue_size)
+        self._overflow = overflow
+        self._metrics = metrics
+        self._lock = threading.Condition()
+        self._pending = {} #Key -> deque of _PendingCallback
+        self._ready = deque() #Keys with callbacks waiting and no worker running them
+        self._running = set() #Keys a worker is running a callback of
+        self._queued = 0
+        self._threads = []
+        self._stopped = True
+        self.dropped = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._lag_last = 0.0
+        self._lag_max = 0.0
+        self._lag_total = 0.0
+        self._lag_count = 0
+
+    @property
+    def overflow(self):
+        '''Returns the overflow policy.'''
+        return self._overflow
+
+    def qsize(self):
+        '''Returns the number of callbacks waiting.'''
+        return self._queued
+
+    @property
+    def lag(self):
+        '''Returns the time (in seconds) callbacks waited for a worker.'''
+        with self._lock:
+            _count = self._lag_count
+            return {'count': _count,
+                    'last': self._lag_last,
+                    'max': self._lag_max,
+                    'average': (self._lag_total / _count) if _count else 0.0,
+                    'waiting': self._queued,
+                    'dropped': self.dropped,
+                    'coalesced': self.coalesced}
+
+    def start(self):
+        '''Starts the worker threads.'''
+        with self._lock:
+            if not self._stopped:
+                return
+            self._stopped = False
+            self._threads = [threading.Thread(target=self._work, daemon=True,
+                                              name=str.format('ParadoxCallbacks-{0}', i))
+                             for i in range(self._workers)]
+        for _thread in self._threads:
+            _thread.start()
+
+    def stop(self, timeout=1.0):
+        '''
+        Lets the workers finish the callbacks waiting (for up to timeout seconds)
+        and stops them. Callbacks still waiting after that are dropped.
+        '''
+        _deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._queued and not self._stopped:
+                _remaining = _deadline - time.monotonic()
+                if _remaining <= 0:
+                    break
+                self._lock.wait(_remaining)
+            self._stopped = True
+            if self._queued:
+                _LOGGER.warning('Dropping %d callbacks not run before the stop.', self._queued)
+                self.dropped += self._queued
+            self._pending.clear()
+            self._ready.clear()
+            self._queued = 0
+            self._lock.notify_all()
+        for _thread in self._threads:
+            if _thread is not threading.current_thread():
+                _thread.join(max(0.0, _deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, key, slot, callback, number):
+        '''
+        Queues callback(number) behind the callbacks waiting for the same key,
+        slot names the callback in the metrics. Returns False if it was coalesced
+        or could not be queued.
+        '''
+        _now = time.monotonic()
+        with self._lock:
+            if self._stopped:
+                return False
+            _waiting = self._pending.get(key)
+            if _waiting is None:
+                _waiting = self._pending[key] = deque()
+                if key not in self._running:
+                    self._ready.append(key)
+            elif self._overflow == OVERFLOW_COALESCE:
+                for _item in _waiting:
+                    if _item.callback == callback and _item.number == number:
+                        self.coalesced += 1
+                        return False
+            while len(_waiting) >= self._queue_size:
+                if self._overflow != OVERFLOW_BLOCK:
+                    _waiting.popleft()
+                    self._queued -= 1
+                    self.dropped += 1
+                    if self._metrics is not None:
+                        self._metrics.inc('callbacks_dropped', label=slot)
+                    continue
+                if threading.current_thread() in self._threads:
+                    _LOGGER.error('Callback queue of %s full, not blocking a callback.', key)
+                    return False
+                self._lock.wait()
+                if self._stopped:
+                    return False
+                _waiting = self._pending.get(key)
+                if _waiting is None: #Emptied and removed while we waited
+                    _waiting = self._pending[key] = deque()
+                    if key not in self._running:
+                        self._ready.append(key)
+            _waiting.append(_PendingCallback(slot, callback, number, _now))
+            self._queued += 1
+            self._lock.notify_all()
+            return True
+
+    def _work(self):
+        '''Runs the callbacks of ready keys, one key at a time (as thread).'''
+        while True:
+            with self._lock:
+                while not self._ready and not self._stopped:
+                    self._lock.wait()
+                if self._stopped:
+                    return
+                _key = self._ready.popleft()
+                _waiting = self._pending[_key]
+                _item = _waiting.popleft()
+                if not _waiting:
+                    del self._pending[_key]
+                self._queued -= 1
+                self._running.add(_key)
+                self._lock.notify_all() #Room for a blocked submit()
+            self._run(_item)
+            with self._lock:
+                self._running.discard(_key)
+                if _key in self._pending:
+                    self._ready.append(_key)
+                    self._lock.notify_all()
+                elif not self._queued:
+                    self._lock.notify_all() #For stop()
+
+    def _run(self, item):
+        '''Runs a callback, noting its lag.'''
+        _start = time.monotonic()
+        _lag = _start - item.queued
+        with self._lock: #Several workers note their lag
+            self._lag_last = _lag
+            self._lag_total += _lag
+            self._lag_count += 1
+            if _lag > self._lag_max:
+                self._lag_max = _lag
+        _metrics = self._metrics
+        if _metrics is not None:
+            _metrics.observe('callback_lag_seconds', _lag, item.slot)
+        try:
+            if _metrics is not None and _metrics.sample('callback_seconds'):
+                _start = time.perf_counter()
+                item.callback(item.number)
+                _metrics.observe('callback_seconds', time.perf_counter() - _start, item.slot)
+            else:
+                item.callback(item.number)
+        except Exception: #pylint: disable=broad-except
+            self.failed += 1
+            _LOGGER.exception('Callback %s for %s failed.', item.slot, item.number)
@@ -0,0 +1,177 @@
+'''
+Finds out what is on the other end of the PRT3 and which zones and areas are in use.
+
+The speed of a serial port is found by sending a status request at every speed
+the PRT3 supports until one is answered. The model follows from the highest
+zone and area the panel accepts: a status request beyond the limits of the
+panel is answered with &fail. Zones and areas count as enrolled when their
+label was changed from the default ("Zone 012", "Area 1"); the labels are
+requested a window at a time and the search stops max_gap numbers after the
+last enrolled one, or at the first number the panel does not have.
+With fixed pacing a request only goes out interval seconds after the one in
+front of it, so every request waits the timeout plus the pacing of the
+requests queued ahead of it.
+'''
+
+import logging
+import re
+import time
+from collections import deque, namedtuple
+from pyparadox_alarm.paradox_defaults import PARADOX_MODELS
+from pyparadox_alarm.alarm_requests import ParadoxRequestFailed, ParadoxRequestTimeout
+from pyparadox_alarm.alarm_transport import SerialTransport, parse_socket_port
+
+_LOGGER = logging.getLogger(__name__)
+
+PRT3_SPEEDS = (57600, 19200, 9600, 2400) #Fastest first
+PROBE_REQUEST = b'RA001\r'
+PROBE_TIMEOUT = 0.5 #Seconds to wait for the reply at each speed
+DISCOVERY_WINDOW = 16 #Label requests in flight at a time
+DISCOVERY_TIMEOUT = 5 #Seconds to wait for each reply
+MAX_GAP = 32 #Unused numbers after the last enrolled one before the search stops
+_DEFAULT_LABEL = re.compile(r'^(zone|area)\s*0*\d+$', re.IGNORECASE)
+
+DiscoveryResult = namedtuple('DiscoveryResult', ['model', 'zones', 'areas'])
+
+def is_default_label(label):
+    '''Returns True for the label a zone or area has until it is programmed.'''
+    return bool(_DEFAULT_LABEL.match(label.strip()))
+
+def probe_speed(port, speeds=PRT3_SPEEDS, timeout=PROBE_TIMEOUT):
+    '''
+    Returns the first speed at which the PRT3 on a serial port answers a status
+    request, None if it answers at none (or the port is a TCP bridge, which has
+    its own speed setting).
+    '''
+    if parse_socket_port(port) is not None:
+        return None
+    for _speed in speeds:
+        _transport = SerialTransport(port, _speed, timeout=timeout)
+        try:
+            _transport.open()
+            _transport.flush_input()
+            _transport.write(PROBE_REQUEST)
+            _received = b''
+            _deadline = time.monotonic() + timeout
+            while time.monotonic() < _deadline and PROBE_REQUEST[:5] not in _received:
+                _received += _transport.read()
+        except OSError as err:
+            _LOGGER.warning('Unable to probe %s at %d baud: %s', port, _speed, err)
+            continue
+        finally:
+            _transport.close()
+        if PROBE_REQUEST[:5] in _received:
+            _LOGGER.info('PRT3 on %s answers at %d baud.', port, _speed)
+            return _speed
+    return None
+
+def _result(request, future, cancel):
+    '''
+    Returns the reply to a request, None if it was answered with &fail. Raises
+    ParadoxRequestTimeout if it was not answered, after cancelling it if it is
+    still queued.
+    '''
+    try:
+        return future.result()
+    except ParadoxRequestFailed:
+        return None
+    except ParadoxRequestTimeout:
+        if cancel is not None:
+            cancel(request)
+        raise
+
+def discover_model(request, timeout=DISCOVERY_TIMEOUT, interval=0, cancel=None):
+    '''
+    Returns the name of the model, found by requesting the status of the highest
+    zone and area of every model at once. request(request, timeout, retries)
+    returns a future for the reply, as ParadoxAlarmPanel.request() does, and
+    cancel(request) drops a request still queued. interval is the fixed pacing
+    of the requests (0: paced by the replies).
+    Raises OSError if the panel does not answer a status request in time or
+    answers none of them.
+    '''
+    _zone_limits = sorted({model['max zones'] for model in PARADOX_MODELS.values()})
+    _area_limits = sorted({model['max areas'] for model in PARADOX_MODELS.values()})
+    _requests = ([('RZ' + str(limit).zfill(3), limit) for limit in _zone_limits] +
+                 [('RA' + str(limit).zfill(3), limit) for limit in _area_limits])
+    _futures = [request(_request, timeout + _position * interval, 0)
+                for _position, (_request, _) in enumerate(_requests)]
+    _answered = set()
+    for (_request, _limit), _future in zip(_requests, _futures):
+        try:
+            if _result(_request, _future, cancel) is not None:
+                _answered.add((_request[:2], _limit))
+        except ParadoxRequestTimeout as err:
+            raise OSError(str.format('The panel did not answer {0} in time.', _request)) from err
+    _max_zones = max((limit for limit in _zone_limits if ('RZ', limit) in _answered),
+                     default=None)
+    _max_areas = max((limit for limit in _area_limits if ('RA', limit) in _answered),
+                     default=None)
+    if _max_zones is None:
+        raise OSError('The panel did not answer any zone status request.')
+    _candidates = [name for name, model in PARADOX_MODELS.items()
+                   if model['max zones'] == _max_zones]
+    _model = next((name for name in _candidates
+                   if PARADOX_MODELS[name]['max areas'] == _max_areas), _candidates[0])
+    _LOGGER.info('Discovered a %s (%d zones, %s areas).', _model, _max_zones, _max_areas)
+    return _model
+
+def discover_enrolled(request, command, maximum, window=DISCOVERY_WINDOW, max_gap=MAX_GAP,
+                      timeout=DISCOVERY_TIMEOUT, interval=0, cancel=None):
+    '''
+    Returns the numbers up to maximum whose label (command 'ZL' or 'AL') is not
+    the default one, keeping window label requests in flight. Stops max_gap
+    numbers after the last enrolled one (None: never) or at a number the panel
+    does not have. A label not read in time counts as enrolled: it may well be.
+    '''
+    _enrolled = []
+    _last = 0
+    _next = 1
+    _in_flight = deque()
+    while True:
+        while (len(_in_flight) < window and _next <= maximum and
+               (max_gap is None or _next - _last <= max_gap)):
+            _request = command + str(_next).zfill(3)
+            _in_flight.append((_next, _request, request(
+                _request, timeout + len(_in_flight) * interval, 0)))
+            _next += 1
+        if not _in_flight:
+            break
+        _number, _request, _future = _in_flight.popleft()
+        try:
+            _reply = _result(_request, _future, cancel)
+        except ParadoxRequestTimeout:
+            _LOGGER.warning('No label for %s in time, taken as enrolled.', _request)
+            if _number <= maximum:
+                _enrolled.append(_number)
+                _last = max(_last, _number)
+            continue
+        if _reply is None:
+            maximum = min(maximum, _number - 1) #Beyond what the panel has
+            continue
+        if _number <= maximum and not is_default_label(_reply[5:]):
+            _enrolled.append(_number)
+            _last = max(_last, _number)
+    _LOGGER.info('%d of %d %s labels programmed.', len(_enrolled), min(maximum, _next - 1),
+                 'zone' if command == 'ZL' else 'area')
+    return _enrolled
+
+def discover(request, paradox_model=None, window=DISCOVERY_WINDOW, max_gap=MAX_GAP,
+             timeout=DISCOVERY_TIMEOUT, interval=0, cancel=None):
+    '''
+    Returns a DiscoveryResult with the model (discovered unless given) and the
+    enrolled zones and areas. Areas are few and often keep their default label,
+    so all areas up to the last programmed one count as enrolled. When no label
+    was programmed at all, every zone (or area) of the model is taken as enrolled.
+    See discover_model() for request, interval and cancel.
+    '''
+    if paradox_model is None:
+        paradox_model = discover_model(request, timeout, interval, cancel)
+    _model = PARADOX_MODELS[paradox_model]
+    _zones = discover_enrolled(request, 'ZL', _model['max zones'], window, max_gap, timeout,
+                               interval, cancel)
+    _areas = discover_enrolled(request, 'AL', _model['max areas'], window, None, timeout,
+                               interval, cancel)
+    return DiscoveryResult(paradox_model,
+                           tuple(_zones) or tuple(range(1, _model['max zones'] + 1)),
+                           tuple(range(1, (_areas[-1] if _areas else _model['max areas']) + 1)))
@@ -0,0 +1,554 @@
+'''
+Shares one panel connection with many local consumers.
+
+ParadoxFanoutServer owns a ParadoxAlarmPanel (and with it the serial link) and
+publishes every decoded message and every change of the alarm state over a Unix
+or TCP socket to any number of subscribers. Subscribers may also send requests,
+which go through the priority scheduler of the panel. A request identical to
+one that is still queued or awaiting its reply is not submitted again, so the
+number of subscribers does not add serial traffic.
+
+Frames are a 3 byte header (type, payload length) and a little-endian payload:
+  MESSAGE   time (double) + the message as received (ascii)
+  STATUS    version, kind (0 zone, 1 area), number, status bits
+  NAME      version, kind, number + name (utf-8)
+  FAULT     version, zone number, time of the last fault (double)
+  SNAPSHOT  version, zones, areas, status bits of all zones and areas, the
+            times of the last faults and the names (each prefixed by its length)
+  REQUEST   priority (255: by command) + request (ascii), subscriber to server
+Every subscriber has a bounded buffer. A subscriber that falls behind so far
+that its buffer overflows loses what was buffered and gets a new snapshot
+instead, state changes up to its version are then to be ignored.
+'''
+
+import argparse
+import logging
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+from array import array
+from collections import deque, namedtuple
+from struct import Struct
+from pyparadox_alarm.alarm_flow_control import reply_key
+from pyparadox_alarm.alarm_requests import REQUEST_TIMEOUT
+from pyparadox_alarm.alarm_scheduler import PRIORITY_NAMES
+from pyparadox_alarm.alarm_state import AlarmStateSnapshot, status_dict
+from pyparadox_alarm.alarm_transport import parse_socket_port
+
+_LOGGER = logging.getLogger(__name__)
+
+HEADER = Struct('<BH')
+FRAME_MESSAGE = 1
+FRAME_STATUS = 2
+FRAME_NAME = 3
+FRAME_FAULT = 4
+FRAME_SNAPSHOT = 5
+FRAME_REQUEST = 6
+MESSAGE = Struct('<d')
+STATUS = Struct('<IBHL')
+NAME = Struct('<IBH')
+FAULT = Struct('<IHd')
+SNAPSHOT = Struct('<IHH')
+REQUEST = Struct('<B')
+DEFAULT_PRIORITY = 255
+KINDS = ('zone', 'partition')
+BUFFER_SIZE = 1024 #Frames buffered per subscriber
+MAX_REQUEST = 32 #Longest request accepted from a subscriber
+MAX_IN_FLIGHT = 256 #Requests remembered to merge identical ones
+
+StatusChange = namedtuple('StatusChange', ['version', 'kind', 'number', 'status'])
+NameChange = namedtuple('NameChange', ['version', 'kind', 'number', 'name'])
+FaultChange = namedtuple('FaultChange', ['version', 'number', 'last_fault'])
+Message = namedtuple('Message', ['time', 'message'])
+
+def encode_frame(frame_type, payload):
+    '''Returns a frame with its header.'''
+    return HEADER.pack(frame_type, len(payload)) + payload
+
+def encode_message(message, timestamp):
+    '''Returns a MESSAGE frame.'''
+    return encode_frame(FRAME_MESSAGE, MESSAGE.pack(timestamp) +
+                        message.encode('ascii', 'replace'))
+
+def encode_change(change):
+    '''Returns the frame of a raw change as returned by changes_since(version, raw=True).'''
+    _version, (_kind, _number), _field, _value = change
+    if _field == 'status':
+        return encode_frame(FRAME_STATUS, STATUS.pack(_version, KINDS.index(_kind), _number,
+                                                      _value))
+    if _field == 'name':
+        return encode_frame(FRAME_NAME, NAME.pack(_version, KINDS.index(_kind), _number) +
+                            (_value or '').encode('utf-8'))
+    return encode_frame(FRAME_FAULT, FAULT.pack(_version, _number, _value or 0))
+
+def _encode_names(names):
+    '''Returns the names, each prefixed by its length.'''
+    _payload = bytearray()
+    for _name in names:
+        _encoded = _name.encode('utf-8')[:255]
+        _payload.append(len(_encoded))
+        _payload += _encoded
+    return _payload
+
+def encode_snapshot(snapshot):
+    '''Returns the SNAPSHOT frame of an AlarmStateSnapshot.'''
+    _payload = bytearray(SNAPSHOT.pack(snapshot.version, snapshot.max_zones,
+                                       snapshot.max_partitions))
+    _zone_flags = array('H', snapshot.zone_flags)
+    _partition_flags = array('I', snapshot.partition_flags) #Fixed 4 bytes, 'L' may be 8
+    _faults = array('d', (snapshot.zone_last_fault(i) or 0
+                          for i in range(snapshot.max_zones + 1)))
+    if sys.byteorder != 'little':
+        for _array in (_zone_flags, _partition_flags, _faults):
+            _array.byteswap()
+    _payload += _zone_flags.tobytes()
+    _payload += _partition_flags.tobytes()
+    _payload += _faults.tobytes()
+    _payload += _encode_names(snapshot.zone_name(i) for i in range(snapshot.max_zones + 1))
+    _payload += _encode_names(snapshot.partition_name(i)
+                              for i in range(snapshot.max_partitions + 1))
+    return encode_frame(FRAME_SNAPSHOT, bytes(_payload))
+
+def encode_request(request, priority=None):
+    '''Returns a REQUEST frame.'''
+    return encode_frame(FRAME_REQUEST, REQUEST.pack(DEFAULT_PRIORITY if priority is None
+                                                    else priority) + request.encode('ascii'))
+
+def _decode_names(payload, offset, count):
+    '''Returns the names starting at offset and the offset after them.'''
+    _names = []
+    for _ in range(count):
+        _length = payload[offset]
+        _names.append(bytes(payload[offset + 1:offset + 1 + _length]).decode('utf-8', 'replace'))
+        offset += 1 + _length
+    return tuple(_names), offset
+
+def decode_snapshot(payload):
+    '''Returns the AlarmStateSnapshot of a SNAPSHOT payload.'''
+    _version, _zones, _areas = SNAPSHOT.unpack_from(payload)
+    _offset = SNAPSHOT.size
+    _arrays = []
+    for _typecode, _count in (('H', _zones + 1), ('I', _areas + 1), ('d', _zones + 1)):
+        _array = array(_typecode)
+        _size = _array.itemsize * _count
+        _array.frombytes(bytes(payload[_offset:_offset + _size]))
+        if sys.byteorder != 'little':
+            _array.byteswap()
+        _arrays.append(_array)
+        _offset += _size
+    _zone_names, _offset = _decode_names(payload, _offset, _zones + 1)
+    _partition_names, _offset = _decode_names(payload, _offset, _areas + 1)
+    return AlarmStateSnapshot(_version, _arrays[0], array('L', _arrays[1]), _zone_names,
+                              _partition_names, tuple(_arrays[2]))
+
+def decode_frame(frame_type, payload):
+    '''
+    Returns a published frame as Message, StatusChange (with the status as a
+    dictionary), NameChange, FaultChange or AlarmStateSnapshot.
+    '''
+    if frame_type == FRAME_MESSAGE:
+        return Message(MESSAGE.unpack_from(payload)[0],
+                       bytes(payload[MESSAGE.size:]).decode('ascii', 'replace'))
+    if frame_type == FRAME_STATUS:
+        _version, _kind, _number, _bits = STATUS.unpack(payload)
+        return StatusChange(_version, KINDS[_kind], _number, status_dict(KINDS[_kind], _bits))
+    if frame_type == FRAME_NAME:
+        _version, _kind, _number = NAME.unpack_from(payload)
+        return NameChange(_version, KINDS[_kind], _number,
+                          bytes(payload[NAME.size:]).decode('utf-8', 'replace'))
+    if frame_type == FRAME_FAULT:
+        return FaultChange(*FAULT.unpack(payload))
+    if frame_type == FRAME_SNAPSHOT:
+        return decode_snapshot(payload)
+    raise ValueError(str.format('Unknown frame type {0}.', frame_type))
+
+def split_frames(buffer):
+    '''
+    Returns [(type, payload), ...] for the complete frames in the buffer (a
+    bytearray) and removes them from it.
+    '''
+    _frames = []
+    _offset = 0
+    _length = len(buffer)
+    with memoryview(buffer) as _view:
+        while _length - _offset >= HEADER.size:
+            _type, _size = HEADER.unpack_from(_view, _offset)
+            _end = _offset + HEADER.size + _size
+            if _end > _length:
+                break
+            _frames.append((_type, bytes(_view[_offset + HEADER.size:_end])))
+            _offset = _end
+    del buffer[:_offset]
+    return _frames
+
+
+class _Subscriber:
+    '''A connected subscriber with the frames waiting to be sent to it.'''
+    __slots__ = ['socket', 'name', 'frames', 'sending', 'received', 'resync', 'dropped',
+                 'events']
+
+    def __init__(self, sock, name):
+        self.socket = sock
+        self.name = name
+        self.frames = deque()
+        self.sending = None #Memoryview of the frame being sent
+        self.received = bytearray()
+        self.resync = True #Send a snapshot first
+        self.dropped = 0
+        self.events = selectors.EVENT_READ
+
+
+class ParadoxFanoutServer:
+    '''
+    Publishes the messages and state changes of the panel to the subscribers
+    connected to address: a "socket://host:port" url or the path of a Unix socket.
+    start() starts the panel too and stop() stops it.
+    '''
+    def __init__(self, panel, address, buffer_size=BUFFER_SIZE):
+        self._panel = panel
+        self._address = address
+        self._buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._selector = None
+        self._listener = None
+        self._wakeup_reader = None
+        self._wakeup_writer = None
+        self._woken = False
+        self._thread = None
+        self._stopped = True
+        self._version = 0
+        self._in_flight = {} #Reply key -> (request, deadline) of the requests submitted
+        self.published = 0
+        self.requests = 0
+        self.merged = 0
+
+    @property
+    def panel(self):
+        '''Returns the panel shared by the subscribers.'''
+        return self._panel
+
+    @property
+    def address(self):
+        '''Returns the address subscribers connect to (with the port picked for port 0).'''
+        if isinstance(self._listener.getsockname(), tuple):
+            return str.format('socket://{0}:{1}', *self._listener.getsockname()[:2])
+        return self._address
+
+    @property
+    def subscribers(self):
+        '''Returns the number of subscribers connected.'''
+        return len(self._subscribers)
+
+    def start(self):
+        '''Starts listening for subscribers and starts the panel.'''
+        _address = parse_socket_port(self._address)
+        if _address is not None:
+            self._listener = socket.create_server(_address)
+        else:
+            if os.path.exists(self._address):
+                os.remove(self._address) #Left by a previous run
+            self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._listener.bind(self._address)
+            self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._stopped = False
+        self._version = self._panel.state_version
+        self._panel.add_listener(self._publish)
+        self._thread = threading.Thread(target=self._serve, daemon=True,
+                                        name='ParadoxFanoutServer')
+        self._thread.start()
+        self._panel.start()
+        _LOGGER.info('Publishing the panel on %s.', self.address)
+
+    def stop(self):
+        '''Stops the panel, disconnects the subscribers and stops listening.'''
+        self._panel.stop()
+        self._panel.remove_listener(self._publish)
+        self._stopped = True
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(1)
+            self._thread = None
+        for _subscriber in list(self._subscribers.values()):
+            self._disconnect(_subscriber)
+        self._selector.close()
+        self._listener.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+        if parse_socket_port(self._address) is None:
+            try:
+                os.remove(self._address)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _publish(self, message):
+        '''Queues a decoded message and the state changes it made for every subscriber.'''
+        _frames = [encode_message(message, time.time())]
+        _version, _changes = self._panel.changes_since(self._version, raw=True)
+        with self._lock:
+            if self._in_flight and message[:1] != 'G':
+                self._in_flight.pop(reply_key(message), None)
+            if _changes is None: #Too many changes at once, everyone starts over
+                for _subscriber in self._subscribers.values():
+                    self._overflow(_subscriber)
+            else:
+                _frames.extend(encode_change(_change) for _change in _changes)
+            self._version = _version
+            for _subscriber in self._subscribers.values():
+                if _subscriber.resync:
+                    continue #Its snapshot covers the changes
+                _subscriber.frames.extend(_frames)
+                if len(_subscriber.frames) > self._buffer_size:
+                    self._overflow(_subscriber)
+            self.published += len(_frames)
+            _wake = self._subscribers and not self._woken
+            self._woken = True
+        if _wake:
+            self._wake()
+
+    def _overflow(self, subscriber):
+        '''Replaces the frames of a subscriber that fell behind by a snapshot (lock held).'''
+        if not subscriber.resync:
+            _LOGGER.warning('Subscriber %s fell behind, it gets a new snapshot.', subscriber.name)
+        subscriber.dropped += len(subscriber.frames)
+        subscriber.frames.clear()
+        subscriber.resync = True
+
+    def _wake(self):
+        '''Wakes the server thread up.'''
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError: #Already woken, or closed by stop()
+            pass
+
+    def _serve(self):
+        '''Accepts subscribers, reads their requests and sends them their frames (as thread).'''
+        while not self._stopped:
+            for _key, _events in self._selector.select():
+                _fileobj = _key.fileobj
+                if _fileobj is self._wakeup_reader:
+                    try:
+                        self._wakeup_reader.recv(4096)
+                    except OSError:
+                        pass
+                elif _fileobj is self._listener:
+                    self._accept()
+                else:
+                    self._serve_subscriber(_key.data, _events)
+            if self._stopped:
+                break
+            with self._lock:
+                self._woken = False
+            for _subscriber in list(self._subscribers.values()):
+                if _subscriber.sending is None and (_subscriber.frames or _subscriber.resync):
+                    self._serve_subscriber(_subscriber, selectors.EVENT_WRITE)
+
+    def _serve_subscriber(self, subscriber, events):
+        '''Reads from and/or sends to a subscriber, dropping it if that fails.'''
+        try:
+            if events & selectors.EVENT_READ:
+                self._read(subscriber)
+            if events & selectors.EVENT_WRITE and subscriber.socket is not None:
+                self._send(subscriber)
+        except Exception: #pylint: disable=broad-except
+            _LOGGER.exception('Serving subscriber %s failed, disconnecting.', subscriber.name)
+            self._disconnect(subscriber)
+
+    def _accept(self):
+        '''Accepts a new subscriber.'''
+        try:
+            _socket, _address = self._listener.accept()
+        except OSError:
+            return
+        _socket.setblocking(False)
+        _subscriber = _Subscriber(_socket, str(_address or _socket.fileno()))
+        with self._lock:
+            self._subscribers[_socket.fileno()] = _subscriber
+        self._selector.register(_socket, selectors.EVENT_READ, _subscriber)
+        _LOGGER.info('Subscriber %s connected, %d in total.', _subscriber.name,
+                     len(self._subscribers))
+        self._send(_subscriber)
+
+    def _read(self, subscriber):
+        '''Reads requests from a subscriber and submits them to the panel.'''
+        try:
+            _data = subscriber.socket.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            _data = b''
+        if not _data:
+            self._disconnect(subscriber)
+            return
+        subscriber.received += _data
+        for _type, _payload in split_frames(subscriber.received):
+            _request = _payload[REQUEST.size:]
+            _priority = _payload[0] if _payload else None
+            if (_type != FRAME_REQUEST or not 0 < len(_request) <= MAX_REQUEST or
+                    not _request.isalnum() or
+                    not (_priority == DEFAULT_PRIORITY or _priority < len(PRIORITY_NAMES))):
+                _LOGGER.warning('Subscriber %s sent an invalid frame, disconnecting.',
+                                subscriber.name)
+                self._disconnect(subscriber)
+                return
+            self.requests += 1
+            self._submit(_request.decode('ascii'),
+                         None if _priority == DEFAULT_PRIORITY else _priority)
+
+    def _submit(self, request, priority):
+        '''Submits a request unless the same request is still waiting for its reply.'''
+        _now = time.monotonic()
+        _key = reply_key(request)
+        with self._lock:
+            _waiting = self._in_flight.get(_key)
+            if _waiting is not None and _waiting[0] == request and _waiting[1] > _now:
+                self.merged += 1
+                return
+            if len(self._in_flight) >= MAX_IN_FLIGHT: #Forget the requests never answered
+                self._in_flight = {key: waiting for key, waiting in self._in_flight.items()
+                                   if waiting[1] > _now}
+            self._in_flight[_key] = (request, _now + REQUEST_TIMEOUT)
+        self._panel.submit_request(request, priority)
+
+    def _send(self, subscriber):
+        '''Sends a subscriber what it can take without blocking.'''
+        _socket = subscriber.socket
+        while True:
+            if subscriber.sending is None:
+                with self._lock:
+                    if subscriber.resync:
+                        subscriber.resync = False
+                        subscriber.frames.clear()
+                        _frame = encode_snapshot(self._panel.snapshot())
+                    elif subscriber.frames:
+                        _frame = subscriber.frames.popleft()
+                    else:
+                        break
+                subscriber.sending = memoryview(_frame)
+            try:
+                _sent = _socket.send(subscriber.sending)
+            except BlockingIOError:
+                break
+            except OSError:
+                self._disconnect(subscriber)
+                return
+            subscriber.sending = subscriber.sending[_sent:]
+            if not subscriber.sending:
+                subscriber.sending = None
+        #Only wait for the socket to take more when something is left
+        _events = selectors.EVENT_READ
+        if subscriber.sending is not None:
+            _events |= selectors.EVENT_WRITE
+        if _events != subscriber.events:
+            subscriber.events = _events
+            self._selector.modify(_socket, _events, subscriber)
+
+    def _disconnect(self, subscriber):
+        '''Drops a subscriber.'''
+        if subscriber.socket is None:
+            return
+        with self._lock:
+            self._subscribers.pop(subscriber.socket.fileno(), None)
+        try:
+            self._selector.unregister(subscriber.socket)
+        except (KeyError, ValueError):
+            pass
+        subscriber.socket.close()
+        subscriber.socket = None
+        _LOGGER.info('Subscriber %s disconnected.', subscriber.name)
+
+
+class ParadoxFanoutClient:
+    '''
+    Subscribes to a ParadoxFanoutServer at address. read() returns the next
+    published frame, decoded (see decode_frame()); the first is a snapshot.
+    '''
+    def __init__(self, address, timeout=None):
+        self._address = address
+        self._timeout = timeout
+        self._socket = None
+        self._received = bytearray()
+        self._frames = deque()
+
+    def connect(self):
+        '''Connects to the server.'''
+        _address = parse_socket_port(self._address)
+        if _address is not None:
+            self._socket = socket.create_connection(_address, self._timeout)
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(self._timeout)
+            self._socket.connect(self._address)
+        return self
+
+    def close(self):
+        '''Disconnects from the server.'''
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit_request(self, request, priority=None):
+        '''Has the server submit a request to the panel.'''
+        self._socket.sendall(encode_request(request, priority))
+
+    def read(self):
+        '''
+        Returns the next frame, raises socket.timeout after the timeout and
+        ConnectionError when the server went away.
+        '''
+        while not self._frames:
+            _data = self._socket.recv(65536)
+            if not _data:
+                raise ConnectionError('Disconnected by the fan-out server.')
+            self._received += _data
+            self._frames.extend(split_frames(self._received))
+        return decode_frame(*self._frames.popleft())
+
+
+def main(argv=None):
+    '''Command line interface, serves a panel until interrupted.'''
+    from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel #pylint: disable=import-outside-toplevel
+    _parser = argparse.ArgumentParser(prog='python -m pyparadox_alarm.alarm_fanout',
+                                      description='Shares one PRT3 with many subscribers.')
+    _parser.add_argument('address', help='Unix socket path or socket://host:port to listen on')
+    _parser.add_argument('--port', default='/dev/ttyUSB0', help='serial port of the PRT3')
+    _parser.add_argument('--speed', type=int, default=57600)
+    _parser.add_argument('--model', default='EVO48')
+    _parser.add_argument('--adaptive-pacing', action='store_true')
+    _args = _parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    _panel = ParadoxAlarmPanel(_args.model, prt_port=_args.port, prt_speed=_args.speed,
+                               adaptive_pacing=_args.adaptive_pacing)
+    with ParadoxFanoutServer(_panel, _args.address):
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
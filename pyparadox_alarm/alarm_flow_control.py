@@ -0,0 +1,171 @@
+'''
+Paces requests to the Paradox alarm panel based on the replies it sends back.
+
+Every PRT3 request is answered with a message that starts with the same command
+and number, e.g. "ZL005" is answered by "ZL005Front door" and "AA001" by
+"AA001&ok" or "AA001&fail". Matching those replies to the requests in flight
+lets the next request go out as soon as the panel is ready for it rather than
+after a fixed sleep.
+'''
+
+import logging
+import threading
+import time
+from collections import deque
+
+_LOGGER = logging.getLogger(__name__)
+
+REPLY_KEY_LENGTH = 5 #Command (2 chars) + number (3 digits)
+BITS_PER_BYTE = 10 #8N1: start bit + 8 data bits + stop bit
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+
+def reply_key(message):
+    '''Returns the part of a request/reply used to match them together.'''
+    return message[:REPLY_KEY_LENGTH]
+
+class ParadoxFlowControl:
+    '''
+    Ack driven flow control for the request thread.
+    At most "window" requests are in flight at a time. The window grows by one
+    for every acknowledged request (up to max_in_flight) and is halved when a
+    request times out or fails. Writes are further limited by a token bucket
+    that never lets more bytes out than the baud rate can carry.
+    Round trip times are smoothed like TCP does and used for the ack timeout.
+    '''
+    def __init__(self, speed, max_in_flight=4, ack_timeout=3.0, min_ack_timeout=0.25):
+        self._lock = threading.Condition()
+        self._bytes_per_second = speed / BITS_PER_BYTE
+        self._bucket_size = max(64.0, self._bytes_per_second / 10)
+        self._tokens = self._bucket_size
+        self._refilled = time.monotonic()
+        self._max_in_flight = max(1, max_in_flight)
+        self._window = 1
+        self._in_flight = {}
+        self._in_flight_count = 0
+        self._max_ack_timeout = ack_timeout
+        self._min_ack_timeout = min_ack_timeout
+        self._srtt = None
+        self._rttvar = 0.0
+        self._closed = False
+        self.acknowledged = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    @property
+    def rtt(self):
+        '''Returns the smoothed round trip time in seconds (None until measured).'''
+        return self._srtt
+
+    @property
+    def window(self):
+        '''Returns the number of requests currently allowed in flight.'''
+        return self._window
+
+    @property
+    def in_flight(self):
+        '''Returns the number of requests waiting for a reply.'''
+        return self._in_flight_count
+
+    @property
+    def ack_timeout(self):
+        '''Returns how long to wait for a reply before giving up on a request.'''
+        if self._srtt is None:
+            return self._max_ack_timeout
+        return min(self._max_ack_timeout,
+                   max(self._min_ack_timeout, self._srtt + 4 * self._rttvar))
+
+    def close(self):
+        '''Releases any thread waiting in acquire().'''
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+
+    def reset(self):
+        '''Forgets the requests in flight (lost with the link) and starts over with a window of 1.'''
+        with self._lock:
+            self._in_flight.clear()
+            self._in_flight_count = 0
+            self._window = 1
+            self._lock.notify_all()
+
+    def acquire(self, request):
+        '''
+        Blocks until the request may be written and registers it as in flight.
+        Returns False if the flow control was closed in the mean time.
+        '''
+        _size = len(request) + 1
+        with self._lock:
+            while not self._closed:
+                _now = time.monotonic()
+                _wait = self._expire(_now)
+                if self._in_flight_count < self._window:
+                    self._refill(_now)
+                    if self._tokens >= _size:
+                        break
+                    _wait = (_size - self._tokens) / self._bytes_per_second
+                self._lock.wait(_wait)
+            else:
+                return False
+            self._tokens -= _size
+            self._in_flight.setdefault(reply_key(request), deque()).append(time.monotonic())
+            self._in_flight_count += 1
+            return True
+
+    def acknowledge(self, response):
+        '''
+        Matches a reply from the panel to a request in flight.
+        Returns True if the reply belonged to a request.
+        '''
+        _key = reply_key(response)
+        with self._lock:
+            _sent = self._in_flight.get(_key)
+            if not _sent:
+                return False
+            _rtt = time.monotonic() - _sent.popleft()
+            if not _sent:
+                del self._in_flight[_key]
+            self._in_flight_count -= 1
+            if response.endswith('&fail'):
+                self.failed += 1
+                self._window = max(1, self._window // 2)
+            else:
+                self.acknowledged += 1
+                self._window = min(self._max_in_flight, self._window + 1)
+            self._update_rtt(_rtt)
+            self._lock.notify_all()
+        return True
+
+    def _update_rtt(self, rtt):
+        '''Smooths the measured round trip time.'''
+        if self._srtt is None:
+            self._srtt = rtt
+            self._rttvar = rtt / 2
+        else:
+            self._rttvar += RTT_BETA * (abs(self._srtt - rtt) - self._rttvar)
+            self._srtt += RTT_ALPHA * (rtt - self._srtt)
+
+    def _refill(self, now):
+        '''Adds the tokens earned since the last refill.'''
+        self._tokens = min(self._bucket_size,
+                           self._tokens + (now - self._refilled) * self._bytes_per_second)
+        self._refilled = now
+
+    def _expire(self, now):
+        '''Gives up on requests without reply, returns the time until the next expiry.'''
+        _timeout = self.ack_timeout
+        _next = None
+        for _key in list(self._in_flight):
+            _sent = self._in_flight[_key]
+            while _sent and now - _sent[0] >= _timeout:
+                _sent.popleft()
+                self._in_flight_count -= 1
+                self.timed_out += 1
+                self._window = max(1, self._window // 2)
+                _LOGGER.debug('No reply to %s within %.2f s.', _key, _timeout)
+            if _sent:
+                _remaining = _timeout - (now - _sent[0])
+                _next = _remaining if _next is None else min(_next, _remaining)
+            else:
+                del self._in_flight[_key]
+        return _next
@@ -0,0 +1,59 @@
+'''
+Splits the raw byte stream received from a Paradox PRT3 module into messages.
+
+The PRT3 terminates every message with a carriage return, not a line feed, so
+messages are released the moment their terminator is seen rather than when a
+readline() times out.
+'''
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+FRAME_TERMINATOR = 0x0D #\r
+MAX_FRAME_LENGTH = 1024
+
+class ParadoxFramer:
+    '''
+    Incremental framer for PRT3 messages.
+    Bytes are appended to a single reusable buffer that is only compacted once
+    per feed(). All complete messages are decoded straight from a memoryview of
+    it in one go, so no regular expressions or per-message slicing is needed.
+    '''
+    def __init__(self, max_frame_length=MAX_FRAME_LENGTH):
+        self._buffer = bytearray()
+        self._scan_from = 0
+        self._max_frame_length = max_frame_length
+        self.frames = 0
+        self.dropped = 0
+
+    @property
+    def pending(self):
+        '''Returns the number of buffered bytes not yet part of a complete message.'''
+        return len(self._buffer)
+
+    def reset(self):
+        '''Throws away any partially received message, e.g. after a reconnect.'''
+        del self._buffer[:]
+        self._scan_from = 0
+
+    def feed(self, data):
+        '''Adds received bytes and returns the list of messages they completed.'''
+        _buffer = self._buffer
+        _buffer += data
+        _end = _buffer.rfind(FRAME_TERMINATOR, self._scan_from)
+        if _end < 0:
+            self._scan_from = len(_buffer)
+            if self._scan_from > self._max_frame_length:
+                _LOGGER.warning('Dropping %d bytes without message terminator.', self._scan_from)
+                self.dropped += 1
+                self.reset()
+            return []
+        #Decode everything up to the last terminator at once and split it in one pass
+        with memoryview(_buffer) as _view:
+            _text = str(_view[:_end], 'ascii', 'replace')
+        del _buffer[:_end + 1]
+        self._scan_from = len(_buffer)
+        _frames = [_frame for _frame in map(str.strip, _text.split('\r')) if _frame]
+        self.frames += len(_frames)
+        return _frames
@@ -0,0 +1,375 @@
+'''
+Append-only binary journal of every message decoded from the panel.
+
+Messages are stored as fixed-width records in segment files that are rotated
+by size. Records are buffered and written in batches, and at the latest
+batch_interval after they arrived. Queries memory-map the segments and keep an
+index of record numbers per zone and per area, so looking up the history of one
+zone only touches the records of that zone. The index of a segment is saved
+next to it once the segment is full (and when the reader closes), so the next
+process only indexes the records added since.
+'''
+
+import logging
+import mmap
+import os
+import threading
+import time
+from array import array
+from collections import namedtuple
+from struct import Struct, error as StructError
+
+_LOGGER = logging.getLogger(__name__)
+
+#Time, message type, event group, event/zone/area number, zone, area, status
+RECORD = Struct('<d2sBxHHH8s')
+NO_GROUP = 255 #Event group of replies, they are not system events
+SEGMENT_SIZE = 16 * 1024 * 1024 #Bytes per segment file before a new one is started
+BATCH_SIZE = 64 #Records buffered before they are written
+BATCH_INTERVAL = 1.0 #Seconds the oldest buffered record may wait to be written
+SEGMENT_PREFIX = 'journal-'
+SEGMENT_SUFFIX = '.bin'
+INDEX_SUFFIX = '.idx'
+#Magic, records indexed, zone and area entries, first and last time
+INDEX_HEADER = Struct('<4sIIIdd')
+INDEX_ENTRY = Struct('<HI') #Zone/area number, record numbers that follow
+INDEX_MAGIC = b'PJX1'
+
+#Replies whose number is a zone or an area
+_ZONE_REPLIES = frozenset(['ZL', 'RZ'])
+_AREA_REPLIES = frozenset(['AL', 'RA', 'AA', 'AQ', 'AS', 'AD'])
+
+JournalRecord = namedtuple('JournalRecord', ['time', 'type', 'group', 'number', 'zone', 'area',
+                                             'status'])
+
+def _decode_record(fields):
+    '''Returns a JournalRecord from the unpacked fields of a record.'''
+    _time, _type, _group, _number, _zone, _area, _status = fields
+    return JournalRecord(_time, _type.decode('ascii', 'replace'),
+                         None if _group == NO_GROUP else _group, _number, _zone, _area,
+                         _status.rstrip(b'\0').decode('ascii', 'replace'))
+
+def _index_path(segment_path):
+    '''Returns the path the index of a segment is saved to.'''
+    return segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+def _segment_paths(directory):
+    '''Returns the paths of the segment files, oldest first.'''
+    try:
+        _names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(_names)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)]
+
+
+class ParadoxEventJournal:
+    '''
+    Writes decoded messages to the journal in directory. zone_groups are the
+    system event groups whose event number is a zone.
+    Buffered records are written once batch_size are waiting, batch_interval
+    after the oldest one arrived, by flush() and by close().
+    When max_segments is given the oldest segments beyond that are deleted.
+    '''
+    def __init__(self, directory, zone_groups=(), segment_size=SEGMENT_SIZE,
+                 batch_size=BATCH_SIZE, batch_interval=BATCH_INTERVAL, max_segments=None):
+        self._directory = directory
+        self._zone_groups = frozenset(zone_groups)
+        self._segment_size = max(RECORD.size, segment_size - segment_size % RECORD.size)
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._max_segments = max_segments
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._oldest = 0.0
+        self._file = None
+        self._file_size = 0
+        self._reader = None
+        self._timer = None
+        self.records = 0
+
+    @property
+    def directory(self):
+        '''Returns the directory of the journal.'''
+        return self._directory
+
+    def append(self, message, timestamp=None):
+        '''Adds a message as received from the panel.'''
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            if message[:1] == 'G':
+                _group = int(message[1:4])
+                _number = int(message[5:8])
+                _area = int(message[9:12])
+                _zone = _number if _group in self._zone_groups else 0
+                _record = RECORD.pack(timestamp, b'G ', _group, _number, _zone, _area, b'')
+            else:
+                _type = message[:2]
+                _number = int(message[2:5])
+                _record = RECORD.pack(timestamp, _type.encode('ascii', 'replace'), NO_GROUP,
+                                      _number, _number if _type in _ZONE_REPLIES else 0,
+                                      _number if _type in _AREA_REPLIES else 0,
+                                      message[5:13].encode('ascii', 'replace'))
+        except ValueError:
+            _LOGGER.debug('Message %s not journalled.', message)
+            return
+        with self._lock:
+            if not self._buffered:
+                self._oldest = timestamp
+                if self._timer is None: #Written in time even if nothing follows
+                    self._timer = threading.Timer(self._batch_interval, self._flush_due)
+                    self._timer.daemon = True
+                    self._timer.start()
+            self._buffer += _record
+            self._buffered += 1
+            if (self._buffered >= self._batch_size or
+                    timestamp - self._oldest >= self._batch_interval):
+                self._write()
+
+    def flush(self):
+        '''Writes all buffered records.'''
+        with self._lock:
+            self._write()
+
+    def _flush_due(self):
+        '''Writes the records buffered for batch_interval (on the timer thread).'''
+        with self._lock:
+            self._timer = None
+            self._write()
+
+    def close(self):
+        '''Writes all buffered records and closes the segment file.'''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._write()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._file_size = 0
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def query(self, zone=None, area=None, since=None, until=None):
+        '''Returns the records matching the query, see ParadoxJournalReader.query().'''
+        self.flush()
+        if self._reader is None:
+            self._reader = ParadoxJournalReader(self._directory)
+        return self._reader.query(zone, area, since, until)
+
+    def _write(self):
+        '''Writes the buffer, starting new segments as they fill up (lock held).'''
+        _view = memoryview(self._buffer)
+        try:
+            while _view:
+                if self._file is None or self._file_size >= self._segment_size:
+                    self._next_segment()
+                _length = min(len(_view), self._segment_size - self._file_size)
+                self._file.write(_view[:_length])
+                self._file_size += _length
+                _view = _view[_length:]
+            if self._file is not None:
+                self._file.flush()
+        except OSError as err:
+            _LOGGER.error('Unable to write to the journal: %s', err)
+        finally:
+            _view.release()
+        self.records += self._buffered
+        self._buffer = bytearray()
+        self._buffered = 0
+
+    def _next_segment(self):
+        '''Continues the last segment if it has room, otherwise starts a new one (lock held).'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.makedirs(self._directory, exist_ok=True)
+        _paths = _segment_paths(self._directory)
+        _path = None
+        if _paths and self._file_size == 0: #Just (re)opened
+            _size = os.path.getsize(_paths[-1])
+            if _size < self._segment_size:
+                _path = _paths[-1]
+        if _path is None:
+            _number = int(os.path.basename(_paths[-1])[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) \
+                if _paths else 0
+            _path = os.path.join(self._directory, str.format('{0}{1:06d}{2}', SEGMENT_PREFIX,
+                                                             _number + 1, SEGMENT_SUFFIX))
+            _paths.append(_path)
+        self._file = open(_path, 'ab')
+        _size = self._file.tell()
+        if _size % RECORD.size: #Cut off a record torn by a crash
+            self._file.truncate(_size - _size % RECORD.size)
+        self._file_size = _size - _size % RECORD.size
+        if self._max_segments is not None:
+            for _old in _paths[:-self._max_segments]:
+                try:
+                    os.remove(_old)
+                    if os.path.exists(_index_path(_old)):
+                        os.remove(_index_path(_old))
+                except OSError as err:
+                    _LOGGER.warning('Unable to remove journal segment %s: %s', _old, err)
+
+
+class _SegmentIndex:
+    '''Memory map of one segment with the record numbers per zone and per area.'''
+    __slots__ = ['map', 'mapped', 'count', 'saved', 'first_time', 'last_time', 'zones',
+                 'areas']
+
+    def __init__(self):
+        self.map = None
+        self.mapped = 0 #Records the map covers
+        self.count = 0 #Records indexed
+        self.saved = 0 #Records in the saved index
+        self.first_time = None
+        self.last_time = None
+        self.zones = {}
+        self.areas = {}
+
+    def close(self):
+        '''Unmaps the segment.'''
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.mapped = 0
+
+    def load(self, path, count):
+        '''Takes over the index saved for the segment, if it covers at most count records.'''
+        try:
+            with open(_index_path(path), 'rb') as _file:
+                _data = _file.read()
+            _magic, _count, _zone_entries, _area_entries, _first, _last = \
+                INDEX_HEADER.unpack_from(_data)
+            if _magic != INDEX_MAGIC or _count > count:
+                return False
+            _offset = INDEX_HEADER.size
+            _tables = ({}, {})
+            for _table, _entries in zip(_tables, (_zone_entries, _area_entries)):
+                for _ in range(_entries):
+                    _number, _length = INDEX_ENTRY.unpack_from(_data, _offset)
+                    _offset += INDEX_ENTRY.size
+                    _numbers = array('I')
+                    _numbers.frombytes(_data[_offset:_offset + _length * _numbers.itemsize])
+                    _offset += _length * _numbers.itemsize
+                    _table[_number] = array('L', _numbers)
+        except (OSError, ValueError, StructError) as err:
+            _LOGGER.debug('No usable index for journal segment %s: %s', path, err)
+            return False
+        self.zones, self.areas = _tables
+        self.count = self.saved = _count
+        self.first_time = _first if _count else None
+        self.last_time = _last if _count else None
+        return True
+
+    def save(self, path):
+        '''Saves the index next to the segment (atomically).'''
+        _parts = [INDEX_HEADER.pack(INDEX_MAGIC, self.count, len(self.zones), len(self.areas),
+                                    self.first_time or 0.0, self.last_time or 0.0)]
+        for _table in (self.zones, self.areas):
+            for _number, _numbers in _table.items():
+                _parts.append(INDEX_ENTRY.pack(_number, len(_numbers)))
+                _parts.append(array('I', _numbers).tobytes())
+        _temp_path = str.format('{0}.{1}.tmp', _index_path(path), os.getpid())
+        try:
+            with open(_temp_path, 'wb') as _file:
+                _file.write(b''.join(_parts))
+            os.replace(_temp_path, _index_path(path))
+        except OSError as err:
+            _LOGGER.warning('Unable to save the index of journal segment %s: %s', path, err)
+            return
+        self.saved = self.count
+
+
+class ParadoxJournalReader:
+    '''
+    Queries the journal in directory. Segments are memory-mapped and indexed the
+    first time they are queried, starting from the index saved with them; records
+    added since are indexed on the next query. indexed counts the records this
+    reader had to index itself.
+    '''
+    def __init__(self, directory):
+        self._directory = directory
+        self._segments = {}
+        self.indexed = 0
+
+    def query(self, zone=None, area=None, since=None, until=None):
+        '''
+        Returns the JournalRecords of a zone and/or area (all if neither is given)
+        from since to until (times as time.time()), oldest first.
+        '''
+        _records = []
+        for _path in self._refresh():
+            _segment = self._segments[_path]
+            if (not _segment.count or (since is not None and _segment.last_time < since) or
+                    (until is not None and _segment.first_time > until)):
+                continue
+            if zone is not None:
+                _numbers = _segment.zones.get(zone, ())
+            elif area is not None:
+                _numbers = _segment.areas.get(area, ())
+            else:
+                _numbers = range(_segment.count)
+            _map = _segment.map
+            for _number in _numbers:
+                _fields = RECORD.unpack_from(_map, _number * RECORD.size)
+                if ((since is not None and _fields[0] < since) or
+                        (until is not None and _fields[0] > until) or
+                        (area is not None and _fields[5] != area)):
+                    continue
+                _records.append(_decode_record(_fields))
+        return _records
+
+    def close(self):
+        '''Saves the indexes that grew and unmaps all segments.'''
+        for _path, _segment in self._segments.items():
+            if _segment.count > _segment.saved:
+                _segment.save(_path)
+            _segment.close()
+        self._segments = {}
+
+    def _refresh(self):
+        '''Maps and indexes new segments and records, forgets removed segments.'''
+        _paths = _segment_paths(self._directory)
+        for _path in set(self._segments) - set(_paths):
+            self._segments.pop(_path).close()
+        for _position, _path in enumerate(_paths):
+            _segment = self._segments.get(_path)
+            try:
+                _count = os.path.getsize(_path) // RECORD.size
+            except OSError:
+                continue
+            if _segment is None:
+                _segment = self._segments[_path] = _SegmentIndex()
+                _segment.load(_path, _count)
+            if _count > _segment.mapped:
+                self._index(_path, _segment, _count)
+            if _position < len(_paths) - 1 and _segment.count > _segment.saved:
+                _segment.save(_path) #Full, it will not grow any more
+        return _paths
+
+    def _index(self, path, segment, count):
+        '''(Re)maps a segment that grew and indexes the records not indexed yet.'''
+        segment.close()
+        with open(path, 'rb') as _file:
+            segment.map = mmap.mmap(_file.fileno(), count * RECORD.size, access=mmap.ACCESS_READ)
+        segment.mapped = count
+        self.indexed += count - segment.count
+        _zones = segment.zones
+        _areas = segment.areas
+        _number = segment.count
+        _view = memoryview(segment.map)[_number * RECORD.size:count * RECORD.size]
+        for _fields in RECORD.iter_unpack(_view):
+            if segment.first_time is None:
+                segment.first_time = _fields[0]
+            segment.last_time = _fields[0]
+            if _fields[4]:
+                _zones.setdefault(_fields[4], array('L')).append(_number)
+            if _fields[5]:
+                _areas.setdefault(_fields[5], array('L')).append(_number)
+            _number += 1
+        _view.release()
+        segment.count = count
@@ -0,0 +1,151 @@
+'''
+Runs any number of Paradox alarm panels on a single asyncio event loop.
+
+Every panel reads from its own connection, but the messages of all panels are
+decoded by one dispatcher task that takes turns between the panels, so a busy
+panel cannot starve the others. The writers of the panels wait for requests on
+the loop as well, so a request goes out as soon as its panel's pacing allows,
+however many panels share the loop.
+'''
+
+import asyncio
+import logging
+from collections import deque
+from pyparadox_alarm.alarm_async import AsyncParadoxAlarmPanel
+
+_LOGGER = logging.getLogger(__name__)
+
+DISPATCH_BATCH = 16 #Messages decoded for a panel before moving on to the next one
+
+class _ManagedPanel:
+    '''A panel together with the messages waiting to be decoded for it.'''
+    __slots__ = ['name', 'panel', 'pending', 'scheduled']
+
+    def __init__(self, name):
+        self.name = name
+        self.panel = None
+        self.pending = deque()
+        self.scheduled = False
+
+class ParadoxPanelManager:
+    '''
+    Owns a set of AsyncParadoxAlarmPanels that share the event loop and one
+    dispatcher. Listeners added with add_listener() receive (panel name, message)
+    for every message of every panel, after the panel decoded it.
+    '''
+    def __init__(self, dispatch_batch=DISPATCH_BATCH, loop=None):
+        self._dispatch_batch = dispatch_batch
+        self._loop = loop
+        self._panels = {}
+        self._ready = deque()
+        self._wakeup = None
+        self._dispatcher = None
+        self._listeners = []
+        self.dispatched = 0
+
+    @property
+    def panels(self):
+        '''Returns the panels by name.'''
+        return {name: managed.panel for name, managed in self._panels.items()}
+
+    @property
+    def alarm_states(self):
+        '''Returns the (read-only) alarm state of every panel by name.'''
+        return {name: managed.panel.alarm_state for name, managed in self._panels.items()}
+
+    @property
+    def backlog(self):
+        '''Returns the number of messages waiting to be decoded, over all panels.'''
+        return sum(len(managed.pending) for managed in self._panels.values())
+
+    def add_listener(self, listener):
+        '''Subscribes a function to the messages of all panels.'''
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        '''Unsubscribes a function.'''
+        self._listeners.remove(listener)
+
+    def add_panel(self, name, **panel_args):
+        '''
+        Creates a panel (arguments as for AsyncParadoxAlarmPanel) managed under the name.
+        The panel is started by start(), or straight away if the manager is running.
+        '''
+        if name in self._panels:
+            raise ValueError(str.format('Panel {0} already exists.', name))
+        managed = _ManagedPanel(name)
+        managed.panel = AsyncParadoxAlarmPanel(
+            loop=self._loop, message_handler=lambda message: self._received(managed, message),
+            **panel_args)
+        self._panels[name] = managed
+        return managed.panel
+
+    async def start(self):
+        '''Starts the dispatcher and all panels.'''
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = self._loop.create_task(self._dispatch())
+        _results = await asyncio.gather(*[self._start_panel(managed)
+                                          for managed in self._panels.values()],
+                                        return_exceptions=True)
+        for managed, result in zip(list(self._panels.values()), _results):
+            if isinstance(result, Exception):
+                _LOGGER.error('Unable to start panel %s: %s', managed.name, result)
+
+    async def stop(self):
+        '''Stops all panels and the dispatcher.'''
+        await asyncio.gather(*[managed.panel.stop() for managed in self._panels.values()],
+                             return_exceptions=True)
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+    async def _start_panel(self, managed):
+        '''Starts a single panel on the loop of the manager.'''
+        managed.panel.loop = self._loop
+        await managed.panel.start()
+
+    def _received(self, managed, message):
+        '''Queues a message of a panel and makes sure the panel gets its turn.'''
+        managed.pending.append(message)
+        if not managed.scheduled:
+            managed.scheduled = True
+            self._ready.append(managed)
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        '''Decodes the queued messages, taking turns between the panels (as task).'''
+        _ready = self._ready
+        _batch = self._dispatch_batch
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while _ready:
+                managed = _ready.popleft()
+                _pending = managed.pending
+                for _ in range(min(_batch, len(_pending))):
+                    self._decode(managed, _pending.popleft())
+                if _pending:
+                    _ready.append(managed) #Back of the line, others first
+                else:
+                    managed.scheduled = False
+                await asyncio.sleep(0) #Let the protocols read in between turns
+
+    def _decode(self, managed, message):
+        '''Has the panel decode a message, then tells the listeners.'''
+        try:
+            managed.panel.decode_response(message)
+        except Exception: #pylint: disable=broad-except
+            _LOGGER.exception('Panel %s failed to decode %s.', managed.name, message)
+        self.dispatched += 1
+        for listener in self._listeners:
+            try:
+                listener(managed.name, message)
+            except Exception: #pylint: disable=broad-except
+                _LOGGER.exception('Listener %s failed on %s of panel %s.', listener, message,
+                                  managed.name)
@@ -0,0 +1,157 @@
+'''
+Low overhead counters, gauges and histograms describing the link to the panel.
+
+Counters are plain integer increments. Timings are only taken for one in every
+"sample_every" messages/callbacks, so the hot path stays cheap. Everything can
+be read as a snapshot dictionary or in the Prometheus text format.
+'''
+
+import threading
+from bisect import bisect_left
+
+SAMPLE_EVERY = 16
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#Metric name: (type, help text, label name or None)
+METRICS = {
+    'tx_bytes': ('counter', 'Bytes written to the panel.', None),
+    'tx_frames': ('counter', 'Requests written to the panel.', None),
+    'rx_bytes': ('counter', 'Bytes read from the panel.', None),
+    'rx_frames': ('counter', 'Messages read from the panel.', None),
+    'write_errors': ('counter', 'Requests that could not be written.', None),
+    'reconnects': ('counter', 'Times the connection to the panel was re-opened.', None),
+    'dropped_frames': ('counter', 'Received data dropped for lack of a terminator.', None),
+    'undecoded_frames': ('counter', 'Messages not understood by the decoder.', 'type'),
+    'request_queue_depth': ('gauge', 'Requests waiting to be written.', None),
+    'response_queue_depth': ('gauge', 'Messages waiting to be decoded.', None),
+    'request_rtt_seconds': ('histogram', 'Time from writing a request to its reply.', None),
+    'decode_seconds': ('histogram', 'Time to decode a message (sampled).', 'type'),
+    'callback_seconds': ('histogram', 'Time spent in client callbacks (sampled).', 'slot'),
+    'callback_lag_seconds': ('histogram', 'Time callbacks waited for a worker.', 'slot'),
+    'callbacks_dropped': ('counter', 'Callbacks dropped from a full callback queue.', 'slot'),
+    'callback_queue_depth': ('gauge', 'Callbacks waiting for a worker.', None),
+    }
+
+class _Histogram:
+    '''Cumulative bucket counts plus sum and count, as Prometheus expects.'''
+    __slots__ = ['counts', 'total', 'count']
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        '''Adds a value to the histogram.'''
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+class ParadoxMetrics:
+    '''
+    Metrics of one panel. Counters and histograms are keyed by metric name and
+    (optional) label value, gauges are functions evaluated when read.
+    '''
+    def __init__(self, sample_every=SAMPLE_EVERY):
+        self._sample_every = max(1, sample_every)
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def sample(self, name):
+        '''Returns True for one in every sample_every calls for the metric: time this one.'''
+        _count = self._samples.get(name, 0) + 1
+        self._samples[name] = _count
+        return _count % self._sample_every == 0
+
+    def inc(self, name, value=1, label=None):
+        '''Adds to a counter.'''
+        _key = (name, label)
+        self._counters[_key] = self._counters.get(_key, 0) + value
+
+    def observe(self, name, value, label=None):
+        '''Adds a value to a histogram.'''
+        _key = (name, label)
+        _histogram = self._histograms.get(_key)
+        if _histogram is None:
+            with self._lock:
+                _histogram = self._histograms.setdefault(_key, _Histogram())
+        _histogram.observe(value)
+
+    def set_gauge(self, name, function, label=None):
+        '''Registers a function returning the current value of a gauge.'''
+        self._gauges[(name, label)] = function
+
+    def snapshot(self):
+        '''Returns all metrics as a dictionary.'''
+        _snapshot = {}
+        for (name, label), value in list(self._counters.items()):
+            self._put(_snapshot, name, label, value)
+        for (name, label), function in list(self._gauges.items()):
+            self._put(_snapshot, name, label, function())
+        for (name, label), histogram in list(self._histograms.items()):
+            self._put(_snapshot, name, label,
+                      {'count': histogram.count, 'sum': histogram.total,
+                       'buckets': dict(zip(LATENCY_BUCKETS + (float('inf'),),
+                                           self._cumulative(histogram)))})
+        return _snapshot
+
+    def prometheus(self, prefix='paradox', panel=None):
+        '''Returns all metrics in the Prometheus text exposition format.'''
+        _lines = []
+        _series = {}
+        for _key in list(self._counters) + list(self._gauges) + list(self._histograms):
+            _series.setdefault(_key[0], []).append(_key[1])
+        for name in sorted(_series):
+            _type, _help, _label_name = METRICS.get(name, ('untyped', name, 'label'))
+            _full_name = prefix + '_' + name
+            _lines.append(str.format('# HELP {0} {1}', _full_name, _help))
+            _lines.append(str.format('# TYPE {0} {1}', _full_name, _type))
+            for label in _series[name]:
+                _labels = []
+                if panel is not None:
+                    _labels.append(str.format('panel="{0}"', panel))
+                if label is not None:
+                    _labels.append(str.format('{0}="{1}"', _label_name, label))
+                if _type == 'histogram':
+                    _histogram = self._histograms[(name, label)]
+                    for _bound, _count in zip(LATENCY_BUCKETS + (float('inf'),),
+                                              self._cumulative(_histogram)):
+                        _bucket = _labels + [str.format('le="{0}"',
+                                                        '+Inf' if _bound == float('inf')
+                                                        else _bound)]
+                        _lines.append(str.format('{0}_bucket{{{1}}} {2}', _full_name,
+                                                 ','.join(_bucket), _count))
+                    _suffix = '{' + ','.join(_labels) + '}' if _labels else ''
+                    _lines.append(str.format('{0}_sum{1} {2}', _full_name, _suffix,
+                                             _histogram.total))
+                    _lines.append(str.format('{0}_count{1} {2}', _full_name, _suffix,
+                                             _histogram.count))
+                else:
+                    _value = self._counters.get((name, label))
+                    if _value is None:
+                        _value = self._gauges[(name, label)]()
+                    _suffix = '{' + ','.join(_labels) + '}' if _labels else ''
+                    _lines.append(str.format('{0}{1} {2}', _full_name, _suffix, _value))
+        return '\n'.join(_lines) + '\n'
+
+    @staticmethod
+    def _cumulative(histogram):
+        '''Returns the cumulative bucket counts of a histogram.'''
+        _total = 0
+        _cumulative = []
+        for _count in histogram.counts:
+            _total += _count
+            _cumulative.append(_total)
+        return _cumulative
+
+    @staticmethod
+    def _put(snapshot, name, label, value):
+        '''Stores a value in the snapshot, nested by label if there is one.'''
+        if label is None:
+            snapshot[name] = value
+        else:
+            snapshot.setdefault(name, {})[label] = value
@@ -1,28 +1,122 @@
 '''Replicates a Paradox Alarm panel as a dictionary and allows interfacing to it.'''
 
+import asyncio
 import logging
 import time
 import threading
 from queue import Queue, Empty
-from pyparadox_alarm.paradox_defaults import PARADOX_MODELS
-from pyparadox_alarm.alarm_serial_comms import ParadoxSerialComms
-from pyparadox_alarm.alarm_state import AlarmState
+from pyparadox_alarm.paradox_defaults import (PARADOX_MODELS, EVENT_GROUPS, EVENT_GROUP_COUNT,
+                                              TROUBLE_AC_FAILURE, STATUS_1, STATUS_2, STATUS_3,
+                                              STATUS_CLEARS)
+from pyparadox_alarm.alarm_serial_comms import (ParadoxSerialComms, DRAIN_TIMEOUT, JOIN_TIMEOUT,
+                                                 REQUEST_INTERVAL)
+from pyparadox_alarm.alarm_state import CompactAlarmState, ZONE_BIT, AREA_BIT
+from pyparadox_alarm.alarm_flow_control import ParadoxFlowControl
+from pyparadox_alarm.alarm_requests import ParadoxRequestTracker
+from pyparadox_alarm.alarm_cache import ParadoxStateCache, LABEL_TTL
+from pyparadox_alarm.alarm_metrics import ParadoxMetrics
+from pyparadox_alarm.alarm_batching import ParadoxChangeBatcher, COALESCE_WINDOW
+from pyparadox_alarm.alarm_journal import ParadoxEventJournal
+from pyparadox_alarm.alarm_scheduler import ParadoxRequestScheduler, PRIORITY_BACKGROUND
+from pyparadox_alarm.alarm_supervisor import SILENCE_TIMEOUT
+from pyparadox_alarm.alarm_callbacks import (ParadoxCallbackExecutor, CALLBACK_QUEUE_SIZE,
+                                             OVERFLOW_BLOCK)
+from pyparadox_alarm.alarm_poller import ParadoxStatusPoller, STALE_AFTER, poll_rate
+from pyparadox_alarm.alarm_discovery import discover, probe_speed, PRT3_SPEEDS
 
 _LOGGER = logging.getLogger(__name__)
 COMMAND_ERR = "Cannot run this command while disconnected. Please run start() first."
 
+_ZONE_CONDITION_BITS = {'O': ZONE_BIT['open'], 'T': ZONE_BIT['tamper'], 'F': ZONE_BIT['fault']}
+_DELAY_BITS = AREA_BIT['exit_delay'] | AREA_BIT['entry_delay']
+_FAULT_BITS = ZONE_BIT['open'] | ZONE_BIT['fault'] #Setting either is noted as last_fault
+_ZONE_OK_BITS = ZONE_BIT['open'] | ZONE_BIT['tamper'] | ZONE_BIT['fault'] #Cleared by zone OK
+#Area bits by the arm status letter of an RA reply, "alpha" marks a disarmed area
+_AREA_ARM_BITS = {'D': AREA_BIT['alpha'], 'A': AREA_BIT['armed_away'],
+                  'F': AREA_BIT['armed_away'], 'S': AREA_BIT['armed_stay'],
+                  'I': AREA_BIT['armed_stay'] | AREA_BIT['armed_zero_entry_delay']}
+_AREA_ARM_MASK = (AREA_BIT['alpha'] | AREA_BIT['armed_away'] | AREA_BIT['armed_stay'] |
+                  AREA_BIT['armed_zero_entry_delay'])
+_AREA_CONDITION_MASK = (AREA_BIT['alarm_in_memory'] | AREA_BIT['trouble'] | AREA_BIT['ready'] |
+                        AREA_BIT['alarm'])
+RESYNC_MARGIN = 60 #Seconds before an outage a zone must have been active to be resynced first
+FULL_RESYNC_AFTER = 300 #Outages longer than this also refresh the quiet zones, in the background
+MONITOR_TIMEOUT = 10 #Seconds to wait for the monitoring thread to run a function
+
+#What every system event group changes in the alarm state: group -> ((action, arguments), ...)
+EVENT_ACTIONS = {
+    0: (('_event_zone_status', ('C',)),),
+    1: (('_event_zone_status', ('O',)), ('_event_area_flag', ('ready', False))),
+    2: (('_event_zone_flag', ('tamper', True)),),
+    3: (('_event_zone_flag', ('fault', True)),),
+    9: (('_event_area_status', ('A',)), ('_event_area_flag', ('alarm_in_memory', False))),
+    10: (('_event_area_status', ('A',)), ('_event_area_flag', ('alarm_in_memory', False))),
+    11: (('_event_area_status', ('A',)), ('_event_area_flag', ('alarm_in_memory', False))),
+    12: (('_event_area_status', ('A',)), ('_event_area_flag', ('alarm_in_memory', False))),
+    13: (('_event_area_status', ('D',)), ('_event_area_flag', ('armed_bypass', False))),
+    14: (('_event_area_status', ('D',)), ('_event_area_flag', ('armed_bypass', False))),
+    15: (('_event_area_status', ('D',)), ('_event_area_flag', ('armed_bypass', False))),
+    16: (('_event_area_status', ('D',)), ('_event_area_flag', ('alarm', False)),
+         ('_event_area_flag', ('armed_bypass', False))),
+    17: (('_event_area_status', ('D',)), ('_event_area_flag', ('alarm', False)),
+         ('_event_area_flag', ('armed_bypass', False))),
+    18: (('_event_area_status', ('D',)), ('_event_area_flag', ('alarm', False)),
+         ('_event_area_flag', ('armed_bypass', False))),
+    19: (('_event_area_flag', ('alarm', False)),),
+    20: (('_event_area_flag', ('alarm', False)),),
+    21: (('_event_area_flag', ('alarm', False)),),
+    23: (('_event_zone_flag', ('bypass', True)),),
+    24: (('_event_zone_flag', ('alarm', True)), ('_event_area_flag', ('alarm', True))),
+    25: (('_event_zone_flag', ('fire', True)), ('_event_area_flag', ('fire', True))),
+    26: (('_event_zone_flag', ('alarm', False)),),
+    27: (('_event_zone_flag', ('fire', False)), ('_event_area_flag', ('fire', False))),
+    28: (('_event_area_flag', ('alarm', True)),),
+    30: (('_event_zone_flag', ('tamper', True)),),
+    31: (('_event_zone_flag', ('tamper', False)),),
+    32: (('_event_trouble', (True,)),),
+    33: (('_event_trouble', (False,)),),
+    37: (('_event_zone_flag', ('low_battery', True)),),
+    38: (('_event_zone_flag', ('supervision_lost', True)),),
+    39: (('_event_zone_flag', ('low_battery', False)),),
+    40: (('_event_zone_flag', ('supervision_lost', False)),),
+    53: (('_event_zone_flag', ('bypass', False)),),
+    64: (('_event_area_status_bits', (STATUS_1,)),),
+    65: (('_event_area_status_bits', (STATUS_2,)),),
+    66: (('_event_area_status_bits', (STATUS_3,)),),
+    }
+#Event groups whose event number is a zone
+ZONE_EVENT_GROUPS = frozenset(group for group, actions in EVENT_ACTIONS.items()
+                              if any(name.startswith('_event_zone') for name, _ in actions))
+
 class ParadoxAlarmPanel:
     '''This class represents an Paradox alarm panel.'''
 
     def __init__(self, paradox_model='EVO48', comm_module='PRT3',
                 #username='user', password='user',
-                prt_port='/dev/ttyUSB0', prt_speed=57600):
+                prt_port='/dev/ttyUSB0', prt_speed=57600,
+                adaptive_pacing=False, max_in_flight=4, request_interval=REQUEST_INTERVAL,
+                cache_dir=None, label_ttl=LABEL_TTL,
+                change_only=False, coalesce_window=COALESCE_WINDOW,
+                journal_dir=None, silence_timeout=SILENCE_TIMEOUT,
+                callback_workers=None, callback_queue_size=CALLBACK_QUEUE_SIZE,
+                callback_overflow=OVERFLOW_BLOCK, poll_share=None, poll_stale_after=STALE_AFTER,
+                discover_enrolled=False):
         _LOGGER.debug('Initialising Panel')
         self._paradox_model = paradox_model
         #self._username = username
         #self._password = password
         self._prt_port = prt_port
+        #None: probe the speed of the PRT3 when connecting
         self._prt_speed = prt_speed
+        #Find the model (if None) and the zones/areas in use when connecting?
+        self._discover = discover_enrolled or paradox_model is None
+        #Pace requests by the replies of the panel rather than a fixed sleep?
+        self._adaptive_pacing = adaptive_pacing
+        self._max_in_flight = max_in_flight
+        #Fixed time to wait after every request without adaptive pacing
+        self._request_interval = request_interval
+        #Probe the panel after this many seconds without a message (None: never)
+        self._silence_timeout = silence_timeout
 
         #Set callbacks
         self._callback_zone_name = self._default_callback
@@ -31,16 +125,67 @@ class ParadoxAlarmPanel:
         self._callback_area_armed = self._default_callback
         self._callback_area_stay_armed = self._default_callback
         self._callback_area_disarmed = self._default_callback
+        self._callback_area_state_change = self._default_callback
+        #Only call the zone/area status callbacks when something actually changed?
+        self._change_only = change_only
+        self._coalesce_window = coalesce_window
+        self._batcher = None
+        self._listeners = []
 
         #Setup default panel state
         self._panel = None
-        self._max_areas = PARADOX_MODELS[self._paradox_model]['max areas']
-        self._max_zones = PARADOX_MODELS[self._paradox_model]['max zones']
-        self._alarm_state = AlarmState.get_initial_alarm_state(self._max_zones, self._max_areas)
+        if paradox_model is None: #Room for the largest model until discovery found it
+            self._max_areas = max(model['max areas'] for model in PARADOX_MODELS.values())
+            self._max_zones = max(model['max zones'] for model in PARADOX_MODELS.values())
+        else:
+            self._max_areas = PARADOX_MODELS[self._paradox_model]['max areas']
+            self._max_zones = PARADOX_MODELS[self._paradox_model]['max zones']
+        self._state = CompactAlarmState(self._max_zones, self._max_areas)
+        #The zones and areas bulk requests go to (discovery narrows them down)
+        self._zones = tuple(range(1, self._max_zones + 1))
+        self._areas = tuple(range(1, self._max_areas + 1))
+        #Warm start from the snapshot taken when we last stopped
+        self._cache = None
+        self._cache_dir = cache_dir
+        self._label_ttl = label_ttl
+        if cache_dir is not None and paradox_model is not None:
+            self._cache = ParadoxStateCache(cache_dir, prt_port, paradox_model, label_ttl)
+            self._cache.load(self._state)
+        #Binary history of every message decoded
+        self._journal = None
+        if journal_dir is not None:
+            self._journal = ParadoxEventJournal(journal_dir, ZONE_EVENT_GROUPS)
         #Setup queues to be used to submit/receive data to/from the panel
-        self._to_alarm = Queue()
+        self._to_alarm = ParadoxRequestScheduler()
         self._from_alarm = Queue()
         self._shutdown = None
+        self._monitor_thread = None
+        #Instrumentation shared with the serial comms
+        self._metrics = ParadoxMetrics()
+        self._metrics.set_gauge('request_queue_depth', self._to_alarm.qsize)
+        self._metrics.set_gauge('response_queue_depth', self._from_alarm.qsize)
+        #Run the callbacks on worker threads rather than the monitoring thread?
+        self._callback_executor = None
+        if callback_workers:
+            self._callback_executor = ParadoxCallbackExecutor(callback_workers,
+                                                              callback_queue_size,
+                                                              callback_overflow, self._metrics)
+            self._metrics.set_gauge('callback_queue_depth', self._callback_executor.qsize)
+        #Precomputed decoding tables
+        self._event_handlers = self._build_event_handlers()
+        self._response_handlers = {'ZL': self.update_zone_name, 'RZ': self.update_zone_status,
+                                   'AL': self.update_area_name, 'RA': self.update_area_status}
+        #Requests waiting for their reply
+        self._request_tracker = ParadoxRequestTracker(self._queue_request)
+        #Poll the statuses no event confirmed lately, with a share of the link (from start())
+        self._poller = None
+        self._poll_share = poll_share
+        self._poll_stale_after = poll_stale_after
+        #Time from reading a message off the wire until its callbacks completed
+        self._latency_last = 0.0
+        self._latency_max = 0.0
+        self._latency_total = 0.0
+        self._latency_count = 0
 
 
 
@@ -81,10 +226,96 @@ class ParadoxAlarmPanel:
         _LOGGER.debug('Returning model name, %s.', self._paradox_model)
         return self._paradox_model
 
+    @property
+    def metrics(self):
+        '''Returns the metrics (see ParadoxMetrics.snapshot() and .prometheus()).'''
+        return self._metrics
+
     @property
     def alarm_state(self):
-        '''Returns the alarm state dictionary.'''
-        return self._alarm_state
+        '''Returns a read-only, live mapping of the alarm state (like a dictionary).'''
+        return self._state.view
+
+    @property
+    def poller(self):
+        '''Returns the ParadoxStatusPoller, None unless a poll_share was given.'''
+        return self._poller
+
+    @property
+    def enrolled_zones(self):
+        '''Returns the zones that are refreshed, all of the model unless discovered.'''
+        return self._zones
+
+    @property
+    def enrolled_areas(self):
+        '''Returns the areas that are refreshed, all of the model unless discovered.'''
+        return self._areas
+
+    @property
+    def journal(self):
+        '''Returns the ParadoxEventJournal (see query()), None unless a journal_dir was given.'''
+        return self._journal
+
+    @property
+    def state_version(self):
+        '''Returns the version of the alarm state, incremented by every change.'''
+        return self._state.version
+
+    def snapshot(self):
+        '''Returns an immutable snapshot of the alarm state (see AlarmStateSnapshot).'''
+        return self._state.snapshot()
+
+    def changes_since(self, version, raw=False):
+        '''
+        Returns (current version, changes after the given version), changes being
+        None if the version is too old: take a snapshot() instead.
+        See CompactAlarmState.changes_since().
+        '''
+        return self._state.changes_since(version, raw)
+
+    def zones_with(self, flag):
+        '''Returns the numbers of the zones with a status flag set, e.g. 'bypass'.'''
+        return self._state.zones_with(flag)
+
+    def open_zones(self):
+        '''Returns the numbers of the open zones.'''
+        return self._state.zones_with('open')
+
+    def alarm_zones(self):
+        '''Returns the numbers of the zones in alarm.'''
+        return self._state.zones_with('alarm')
+
+    def tamper_zones(self):
+        '''Returns the numbers of the tampered zones.'''
+        return self._state.zones_with('tamper')
+
+    def zones_in_area(self, area_number):
+        '''Returns the numbers of the zones of an area, as learnt from their events.'''
+        return self._state.area_zones(area_number)
+
+    def zone_area(self, zone_number):
+        '''Returns the area of a zone, None until an event of the zone told us.'''
+        return self._state.zone_area(zone_number)
+
+    def area_zone_counts(self, area_number):
+        '''Returns the number of zones of an area and of those open, in alarm, tampered...'''
+        return self._state.area_zone_counts(area_number)
+
+    def find_zone(self, name):
+        '''Returns the numbers of the zones with the name (ignoring case and padding).'''
+        return self._state.find_zone(name)
+
+    def find_area(self, name):
+        '''Returns the numbers of the areas with the name (ignoring case and padding).'''
+        return self._state.find_partition(name)
+
+    def add_listener(self, listener):
+        '''Subscribes a function to every message, called with it after it was decoded.'''
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        '''Unsubscribes a function.'''
+        self._listeners.remove(listener)
 
     @property
     def callback_zone_name(self):
@@ -146,201 +377,620 @@ class ParadoxAlarmPanel:
         '''Subscribes a function to an area/partition disarming event.'''
         self._callback_area_disarmed = value
 
+    @property
+    def callback_area_state_change(self):
+        '''Calls function subscribed to other area/partition changes (alarm, trouble...).'''
+        return self._callback_area_state_change
+
+    @callback_area_state_change.setter
+    def callback_area_state_change(self, value):
+        '''Subscribes a function to other area/partition changes (alarm, trouble...).'''
+        self._callback_area_state_change = value
+
+    @property
+    def callback_state_changes(self):
+        '''Calls function subscribed to batches of zone/area status changes.'''
+        return self._batcher.callback if self._batcher is not None else None
+
+    @callback_state_changes.setter
+    def callback_state_changes(self, value):
+        '''
+        Subscribes a function to batches of zone/area status changes. It is called
+        at most once per coalesce window with a list of (entity, old, new) deltas,
+        see ParadoxChangeBatcher.
+        '''
+        if value is None:
+            self._batcher = None
+            self._state.on_change = None
+        else:
+            self._batcher = ParadoxChangeBatcher(value, self._coalesce_window,
+                                                 self._schedule_later)
+            self._state.on_change = self._batcher.changed
+
+    def _schedule_later(self, delay, function):
+        '''Calls the function after the delay (on a timer thread).'''
+        _timer = threading.Timer(delay, function)
+        _timer.daemon = True
+        _timer.start()
+
     def _default_callback(self, number):
         '''This is the callback that occurs when the client doesn't subscribe.'''
         _LOGGER.debug("Callback for area/zone/user %s has not been set by client.", number)
 
     def start(self):
         '''Connect to the Paradox Alarm and start listening for events to occur.'''
+        if self._prt_speed is None:
+            self._prt_speed = probe_speed(self._prt_port) or PRT3_SPEEDS[0]
         _LOGGER.info("Connecting to Paradox on host: %s, port: %d",
                                 self._prt_port, self._prt_speed)
+        _flow_control = None
+        if self._adaptive_pacing:
+            _flow_control = ParadoxFlowControl(self._prt_speed, self._max_in_flight)
         self._panel = ParadoxSerialComms(self._to_alarm, self._from_alarm,
-                                        self._prt_port, self._prt_speed)
+                                        self._prt_port, self._prt_speed, _flow_control,
+                                        request_interval=self._request_interval,
+                                        metrics=self._metrics,
+                                        silence_timeout=self._silence_timeout,
+                                        on_reconnect=self.resync)
+        self._request_tracker.open() #In case of a restart
+        if self._callback_executor is not None:
+            self._callback_executor.start()
         self._panel.start()
         #Allow for a list of areas and zones to be passed rather than simply requesting all
         #self.request_all_labels(self._max_areas, self._max_zones)
-        listen_thread = threading.Thread(target=self.monitor_response_queue)
-        listen_thread.start() #We need a thread to keep on listening for alarm messages
+        self._shutdown = False
+        #We need a thread to keep on listening for alarm messages
+        self._monitor_thread = threading.Thread(target=self.monitor_response_queue, daemon=True)
+        self._monitor_thread.start()
+        if self._discover:
+            _interval = 0 if self._adaptive_pacing else self._request_interval
+            try:
+                self._run_on_monitor(self._apply_discovery,
+                                     discover(self.request, self._paradox_model,
+                                              interval=_interval, cancel=self.cancel_requests))
+            except Exception:
+                self.stop() #Nothing left running, start() can be retried
+                raise
+        if self._cache is not None:
+            self.revalidate_labels()
+        if self._poll_share:
+            self._poller = ParadoxStatusPoller(
+                self._state, self.submit_request,
+                lambda: self._to_alarm.pending(PRIORITY_BACKGROUND) > 0,
+                poll_rate(self._poll_share, self._prt_speed,
+                          None if self._adaptive_pacing else self._request_interval),
+                self._poll_stale_after, self._zones, self._areas)
+            self._poller.start()
         #time.sleep(2) #With proper queue management this should not be needed.
         #self._to_alarm.join() #Allow some time for all the requests to be serviced
         #self.request_all_statuses(self._max_areas, self._max_zones)
 
-    def stop(self):
-        '''Shut down and close our connection to the Paradox Alarm.'''
-        self._shutdown = True # this should kill the "monitoring" thread
+    def stop(self, drain=False, drain_timeout=DRAIN_TIMEOUT):
+        '''
+        Shut down and close our connection to the Paradox Alarm.
+        With drain, the requests still queued are written and answered first (for
+        up to drain_timeout seconds), otherwise they stay queued for the next start().
+        '''
+        if self._poller is not None:
+            self._poller.stop(JOIN_TIMEOUT)
         if self._panel:
             _LOGGER.info("Disconnecting from the Paradox Alarm...")
-            self._panel.stop()
+            self._panel.stop(drain, drain_timeout)
         else:
             _LOGGER.error(COMMAND_ERR)
+        self._shutdown = True # this should kill the "monitoring" thread
+        self._from_alarm.put(None) #Wake the monitoring thread up, after the last messages
+        if self._monitor_thread is not None:
+            if self._monitor_thread is not threading.current_thread():
+                self._monitor_thread.join(JOIN_TIMEOUT)
+            self._monitor_thread = None
+        if self._callback_executor is not None:
+            self._callback_executor.stop(JOIN_TIMEOUT)
+        self._request_tracker.close(JOIN_TIMEOUT)
+        if self._cache is not None:
+            self.save_snapshot()
+        if self._journal is not None:
+            self._journal.close()
+
+    def _run_on_monitor(self, function, *args):
+        '''
+        Calls the function on the monitoring thread, between two messages, and
+        waits for it to return. Raises what the function raised, or TimeoutError
+        if the monitoring thread did not get to it within MONITOR_TIMEOUT.
+        '''
+        _done = threading.Event()
+        _error = []
+        def _call():
+            try:
+                function(*args)
+            except Exception as err: #pylint: disable=broad-except
+                _error.append(err)
+            finally:
+                _done.set()
+        self._from_alarm.put(_call)
+        if not _done.wait(MONITOR_TIMEOUT):
+            raise TimeoutError(str.format('Monitoring thread did not run {0} in {1} s.',
+                                          getattr(function, '__name__', function),
+                                          MONITOR_TIMEOUT))
+        if _error:
+            raise _error[0]
+
+    def _apply_discovery(self, result):
+        '''
+        Adopts a DiscoveryResult: the state is resized to the highest enrolled
+        zone and area (keeping what it holds) and bulk requests only go to the
+        enrolled ones from now on.
+        '''
+        self._paradox_model = result.model
+        self._zones = result.zones
+        self._areas = result.areas
+        self._max_zones = result.zones[-1]
+        self._max_areas = result.areas[-1]
+        self._state = self._state.resized(self._max_zones, self._max_areas)
+        if self._cache is None and self._cache_dir is not None:
+            #The snapshot is kept per model, load it now the model is known. Keep the
+            #labels discovery read, the others are left to revalidate_labels()
+            _labels = [(kind, number, records[number].name)
+                       for kind, records in (('zone', self._state.zones),
+                                             ('partition', self._state.partitions))
+                       for number in range(1, len(records))
+                       if records[number].name is not None]
+            self._cache = ParadoxStateCache(self._cache_dir, self._prt_port, result.model,
+                                            self._label_ttl)
+            self._cache.load(self._state)
+            for kind, number, name in _labels: #Just received, fresher than the snapshot
+                if kind == 'zone':
+                    self._state.set_zone_name(number, name)
+                else:
+                    self._state.set_partition_name(number, name)
+                self._cache.label_updated(kind, number)
+        _LOGGER.info('Panel is a %s with %d zones and %d areas enrolled.',
+                     result.model, len(result.zones), len(result.areas))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
 
     def request_all_labels(self, area_total, zone_total):
         '''Submits requests for all area and zone labels.'''
         _LOGGER.debug("Requesting %s zone labels...", zone_total)
         for i in range(1, zone_total + 1):
             self.submit_zone_label_request(i)
-            time.sleep(0.1)
 
         _LOGGER.info(str.format("Requesting {0} area labels...", area_total))
         for i in range(1, area_total + 1):
             self.submit_area_label_request(i)
-            time.sleep(0.1)
+
+    def revalidate_labels(self):
+        '''Queues label requests for the zones and areas whose cached label is stale.'''
+        if self._cache is None:
+            self.request_all_labels(self._max_areas, self._max_zones)
+            return
+        _zones = self._cache.stale_labels('zone', self._zones)
+        _areas = self._cache.stale_labels('partition', self._areas)
+        _LOGGER.debug('Revalidating %d zone and %d area labels...', len(_zones), len(_areas))
+        for i in _zones:
+            self.submit_zone_label_request(i)
+        for i in _areas:
+            self.submit_area_label_request(i)
+
+    def save_snapshot(self):
+        '''Saves the alarm state so the next start can use it straight away.'''
+        if self._cache is None:
+            _LOGGER.error('No cache_dir configured for state snapshots.')
+            return False
+        return self._cache.save(self._state)
 
     def request_all_statuses(self, area_total, zone_total):
         '''Submits requests for all area and zone statuses.'''
         _LOGGER.info(str.format("Requesting {0} zone statuses...", zone_total))
         for i in range(1, zone_total + 1):
             self.submit_zone_status_request(i)
-            time.sleep(0.1)
 
         _LOGGER.info(str.format("Requesting {0} area statuses...", area_total))
         for i in range(1, area_total + 1):
             self.submit_area_status_request(i)
-            time.sleep(0.1)
+
+    def resync(self, outage):
+        '''
+        Refreshes what may have changed while the link was down for outage seconds:
+        all areas, and the zones that were not idle or were active shortly before
+        the outage. The other zones are only refreshed after a long outage, as
+        background requests. Returns the number of requests queued.
+        '''
+        _active_since = time.time() - outage - RESYNC_MARGIN
+        _idle = ~ZONE_BIT['bypass'] & 0xFFFF
+        _zones = [i for i in self._zones
+                  if self._state.zone_flags[i] & _idle or
+                  self._state.zone_last_fault(i) >= _active_since]
+        _LOGGER.info('Resynchronising %d areas and %d of %d zones after a %.1f s outage.',
+                     len(self._areas), len(_zones), len(self._zones), outage)
+        for i in self._areas:
+            self.submit_area_status_request(i)
+        for i in _zones:
+            self.submit_zone_status_request(i)
+        _queued = len(self._areas) + len(_zones)
+        if outage >= FULL_RESYNC_AFTER:
+            _active = set(_zones)
+            for i in self._zones:
+                if i not in _active:
+                    self.submit_request("RZ" + str(i).zfill(3), PRIORITY_BACKGROUND)
+                    _queued += 1
+        return _queued
 
     def submit_area_label_request(self, area_num):
         '''Places an area label request on the request queue.'''
-        self.submit_request("AL" + str(area_num).zfill(3))
+        return self.submit_request("AL" + str(area_num).zfill(3))
 
     def submit_zone_label_request(self, zone_num):
         '''Places a zone label request on the request queue.'''
-        self.submit_request("ZL" + str(zone_num).zfill(3))
+        return self.submit_request("ZL" + str(zone_num).zfill(3))
 
     def submit_area_status_request(self, area_num):
         '''Places an area label request on the request queue.'''
-        self.submit_request("RA" + str(area_num).zfill(3))
+        return self.submit_request("RA" + str(area_num).zfill(3))
 
     def submit_zone_status_request(self, zone_num):
         '''Places a zone label request on the request queue.'''
-        self.submit_request("RZ" + str(zone_num).zfill(3))
+        return self.submit_request("RZ" + str(zone_num).zfill(3))
+
+    def submit_request(self, request, priority=None):
+        '''
+        Places a request on the request queue, in the priority class of its command
+        (see alarm_scheduler) unless a priority is given. Returns False if the
+        same request was already waiting.
+        '''
+        return self._to_alarm.put(request, priority=priority)
+
+    def cancel_requests(self, request=None, priority=None):
+        '''
+        Cancels a queued request or all queued requests of a priority class (e.g.
+        a bulk label refresh with PRIORITY_LABEL), or everything queued if neither
+        is given. Futures waiting for the cancelled requests are cancelled too.
+        Returns the number of requests cancelled.
+        '''
+        _cancelled = self._to_alarm.cancel(request, priority)
+        for _request in _cancelled:
+            self._request_tracker.cancel(_request)
+        return len(_cancelled)
+
+    def _queue_request(self, request):
+        '''Places a tracked request on the request queue (from any thread).'''
+        self._to_alarm.put(request)
+
+    def request(self, request, timeout=None, retries=None):
+        '''
+        Submits a request and returns a concurrent.futures.Future for the reply.
+        The future raises ParadoxRequestFailed if the panel answers &fail (after
+        the retries) and ParadoxRequestTimeout if it does not answer in time.
+        '''
+        return self._request_tracker.request(request, timeout, retries)
+
+    def async_request(self, request, timeout=None, retries=None):
+        '''Submits a request and returns an awaitable for the reply.'''
+        return asyncio.wrap_future(self.request(request, timeout, retries))
+
+    def request_zone_label(self, zone_num, timeout=None):
+        '''Requests a zone label, returns a future for the reply.'''
+        return self.request("ZL" + str(zone_num).zfill(3), timeout)
+
+    def request_area_label(self, area_num, timeout=None):
+        '''Requests an area label, returns a future for the reply.'''
+        return self.request("AL" + str(area_num).zfill(3), timeout)
+
+    def request_zone_status(self, zone_num, timeout=None):
+        '''Requests a zone status, returns a future for the reply.'''
+        return self.request("RZ" + str(zone_num).zfill(3), timeout)
 
-    def submit_request(self, request):
-        '''Places a request on the request queue.'''
-        self._to_alarm.put(request, timeout=10)
+    def request_area_status(self, area_num, timeout=None):
+        '''Requests an area status, returns a future for the reply.'''
+        return self.request("RA" + str(area_num).zfill(3), timeout)
+
+    def _build_event_handlers(self):
+        '''Binds the event actions to this panel, indexed by event group.'''
+        _handlers = [None] * EVENT_GROUP_COUNT
+        for _group, _actions in EVENT_ACTIONS.items():
+            _handlers[_group] = tuple((getattr(self, _name), _args) for _name, _args in _actions)
+        return tuple(_handlers)
 
     def decode_system_event(self, response):
         '''Decodes a system event.'''
-        _event_group = response[1:4]
+        _event_group = int(response[1:4])
+        _handlers = self._event_handlers[_event_group] if _event_group < EVENT_GROUP_COUNT else None
+        if _handlers is None:
+            _LOGGER.debug('Event %s (%s) ignored.', response, EVENT_GROUPS.get(_event_group))
+            self._metrics.inc('undecoded_frames', label='G')
+            return
         _event_number = int(response[5:8])
         _area_number = int(response[9:12])
-        if _event_group in ['000']: #Zone closed/OK
-            self.update_zone_status(_event_number, 'C')
-        elif _event_group in ['001']: #Zone open
-            self.update_zone_status(_event_number, 'O')
-        elif _event_group in ['009', '010', '011', '012']: #Area arming
-            self.update_area_status(_area_number, 'A')
-        elif _event_group in ['014']: #Area disarming
-            self.update_area_status(_area_number, 'D')
-        else:
-            _LOGGER.debug(str.format('Event {0} to be defined.', response))
+        for _handler, _args in _handlers:
+            _handler(_event_number, _area_number, *_args)
 
     def decode_response(self, response):
         '''Decode the Paradox Alarm response.'''
-        #2Do: Handle requests that failed, i.e. &fail
-        _msg_type = response[:2]
+        if self._metrics.sample('decode_seconds'):
+            _start = time.perf_counter()
+            self._decode_response(response)
+            self._metrics.observe('decode_seconds', time.perf_counter() - _start,
+                                  response[:1] if response[:1] == 'G' else response[:2])
+        else:
+            self._decode_response(response)
+        for _listener in self._listeners:
+            try:
+                _listener(response)
+            except Exception: #pylint: disable=broad-except
+                _LOGGER.exception('Listener %s failed on %s.', _listener, response)
+
+    def _decode_response(self, response):
+        '''Decode the Paradox Alarm response (dispatch through the tables).'''
+        if self._journal is not None:
+            self._journal.append(response)
+        if self._request_tracker.resolve(response) and response.endswith('&fail'):
+            _LOGGER.warning('Request %s failed.', response[:5])
+            return
         if response[:1] == "G": #System event
             self.decode_system_event(response)
-        elif response[:2] == "ZL": #Zone label
-            self.update_zone_name(int(response[2:5]), response[5:])
-        elif _msg_type == "RZ": #Zone status
-            self.update_zone_status(int(response[2:5]), response[5:])
-        elif response[:2] == "AL": #Area label
-            self.update_area_name(int(response[2:5]), response[5:])
-        elif _msg_type == "RA": #Area status
-            self.update_area_status(int(response[2:5]), response[5:])
+            return
+        _handler = self._response_handlers.get(response[:2])
+        if _handler is None:
+            _LOGGER.debug('Response %s to be defined.', response)
+            self._metrics.inc('undecoded_frames', label=response[:2])
+        else:
+            _handler(int(response[2:5]), response[5:])
+
+    def _event_zone_status(self, zone_number, area_number, zone_status):
+        '''Event action: zone opened, or OK again (closed, no tamper, no fault).'''
+        if 0 < zone_number <= self._max_zones:
+            if area_number and self._state.zone_area(zone_number) != area_number:
+                self._state.set_zone_area(zone_number, area_number)
+            _open = zone_status == 'O'
+            if _open:
+                _changed = self._state.set_zone_flag(zone_number, 'open', True)
+            else:
+                _changed = self._state.clear_zone_flags(zone_number, _ZONE_OK_BITS)
+            if _changed and _open:
+                self._state.set_zone_last_fault(zone_number, time.time())
+            if _changed or not self._change_only:
+                _ignore = self.update_zone_status_cb(zone_number)
+
+    def _event_zone_flag(self, zone_number, area_number, flag, value):
+        '''Event action: set a zone status flag.'''
+        if 0 < zone_number <= self._max_zones:
+            if area_number and self._state.zone_area(zone_number) != area_number:
+                self._state.set_zone_area(zone_number, area_number)
+            _changed = self._state.set_zone_flag(zone_number, flag, value)
+            if _changed and value and flag == 'fault':
+                self._state.set_zone_last_fault(zone_number, time.time())
+            if _changed or not self._change_only:
+                _ignore = self.update_zone_status_cb(zone_number)
+
+    def _event_area_status(self, event_number, area_number, area_status):
+        '''Event action: area armed/disarmed.'''
+        if 0 < area_number <= self._max_areas:
+            self._state.clear_partition_flags(area_number, _DELAY_BITS)
+            self.update_area_status(area_number, area_status)
+
+    def _event_area_flag(self, event_number, area_number, flag, value):
+        '''Event action: set an area status flag (on all areas for area 0).'''
+        _bit = AREA_BIT[flag]
+        self._event_area_bits(area_number, _bit if value else 0, _bit)
+
+    def _event_area_bits(self, area_number, flags, mask):
+        '''Sets the area status bits in mask to those of flags (on all areas for area 0).'''
+        if area_number == 0:
+            _areas = range(1, self._max_areas + 1)
+        elif area_number <= self._max_areas:
+            _areas = [area_number]
+        else:
+            return
+        for _area in _areas:
+            _previous = self._state.set_partition_flags(_area, flags, mask)
+            if (_previous & mask) != (flags & mask) or not self._change_only:
+                _ignore = self.update_area_state_change_cb(_area)
+
+    def _event_trouble(self, event_number, area_number, value):
+        '''Event action: new/restored trouble, AC failure clears ac_present.'''
+        if event_number == TROUBLE_AC_FAILURE:
+            self._event_area_flag(event_number, area_number, 'ac_present', not value)
+        else:
+            self._event_area_flag(event_number, area_number, 'trouble', value)
+
+    def _event_area_status_bits(self, event_number, area_number, flags):
+        '''
+        Event action: status group 1-3, the event number selects the flag. The
+        flag comes on and the flags it rules out (STATUS_CLEARS) go off.
+        '''
+        _flag = flags.get(event_number)
+        if _flag is not None:
+            _bit = AREA_BIT[_flag]
+            _mask = _bit
+            for _cleared in STATUS_CLEARS.get(_flag, ()):
+                _mask |= AREA_BIT[_cleared]
+            self._event_area_bits(area_number, _bit, _mask)
+
+    def _run_callback(self, slot, callback, number):
+        '''
+        Calls a client callback, timing one in every few calls, or hands it to
+        the callback executor (in order per zone/area).
+        '''
+        if callback is None:
+            return
+        if self._callback_executor is not None:
+            self._callback_executor.submit((slot[:4], number), slot, callback, number)
+            return
+        if self._metrics.sample('callback_seconds'):
+            _start = time.perf_counter()
+            callback(number)
+            self._metrics.observe('callback_seconds', time.perf_counter() - _start, slot)
         else:
-            _LOGGER.debug(str.format('Response {0} to be defined.', response))
+            callback(number)
 
     def update_zone_name_cb(self, zone_number):
         '''Callback zone name to connected client.'''
-        _LOGGER.debug(str.format('Zone callback to {}...', self._callback_zone_name))
-        if self._callback_zone_name is not None:
-            self._callback_zone_name(zone_number)
+        _LOGGER.debug('Zone callback to %s...', self._callback_zone_name)
+        self._run_callback('zone_name', self._callback_zone_name, zone_number)
 
     def update_zone_name(self, zone_number, zone_name):
         '''Sets the name of the zone.'''
-        self._alarm_state['zone'][zone_number]['name'] = zone_name
+        if not 0 < zone_number <= self._max_zones:
+            return
+        self._state.set_zone_name(zone_number, zone_name)
+        if self._cache is not None:
+            self._cache.label_updated('zone', zone_number)
         _ignore = self.update_zone_name_cb(zone_number)
 
     def update_zone_status_cb(self, zone_number):
         '''Callback zone status to connected client.'''
-        _LOGGER.debug(str.format('Zone callback to {}...', self._callback_zone_state_change))
-        if self._callback_zone_state_change is not None:
-            self._callback_zone_state_change(zone_number)
+        _LOGGER.debug('Zone callback to %s...', self._callback_zone_state_change)
+        self._run_callback('zone_state_change', self._callback_zone_state_change, zone_number)
 
     def update_zone_status(self, zone_number, zone_status):
-        '''Updates the zone status.'''
-        #ZONE_OPEN = 'O'
-        #ZONE_ALARM = 'A'
-        _status = zone_status[:1]
-        _in_alarm = zone_status[1:2]
-        #_fire = status[2:3]
-        #_supervision_lost = status[3:4]
-        #_low_battery = status[4:5]
-        _zone_info = {'open': (_status == 'O'),
-                        'fault': False,
-                        'alarm': (_in_alarm == 'A'),
-                        'tamper': False}
-        self._alarm_state['zone'][zone_number]['status'] = _zone_info
-        _LOGGER.debug(str.format('Zone {0} status updated.', zone_number))
+        '''Updates the zone status from an RZ reply, e.g. "COOOO".'''
+        if not 0 < zone_number <= self._max_zones:
+            return
+        #C(losed), O(pen), T(ampered) or F(ire loop trouble)
+        _zone_flags = (_ZONE_CONDITION_BITS.get(zone_status[:1], 0) |
+                       (ZONE_BIT['alarm'] if zone_status[1:2] == 'A' else 0) |
+                       (ZONE_BIT['fire'] if zone_status[2:3] == 'F' else 0) |
+                       (ZONE_BIT['supervision_lost'] if zone_status[3:4] == 'S' else 0) |
+                       (ZONE_BIT['low_battery'] if zone_status[4:5] == 'L' else 0))
+        #Bypass is not part of the status reply, keep what the events told us
+        _zone_flags |= self._state.zone_flags[zone_number] & ZONE_BIT['bypass']
+        _previous = self._state.set_zone_flags(zone_number, _zone_flags)
+        if _zone_flags & _FAULT_BITS & ~_previous:
+            self._state.set_zone_last_fault(zone_number, time.time())
+        if _previous == _zone_flags and self._change_only:
+            return
+        _LOGGER.debug('Zone %d status updated.', zone_number)
         #Zone status changed, who needs to know about this?
         _ignore = self.update_zone_status_cb(zone_number)
 
+    def update_area_state_change_cb(self, area_number):
+        '''Callback area state change to connected client.'''
+        _LOGGER.debug('Area state callback to %s...', self._callback_area_state_change)
+        self._run_callback('area_state_change', self._callback_area_state_change, area_number)
+
     def update_area_name_cb(self, area_number):
         '''Callback area name to connected client.'''
-        _LOGGER.debug(str.format('Area name callback to {}...', self._callback_area_name))
-        if self._callback_area_name is not None:
-            self._callback_area_name(area_number)
+        _LOGGER.debug('Area name callback to %s...', self._callback_area_name)
+        self._run_callback('area_name', self._callback_area_name, area_number)
 
     def update_area_name(self, area_number, area_name):
         '''Sets the name of the area/partition.'''
-        self._alarm_state['partition'][area_number]['name'] = area_name
+        if not 0 < area_number <= self._max_areas:
+            return
+        self._state.set_partition_name(area_number, area_name)
+        if self._cache is not None:
+            self._cache.label_updated('partition', area_number)
         _ignore = self.update_area_name_cb(area_number)
 
     def update_area_armed_cb(self, area_number):
         '''Callback area armed to connected client.'''
         _LOGGER.debug('Area status callback to %s...', self._callback_area_armed)
-        if self._callback_area_armed is not None:
-            self._callback_area_armed(area_number)
+        self._run_callback('area_armed', self._callback_area_armed, area_number)
 
     def update_area_stay_armed_cb(self, area_number):
         '''Callback area stay armed to connected client.'''
         _LOGGER.debug('Area status callback to %s...', self._callback_area_stay_armed)
-        if self._callback_area_stay_armed is not None:
-            self._callback_area_stay_armed(area_number)
+        self._run_callback('area_stay_armed', self._callback_area_stay_armed, area_number)
 
     def update_area_disarmed_cb(self, area_number):
         '''Callback area disarmed to connected client.'''
         _LOGGER.debug('Area status callback to %s...', self._callback_area_disarmed)
-        if self._callback_area_disarmed is not None:
-            self._callback_area_disarmed(area_number)
+        self._run_callback('area_disarmed', self._callback_area_disarmed, area_number)
 
     def update_area_status(self, area_number, area_status):
-        '''Updates the area status.'''
+        '''
+        Updates the area status from an RA reply, e.g. "DOOOOOO", or from the
+        arm status letter of an event.
+        '''
+        if not 0 < area_number <= self._max_areas:
+            return
+        #D(isarmed), A(rmed), F(orce armed), S(tay armed) or I(nstant armed)
         _status = area_status[:1]
-        if _status in ['A']:
-            self._alarm_state['partition'][area_number]['status']['armed_away'] = (_status == 'A')
-            _ignore = self.update_area_armed_cb(area_number)
-        elif _status in ['S']:
-            self._alarm_state['partition'][area_number]['status']['armed_stay'] = (_status == 'S')
-            _ignore = self.update_area_stay_armed_cb(area_number)
-        elif _status in ['D']:
-            self._alarm_state['partition'][area_number]['status']['alpha'] = (_status == 'D')
-            _ignore = self.update_area_disarmed_cb(area_number)
+        _flags = _AREA_ARM_BITS.get(_status)
+        if _flags is None:
+            _LOGGER.debug('Area %d status %s not understood.', area_number, area_status)
+            return
+        _mask = _AREA_ARM_MASK
+        if len(area_status) >= 6:
+            #Alarm in M(emory), T(rouble), N(ot ready), P(rogramming), A(larm), S(trobe)
+            _mask |= _AREA_CONDITION_MASK
+            _flags |= ((AREA_BIT['alarm_in_memory'] if area_status[1] == 'M' else 0) |
+                       (AREA_BIT['trouble'] if area_status[2] == 'T' else 0) |
+                       (AREA_BIT['ready'] if area_status[3] != 'N' else 0) |
+                       (AREA_BIT['alarm'] if area_status[5] == 'A' else 0))
+        _previous = self._state.set_partition_flags(area_number, _flags, _mask)
+        _notify = not self._change_only
+        if (_previous ^ _flags) & _AREA_ARM_MASK or _notify:
+            if _status in 'AF':
+                _ignore = self.update_area_armed_cb(area_number)
+            elif _status in 'SI':
+                _ignore = self.update_area_stay_armed_cb(area_number)
+            else:
+                _ignore = self.update_area_disarmed_cb(area_number)
+        if (_previous ^ _flags) & _mask & _AREA_CONDITION_MASK:
+            _ignore = self.update_area_state_change_cb(area_number)
         _LOGGER.debug('Area %d status updated.', area_number)
 
+    @property
+    def event_latency(self):
+        '''Returns the time (in seconds) from serial read to callback completion.'''
+        _count = self._latency_count
+        return {'count': _count,
+                'last': self._latency_last,
+                'max': self._latency_max,
+                'average': (self._latency_total / _count) if _count else 0.0}
+
+    @property
+    def callback_lag(self):
+        '''
+        Returns the time (in seconds) callbacks waited for a worker, with the
+        number waiting, dropped and coalesced. None without callback_workers.
+        '''
+        if self._callback_executor is None:
+            return None
+        return self._callback_executor.lag
+
+    def _dispatch_response(self, item):
+        '''Decodes a single queued response and records its latency.'''
+        if callable(item): #Queued by _run_on_monitor()
+            item()
+            return
+        if isinstance(item, tuple):
+            response, rx_time = item
+        else:
+            response, rx_time = item, None
+        _LOGGER.debug('Response found:%s', response)
+        try:
+            self.decode_response(response)
+        except Exception: #pylint: disable=broad-except
+            #A bad message or a failing callback must not end the monitoring thread
+            _LOGGER.exception('Decoding %s failed.', response)
+        if rx_time is not None:
+            _latency = time.monotonic() - rx_time
+            self._latency_last = _latency
+            self._latency_total += _latency
+            self._latency_count += 1
+            if _latency > self._latency_max:
+                self._latency_max = _latency
+
     def monitor_response_queue(self):
         '''Wait for responses from the Paradox Alarm and decode them (as thread).'''
-        _LOGGER.debug(str.format('Wait for alarm responses/events on the queue...'))
-        self._shutdown = False  #Force endless loop
+        _LOGGER.debug('Wait for alarm responses/events on the queue...')
         while not self._shutdown:
-            try:
-                response = self._from_alarm.get_nowait()
-                _LOGGER.debug(str.format('Response found:{0}', response))
-                self.decode_response(response)
+            item = self._from_alarm.get() #Blocks until something arrives
+            while item is not None:
+                self._dispatch_response(item)
                 self._from_alarm.task_done()
-                time.sleep(0.1)
-            except Empty:
-                time.sleep(5)
-
-        _LOGGER.debug(str.format('Stop monitoring response/event queue...'))
+                try: #Drain a burst of messages in one go
+                    item = self._from_alarm.get_nowait()
+                except Empty:
+                    break
+            else:
+                self._from_alarm.task_done() #The wake-up sentinel put there by stop()
+
+        _LOGGER.debug('Stop monitoring response/event queue...')
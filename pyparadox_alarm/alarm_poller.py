@@ -0,0 +1,109 @@
+'''
+Keeps the alarm state fresh by polling the zones and areas no event confirmed lately.
+
+The panel reports most changes as system events, but events can be missed (a
+lost link, a full buffer) and some conditions are only visible in a status
+reply. The poller sends RZ/RA requests for the entities whose status was not
+set by an event or reply for longer than stale_after, stalest first, within a
+fixed budget of polls per second. Its requests are background requests and
+only one is queued at a time, so they never hold up control or status traffic.
+'''
+
+import logging
+import threading
+import time
+from pyparadox_alarm.alarm_scheduler import PRIORITY_BACKGROUND
+
+_LOGGER = logging.getLogger(__name__)
+
+POLL_SHARE = 0.1 #Share of the requests the link can carry spent on polling
+STALE_AFTER = 600.0 #Seconds after which a status not confirmed by an event is polled
+POLL_EXCHANGE_BYTES = 19 #"RZ001\r" plus "RZ001COOOO\r" and some slack
+IDLE_CHECK = 5.0 #Seconds between checks when nothing is stale
+POLL_RETRY = 10.0 #Seconds before an entity still stale after a poll is polled again
+
+def poll_rate(share, speed, request_interval=None):
+    '''
+    Returns the polls per second for a share of the link: of the requests the
+    fixed request interval allows, or of the exchanges the baud rate can carry.
+    '''
+    if request_interval:
+        return share / request_interval
+    return share * speed / 10.0 / POLL_EXCHANGE_BYTES
+
+class ParadoxStatusPoller:
+    '''
+    Polls the stale zones and areas of a CompactAlarmState on its own thread.
+    submit(request, priority) queues a request and busy() returns True while
+    background requests are still waiting; rate is the budget in polls per
+    second. zones and areas are the numbers polled, all of the state by default.
+    '''
+    def __init__(self, state, submit, busy, rate, stale_after=STALE_AFTER, zones=None,
+                 areas=None):
+        self._state = state
+        self._zones = tuple(range(1, state.max_zones + 1)) if zones is None else tuple(zones)
+        self._areas = (tuple(range(1, state.max_partitions + 1)) if areas is None
+                       else tuple(areas))
+        self._submit = submit
+        self._busy = busy
+        self._interval = 1.0 / rate
+        self._stale_after = stale_after
+        self._stopping = threading.Event()
+        self._thread = None
+        self._polled = {} #Request -> time it was last submitted
+        self.polls = 0
+
+    @property
+    def rate(self):
+        '''Returns the budget in polls per second.'''
+        return 1.0 / self._interval
+
+    def stale(self, now=None):
+        '''Returns [(updated, request), ...] of the stale zones and areas, stalest first.'''
+        _limit = (time.time() if now is None else now) - self._stale_after
+        _state = self._state
+        _stale = [(_state.partition_updated(i), 'RA' + str(i).zfill(3))
+                  for i in self._areas
+                  if _state.partition_updated(i) < _limit]
+        _stale += [(_state.zone_updated(i), 'RZ' + str(i).zfill(3))
+                   for i in self._zones
+                   if _state.zone_updated(i) < _limit]
+        _stale.sort()
+        return _stale
+
+    def start(self):
+        '''Starts polling.'''
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._poll, daemon=True, name='ParadoxPoller')
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        '''Stops polling.'''
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _poll(self):
+        '''Submits the stalest status request once per interval (as thread).'''
+        _next = time.monotonic()
+        while not self._stopping.is_set():
+            _wait = _next - time.monotonic()
+            if _wait > 0 and self._stopping.wait(_wait):
+                break
+            if self._busy():
+                _next = time.monotonic() + self._interval
+                continue
+            _now = time.monotonic()
+            _polled = self._polled
+            #Not again while its reply may still be on its way
+            _stale = [_request for _, _request in self.stale()
+                      if _now - _polled.get(_request, float('-inf')) >= POLL_RETRY]
+            if not _stale:
+                _next = _now + IDLE_CHECK
+                continue
+            _LOGGER.debug('Polling %s, %d statuses stale.', _stale[0], len(_stale))
+            _polled[_stale[0]] = _now
+            self._submit(_stale[0], PRIORITY_BACKGROUND)
+            self.polls += 1
+            _next = max(_next + self._interval, time.monotonic())
@@ -0,0 +1,395 @@
+'''
+Runs the serial link and the decoding in a child process.
+
+The child owns the ParadoxAlarmPanel and publishes the alarm state into a
+shared memory segment with a fixed layout; the host process reads it in place,
+so a busy host interpreter can no longer hold up reading the serial port.
+The segment is guarded by a sequence counter (a seqlock): the child makes it
+odd before it writes and even again after, readers that need several values
+to be consistent retry when the counter was odd or changed while they read.
+Callbacks are passed to the host through a pipe once the state they announce
+is in the segment, requests go the other way.
+
+Layout of the segment (native byte order):
+  header      sequence (uint64), version (uint32), zones, partitions (uint16)
+  zone flags  uint16 per zone (index 0 unused)
+  area flags  uint32 per partition
+  last fault  double per zone
+  names       NAME_SIZE bytes of utf-8 per zone, then per partition
+'''
+
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+from struct import Struct
+from pyparadox_alarm.alarm_state import AlarmStateView, AlarmStateSnapshot
+
+_LOGGER = logging.getLogger(__name__)
+
+HEADER = Struct('=QIHH')
+NAME_SIZE = 32 #Bytes per name, PRT3 labels are 16 characters
+STOP_TIMEOUT = 5 #Seconds the child gets to stop before it is terminated
+START_TIMEOUT = 30 #Seconds the child gets to start the panel
+#Client callbacks by slot, as run by ParadoxAlarmPanel._run_callback()
+CALLBACK_SLOTS = ('zone_name', 'area_name', 'zone_state_change', 'area_armed',
+                  'area_stay_armed', 'area_disarmed', 'area_state_change')
+
+def _align(offset):
+    '''Rounds an offset up to 8 bytes.'''
+    return (offset + 7) & ~7
+
+class SharedAlarmState:
+    '''
+    Alarm state in a shared memory buffer. Offers the same read interface as
+    CompactAlarmState (zone_flags, partition_flags, zone_name()... and view),
+    reading the buffer in place. The writing side wraps its changes in
+    write_begin()/write_end(), snapshot() returns a consistent copy.
+    '''
+    def __init__(self, buffer, max_zones=None, max_partitions=None):
+        if max_zones is None:
+            _, _, max_zones, max_partitions = HEADER.unpack_from(buffer)
+        else:
+            HEADER.pack_into(buffer, 0, 0, 0, max_zones, max_partitions)
+        self.max_zones = max_zones
+        self.max_partitions = max_partitions
+        _zones = max_zones + 1
+        _partitions = max_partitions + 1
+        _buffer = memoryview(buffer)
+        self._buffer = _buffer
+        self._sequence = _buffer[0:8].cast('Q')
+        self._version = _buffer[8:12].cast('I')
+        _offset = HEADER.size
+        self.zone_flags = _buffer[_offset:_offset + 2 * _zones].cast('H')
+        _offset = _align(_offset + 2 * _zones)
+        self.partition_flags = _buffer[_offset:_offset + 4 * _partitions].cast('I')
+        _offset = _align(_offset + 4 * _partitions)
+        self._faults = _buffer[_offset:_offset + 8 * _zones].cast('d')
+        _offset += 8 * _zones
+        self._zone_names = _offset
+        self._partition_names = _offset + NAME_SIZE * _zones
+        self.view = AlarmStateView(self)
+
+    @staticmethod
+    def size(max_zones, max_partitions):
+        '''Returns the bytes needed for the state of a panel.'''
+        _offset = _align(HEADER.size + 2 * (max_zones + 1))
+        _offset = _align(_offset + 4 * (max_partitions + 1))
+        return _offset + 8 * (max_zones + 1) + NAME_SIZE * (max_zones + max_partitions + 2)
+
+    @property
+    def version(self):
+        '''Returns the version of the state last published.'''
+        return self._version[0]
+
+    def zone_name(self, number):
+        '''Returns the name of the zone.'''
+        _name = self._name(self._zone_names, number)
+        return ('Zone ' + str(number) + ' label default') if _name is None else _name
+
+    def partition_name(self, number):
+        '''Returns the name of the partition.'''
+        _name = self._name(self._partition_names, number)
+        return ('Area ' + str(number) + ' label default') if _name is None else _name
+
+    def zone_last_fault(self, number):
+        '''Returns the time of the last fault of the zone.'''
+        return self._faults[number]
+
+    def snapshot(self):
+        '''Returns an AlarmStateSnapshot, copied while no write was in progress.'''
+        while True:
+            _sequence = self._sequence[0]
+            if _sequence & 1: #Being written
+                time.sleep(0)
+                continue
+            _snapshot = AlarmStateSnapshot(
+                self._version[0], self.zone_flags.tolist(), self.partition_flags.tolist(),
+                tuple(self.zone_name(i) for i in range(self.max_zones + 1)),
+                tuple(self.partition_name(i) for i in range(self.max_partitions + 1)),
+                tuple(self._faults.tolist()))
+            if self._sequence[0] == _sequence:
+                return _snapshot
+
+    def write_begin(self):
+        '''Marks the state as being written.'''
+        self._sequence[0] += 1
+
+    def write_end(self, version):
+        '''Publishes the version written.'''
+        self._version[0] = version
+        self._sequence[0] += 1
+
+    def set_flags(self, kind, number, flags):
+        '''Sets the status bits of a zone or partition (between write_begin and write_end).'''
+        if kind == 'zone':
+            self.zone_flags[number] = flags
+        else:
+            self.partition_flags[number] = flags
+
+    def set_name(self, kind, number, name):
+        '''Sets the name of a zone or partition.'''
+        _offset = ((self._zone_names if kind == 'zone' else self._partition_names) +
+                   number * NAME_SIZE)
+        _encoded = (name or '').encode('utf-8')[:NAME_SIZE]
+        self._buffer[_offset:_offset + NAME_SIZE] = _encoded.ljust(NAME_SIZE, b'\0')
+
+    def set_last_fault(self, number, last_fault):
+        '''Sets the time of the last fault of a zone.'''
+        self._faults[number] = last_fault or 0
+
+    def load(self, snapshot):
+        '''
+        Copies everything from a snapshot (between write_begin and write_end), the
+        zones and partitions beyond those of the snapshot are cleared.
+        '''
+        for i in range(self.max_zones + 1):
+            _known = i <= snapshot.max_zones
+            self.zone_flags[i] = snapshot.zone_flags[i] if _known else 0
+            self._faults[i] = (snapshot.zone_last_fault(i) or 0) if _known else 0
+            self.set_name('zone', i, snapshot.zone_name(i) if _known else None)
+        for i in range(self.max_partitions + 1):
+            _known = i <= snapshot.max_partitions
+            self.partition_flags[i] = snapshot.partition_flags[i] if _known else 0
+            self.set_name('partition', i, snapshot.partition_name(i) if _known else None)
+
+    def release(self):
+        '''Releases the buffer, the state can no longer be read.'''
+        for _view in (self._sequence, self._version, self.zone_flags, self.partition_flags,
+                      self._faults, self._buffer):
+            _view.release()
+
+    def _name(self, offset, number):
+        '''Returns a name stored in the buffer, None if none was.'''
+        _offset = offset + number * NAME_SIZE
+        _name = bytes(self._buffer[_offset:_offset + NAME_SIZE]).rstrip(b'\0')
+        return _name.decode('utf-8', 'replace') if _name else None
+
+
+class _StatePublisher:
+    '''Child side: copies the changes of the panel into the segment, then notifies the host.'''
+
+    def __init__(self, panel, shared, connection):
+        self._panel = panel
+        self._shared = shared
+        self._connection = connection
+        self._version = -1
+        self._callbacks = []
+        self._lock = threading.Lock() #Sends come from the monitoring and the main thread
+
+    def send(self, kind, item):
+        '''Sends a notification to the host.'''
+        with self._lock:
+            self._connection.send((kind, item))
+
+    def callback(self, slot):
+        '''Returns the callback that notes a call of the slot for the host.'''
+        return lambda number: self._callbacks.append((slot, number))
+
+    def publish(self, message=None):
+        '''Writes what changed since the last publication and sends the callbacks noted.'''
+        _version, _changes = self._panel.changes_since(self._version, raw=True)
+        if _version != self._version:
+            _shared = self._shared
+            _shared.write_begin()
+            try:
+                if _changes is None or self._version < 0:
+                    _snapshot = self._panel.snapshot()
+                    _version = _snapshot.version
+                    _shared.load(_snapshot)
+                else:
+                    for _, (_kind, _number), _field, _value in _changes:
+                        if _field == 'status':
+                            _shared.set_flags(_kind, _number, _value)
+                        elif _field == 'name':
+                            _shared.set_name(_kind, _number, _value)
+                        else:
+                            _shared.set_last_fault(_number, _value)
+            finally:
+                _shared.write_end(_version)
+            self._version = _version
+        if self._callbacks:
+            _callbacks = self._callbacks
+            self._callbacks = []
+            self.send('callbacks', _callbacks)
+
+
+def _run_engine(segment_name, connection, panel_args):
+    '''Runs the panel in the child process until the host asks it to stop.'''
+    from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel #pylint: disable=import-outside-toplevel
+    _segment = shared_memory.SharedMemory(segment_name)
+    _panel = ParadoxAlarmPanel(**panel_args)
+    _shared = SharedAlarmState(_segment.buf)
+    _publisher = _StatePublisher(_panel, _shared, connection)
+    for _slot in CALLBACK_SLOTS:
+        setattr(_panel, 'callback_' + _slot, _publisher.callback(_slot))
+    _panel.add_listener(_publisher.publish)
+    try:
+        _publisher.publish() #The state loaded from the cache, if any
+        _panel.start()
+        _publisher.send('started', None)
+        while True:
+            _item = connection.recv()
+            if _item is None:
+                break
+            _request, _priority = _item
+            _panel.submit_request(_request, _priority)
+    except (EOFError, OSError): #The host went away
+        pass
+    except Exception as err: #pylint: disable=broad-except
+        _LOGGER.exception('Paradox I/O process failed.')
+        _publisher.send('failed', str(err))
+    finally:
+        _panel.stop()
+        _shared.release()
+        _segment.close()
+
+
+def _callback_property(slot):
+    '''Returns the property of a client callback.'''
+    def _get(self):
+        return self._callbacks.get(slot)
+    def _set(self, value):
+        self._callbacks[slot] = value
+    return property(_get, _set, doc=str.format('Function subscribed to {0}.', slot))
+
+class ParadoxProcessPanel:
+    '''
+    A ParadoxAlarmPanel running in a child process. Takes the arguments of
+    ParadoxAlarmPanel; alarm_state and snapshot() read the shared state, the
+    callbacks are called on a thread of the host once the state they announce
+    can be read. Requests are passed on to the panel in the child.
+    '''
+    callback_zone_name = _callback_property('zone_name')
+    callback_area_name = _callback_property('area_name')
+    callback_zone_state_change = _callback_property('zone_state_change')
+    callback_area_armed = _callback_property('area_armed')
+    callback_area_stay_armed = _callback_property('area_stay_armed')
+    callback_area_disarmed = _callback_property('area_disarmed')
+    callback_area_state_change = _callback_property('area_state_change')
+
+    def __init__(self, paradox_model='EVO48', **panel_args):
+        from pyparadox_alarm.paradox_defaults import PARADOX_MODELS #pylint: disable=import-outside-toplevel
+        self._panel_args = dict(panel_args, paradox_model=paradox_model)
+        #Without a model the panel discovers it, make room for the largest
+        _models = [PARADOX_MODELS[paradox_model]] if paradox_model else PARADOX_MODELS.values()
+        self._max_zones = max(model['max zones'] for model in _models)
+        self._max_areas = max(model['max areas'] for model in _models)
+        self._callbacks = {}
+        self._segment = None
+        self._shared = None
+        self._process = None
+        self._connection = None
+        self._send_lock = threading.Lock()
+        self._receiver = None
+        self._started = threading.Event()
+        self._failure = None
+
+    def _require_shared(self):
+        '''Returns the shared state, raises RuntimeError while the process is not running.'''
+        if self._shared is None:
+            raise RuntimeError('ParadoxProcessPanel is not running, call start() first.')
+        return self._shared
+
+    @property
+    def alarm_state(self):
+        '''Returns a read-only, live mapping of the shared alarm state.'''
+        return self._require_shared().view
+
+    @property
+    def state_version(self):
+        '''Returns the version of the shared alarm state.'''
+        return self._require_shared().version
+
+    @property
+    def pid(self):
+        '''Returns the process id of the child, None while it is not running.'''
+        return self._process.pid if self._process is not None else None
+
+    def snapshot(self):
+        '''Returns a consistent AlarmStateSnapshot of the shared alarm state.'''
+        return self._require_shared().snapshot()
+
+    def start(self, timeout=START_TIMEOUT):
+        '''Starts the child process and waits for it to connect to the panel.'''
+        _size = SharedAlarmState.size(self._max_zones, self._max_areas)
+        self._segment = shared_memory.SharedMemory(create=True, size=_size)
+        self._shared = SharedAlarmState(self._segment.buf, self._max_zones, self._max_areas)
+        _context = multiprocessing.get_context('spawn') #Never fork the threads of the host
+        self._connection, _child = _context.Pipe()
+        self._started.clear()
+        self._failure = None
+        self._process = _context.Process(target=_run_engine, daemon=True,
+                                         args=(self._segment.name, _child, self._panel_args),
+                                         name='ParadoxIO')
+        self._process.start()
+        _child.close()
+        self._receiver = threading.Thread(target=self._receive, daemon=True,
+                                          name='ParadoxProcessReceiver')
+        self._receiver.start()
+        if not self._started.wait(timeout) or self._failure is not None:
+            self.stop()
+            raise OSError(str.format('Paradox I/O process did not start: {0}',
+                                     self._failure or 'timed out'))
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        '''Stops the child process and releases the shared state.'''
+        if self._process is None:
+            return
+        try:
+            with self._send_lock:
+                self._connection.send(None)
+        except OSError:
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            _LOGGER.warning('Paradox I/O process did not stop, terminating it.')
+            self._process.terminate()
+            self._process.join(timeout)
+        self._process = None
+        self._connection.close()
+        if self._receiver is not None and self._receiver is not threading.current_thread():
+            self._receiver.join(timeout)
+        self._receiver = None
+        self._shared.release()
+        self._shared = None
+        self._segment.close()
+        self._segment.unlink()
+        self._segment = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit_request(self, request, priority=None):
+        '''Passes a request to the panel in the child process.'''
+        self._require_shared()
+        with self._send_lock:
+            self._connection.send((request, priority))
+
+    def _receive(self):
+        '''Calls the callbacks the child reports (as thread).'''
+        while True:
+            try:
+                _kind, _item = self._connection.recv()
+            except (EOFError, OSError):
+                break
+            if _kind == 'callbacks':
+                for _slot, _number in _item:
+                    _callback = self._callbacks.get(_slot)
+                    if _callback is None:
+                        continue
+                    try:
+                        _callback(_number)
+                    except Exception: #pylint: disable=broad-except
+                        _LOGGER.exception('Callback %s for %s failed.', _slot, _number)
+            elif _kind == 'started':
+                self._started.set()
+            elif _kind == 'failed':
+                self._failure = _item
+                self._started.set()
+        _LOGGER.debug('Paradox I/O process closed its pipe.')
@@ -0,0 +1,186 @@
+'''
+Correlates requests to the Paradox alarm panel with the replies it sends back.
+
+Replies to PRT3 requests start with the command and number of the request,
+e.g. "ZL005" is answered by "ZL005Front door", "AA001" by "AA001&ok" or
+"AA001&fail". The tracker hands out a future per request and completes it with
+the matching reply, retrying requests that fail or time out.
+'''
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from pyparadox_alarm.alarm_flow_control import reply_key
+
+_LOGGER = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 10 #Seconds to wait for a reply, including pacing delays
+REQUEST_RETRIES = 2
+REPLY_FAILED = '&fail'
+
+class ParadoxRequestFailed(Exception):
+    '''Raised when the panel keeps answering a request with &fail.'''
+
+class ParadoxRequestTimeout(FutureTimeoutError):
+    '''Raised when the panel does not answer a request in time.'''
+
+class _PendingRequest:
+    '''A request waiting for its reply.'''
+    __slots__ = ['request', 'future', 'timeout', 'retries', 'deadline']
+
+    def __init__(self, request, future, timeout, retries):
+        self.request = request
+        self.future = future
+        self.timeout = timeout
+        self.retries = retries
+        self.deadline = time.monotonic() + timeout
+
+class ParadoxRequestTracker:
+    '''
+    Keeps track of requests waiting for a reply.
+    Requests with the same command and number are answered in the order they were
+    submitted; a request keeps its place when it is retried. A single timer
+    thread takes care of timeouts and retries.
+    '''
+    def __init__(self, submit, timeout=REQUEST_TIMEOUT, retries=REQUEST_RETRIES):
+        self._submit = submit
+        self._timeout = timeout
+        self._retries = retries
+        self._pending = {}
+        self._lock = threading.Condition()
+        self._timer_thread = None
+        self._closed = False
+
+    @property
+    def pending(self):
+        '''Returns the number of requests waiting for a reply.'''
+        with self._lock:
+            return sum(len(_waiting) for _waiting in self._pending.values())
+
+    def request(self, request, timeout=None, retries=None):
+        '''Submits a request and returns a future that resolves to its reply.'''
+        _future = Future()
+        _pending = _PendingRequest(request, _future,
+                                   self._timeout if timeout is None else timeout,
+                                   self._retries if retries is None else retries)
+        with self._lock:
+            if self._closed:
+                _future.set_exception(ParadoxRequestFailed('Request tracker has been closed.'))
+                return _future
+            self._pending.setdefault(reply_key(request), deque()).append(_pending)
+            if self._timer_thread is None:
+                self._timer_thread = threading.Thread(target=self._expire_requests, daemon=True)
+                self._timer_thread.start()
+            self._lock.notify()
+        self._submit(request)
+        return _future
+
+    def resolve(self, response):
+        '''
+        Completes the future of the request the response answers.
+        Returns True if the response was a reply to a tracked request.
+        '''
+        if not self._pending: #Nothing tracked, skip the lock
+            return False
+        _key = reply_key(response)
+        with self._lock:
+            _waiting = self._pending.get(_key)
+            if not _waiting:
+                return False
+            _pending = _waiting[0]
+            if response.endswith(REPLY_FAILED) and _pending.retries > 0:
+                self._retry(_pending)
+                return True
+            _waiting.popleft()
+            #Identical requests waiting were sent only once, this reply answers them all
+            _answered = [_pending]
+            while _waiting and _waiting[0].request == _pending.request:
+                _answered.append(_waiting.popleft())
+            if not _waiting:
+                del self._pending[_key]
+        for _pending in _answered:
+            if _pending.future.cancelled():
+                pass
+            elif response.endswith(REPLY_FAILED):
+                _pending.future.set_exception(ParadoxRequestFailed(
+                    str.format('Request {0} failed.', _pending.request)))
+            else:
+                _pending.future.set_result(response)
+        return True
+
+    def cancel(self, request):
+        '''Cancels the futures of the pending requests identical to request.'''
+        _key = reply_key(request)
+        with self._lock:
+            _waiting = self._pending.get(_key)
+            if not _waiting:
+                return 0
+            _cancelled = [_item for _item in _waiting if _item.request == request]
+            _waiting = deque(_item for _item in _waiting if _item.request != request)
+            if _waiting:
+                self._pending[_key] = _waiting
+            else:
+                del self._pending[_key]
+        for _item in _cancelled:
+            _item.future.cancel()
+        return len(_cancelled)
+
+    def open(self):
+        '''Accepts requests again after close().'''
+        with self._lock:
+            self._closed = False
+
+    def close(self, timeout=1.0):
+        '''Cancels all pending requests and waits up to timeout for the timer thread to stop.'''
+        with self._lock:
+            self._closed = True
+            _pending = [_item for _waiting in self._pending.values() for _item in _waiting]
+            self._pending.clear()
+            _thread = self._timer_thread
+            self._lock.notify()
+        for _item in _pending:
+            _item.future.cancel()
+        if _thread is not None and _thread is not threading.current_thread():
+            _thread.join(timeout)
+
+    def _retry(self, pending):
+        '''Re-submits a request, which stays where it is among those waiting (lock held).'''
+        _LOGGER.debug('Retrying request %s...', pending.request)
+        pending.retries -= 1
+        pending.deadline = time.monotonic() + pending.timeout
+        self._submit(pending.request)
+
+    def _expire_requests(self):
+        '''Retries or fails requests without a reply (as thread).'''
+        while True:
+            _failed = []
+            with self._lock:
+                if self._closed:
+                    self._timer_thread = None #The next request starts a new one
+                    break
+                _now = time.monotonic()
+                _next = None
+                for _key in list(self._pending):
+                    _waiting = self._pending[_key]
+                    #Not only the oldest: a shorter timeout may expire behind it
+                    for _pending in [_item for _item in _waiting if _item.deadline <= _now]:
+                        if _pending.retries > 0 and not _pending.future.cancelled():
+                            self._retry(_pending)
+                            continue
+                        _waiting.remove(_pending)
+                        if not _pending.future.cancelled():
+                            _failed.append(_pending)
+                    if _waiting:
+                        _wait = min(_item.deadline for _item in _waiting) - _now
+                        _next = _wait if _next is None else min(_next, _wait)
+                    else:
+                        del self._pending[_key]
+                if not _failed:
+                    self._lock.wait(_next)
+                    continue
+            #Complete the futures outside the lock, their callbacks may submit new requests
+            for _pending in _failed:
+                _pending.future.set_exception(ParadoxRequestTimeout(
+                    str.format('No reply to request {0}.', _pending.request)))
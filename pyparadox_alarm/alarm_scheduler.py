@@ -0,0 +1,213 @@
+'''
+Orders the requests waiting to be written to the panel.
+
+Requests are queued in priority classes: control commands (arm, disarm, panic,
+utility keys) before status requests, before label requests, before background
+work. Within a class requests keep their order. A request that is already
+waiting is not queued twice, and queued requests can be cancelled.
+Requests waiting long in a lower class are aged up, one class per aging
+interval, so a steady stream of status polls cannot starve the labels; aging
+never lifts a request to the control class.
+'''
+
+import threading
+import time
+from collections import deque
+from queue import Empty
+
+PRIORITY_CONTROL = 0
+PRIORITY_STATUS = 1
+PRIORITY_LABEL = 2
+PRIORITY_BACKGROUND = 3
+PRIORITY_NAMES = ('control', 'status', 'label', 'background')
+AGING_INTERVAL = 5.0 #Seconds waited per class a request is moved up
+
+#Priority class of the requests by command, anything else is a control command
+REQUEST_PRIORITIES = {'RZ': PRIORITY_STATUS, 'RA': PRIORITY_STATUS,
+                      'ZL': PRIORITY_LABEL, 'AL': PRIORITY_LABEL, 'UL': PRIORITY_LABEL}
+
+def request_priority(request):
+    '''Returns the priority class of a request by its command.'''
+    return REQUEST_PRIORITIES.get(request[:2], PRIORITY_CONTROL)
+
+class _QueuedRequest:
+    '''A request waiting in the scheduler.'''
+    __slots__ = ['request', 'priority', 'queued', 'cancelled']
+
+    def __init__(self, request, priority, queued):
+        self.request = request
+        self.priority = priority
+        self.queued = queued
+        self.cancelled = False
+
+class ParadoxRequestScheduler:
+    '''
+    Priority queue of requests, a drop-in for the Queue between ParadoxAlarmPanel
+    and ParadoxSerialComms (put, get, task_done and qsize).
+    on_put, if set, is called without arguments after every put() and requeue(),
+    on the thread that queued; it lets an event loop wait for requests without
+    blocking in get().
+    '''
+    def __init__(self, aging_interval=AGING_INTERVAL, on_put=None):
+        self._aging_interval = aging_interval
+        self.on_put = on_put
+        self._queues = tuple(deque() for _ in PRIORITY_NAMES)
+        self._queued = {}
+        self._lock = threading.Condition()
+        self._wakeups = 0
+        self.duplicates = 0
+        self.cancelled = 0
+
+    def qsize(self):
+        '''Returns the number of requests waiting.'''
+        return len(self._queued)
+
+    def pending(self, priority):
+        '''Returns the number of requests waiting in a priority class.'''
+        with self._lock:
+            return sum(1 for _item in self._queues[priority] if not _item.cancelled)
+
+    def put(self, request, block=True, timeout=None, priority=None):
+        '''
+        Queues a request, in the class of its command unless a priority is given.
+        Returns False if the same request was already waiting: it is then only
+        moved up if the new priority is higher. Raises ValueError for a priority
+        that is not a class. Never blocks, the arguments are there to match
+        Queue.put().
+        None is a wake-up sentinel: get() returns it before any request.
+        '''
+        if request is None:
+            with self._lock:
+                self._wakeups += 1
+                self._lock.notify()
+            self._notify()
+            return True
+        if priority is None:
+            priority = request_priority(request)
+        elif not 0 <= priority < len(PRIORITY_NAMES):
+            raise ValueError(str.format('Unknown priority {0}, use 0 to {1}.',
+                                        priority, len(PRIORITY_NAMES) - 1))
+        with self._lock:
+            _waiting = self._queued.get(request)
+            if _waiting is not None:
+                self.duplicates += 1
+                if priority < _waiting.priority:
+                    _waiting.cancelled = True
+                    self._queue(request, priority, _waiting.queued)
+                return False
+            self._queue(request, priority, time.monotonic())
+            self._lock.notify()
+        self._notify()
+        return True
+
+    def requeue(self, request, priority):
+        '''
+        Puts a request taken with take() but not written back in front of its
+        class, e.g. when the connection closed before it could be written.
+        '''
+        with self._lock:
+            _waiting = self._queued.get(request)
+            if _waiting is not None: #Queued again meanwhile, only keep the higher class
+                if priority < _waiting.priority:
+                    _waiting.cancelled = True
+                    self._queue(request, priority, _waiting.queued, True)
+                return
+            self._queue(request, priority, time.monotonic(), True)
+            self._lock.notify()
+        self._notify()
+
+    def get(self, block=True, timeout=None):
+        '''Removes and returns the next request, raises queue.Empty as Queue.get() does.'''
+        return self.take(block, timeout)[0]
+
+    def take(self, block=True, timeout=None):
+        '''
+        Removes and returns the next request with its priority class, as get()
+        does. The wake-up sentinel is returned as (None, None).
+        '''
+        _deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while True:
+                if self._wakeups:
+                    self._wakeups -= 1
+                    return None, None
+                _next = self._next()
+                if _next is not None:
+                    del self._queued[_next.request]
+                    return _next.request, _next.priority
+                if not block:
+                    raise Empty
+                if _deadline is None:
+                    self._lock.wait()
+                else:
+                    _remaining = _deadline - time.monotonic()
+                    if _remaining <= 0:
+                        raise Empty
+                    self._lock.wait(_remaining)
+
+    def task_done(self):
+        '''Nothing to do, there for compatibility with Queue.'''
+
+    def cancel(self, request=None, priority=None):
+        '''
+        Cancels a waiting request, or all waiting requests of a priority class
+        (or both: the request only if it is in that class). Returns the requests
+        cancelled.
+        '''
+        with self._lock:
+            if request is not None:
+                _items = [self._queued[request]] if request in self._queued else []
+                if priority is not None:
+                    _items = [_item for _item in _items if _item.priority == priority]
+            elif priority is not None:
+                _items = [_item for _item in self._queues[priority] if not _item.cancelled]
+                self._queues[priority].clear()
+            else:
+                _items = list(self._queued.values())
+                for _queue in self._queues:
+                    _queue.clear()
+            for _item in _items:
+                _item.cancelled = True
+                del self._queued[_item.request]
+            self.cancelled += len(_items)
+            return [_item.request for _item in _items]
+
+    def _queue(self, request, priority, queued, first=False):
+        '''Adds a request to its class, at the back or first in line (lock held).'''
+        _item = _QueuedRequest(request, priority, queued)
+        self._queued[request] = _item
+        if first:
+            self._queues[priority].appendleft(_item)
+        else:
+            self._queues[priority].append(_item)
+
+    def _notify(self):
+        '''Calls on_put, if set (lock not held).'''
+        _on_put = self.on_put
+        if _on_put is not None:
+            _on_put()
+
+    def _next(self):
+        '''
+        Returns and dequeues the request to write next, None if none is waiting
+        (lock held). Control requests always go first, the other classes compete
+        on their class minus the aging of the request at their head.
+        '''
+        _best = None
+        _best_rank = None
+        _now = time.monotonic()
+        for _priority, _queue in enumerate(self._queues):
+            while _queue and _queue[0].cancelled:
+                _queue.popleft()
+            if not _queue:
+                continue
+            if _priority == PRIORITY_CONTROL:
+                return _queue.popleft()
+            #Equal ranks go to the request waiting longest
+            _rank = (max(PRIORITY_STATUS,
+                         _priority - int((_now - _queue[0].queued) / self._aging_interval)),
+                     _queue[0].queued)
+            if _best_rank is None or _rank < _best_rank:
+                _best = _queue
+                _best_rank = _rank
+        return _best.popleft() if _best is not None else None
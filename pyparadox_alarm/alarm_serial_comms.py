@@ -7,76 +7,136 @@ Created on 10 Aug 2016
 '''
 
 import threading
+from collections import deque
 from multiprocessing import Lock
-import re
 import time
 import logging
-import serial
-from serial.serialutil import SerialException
+from pyparadox_alarm.alarm_framing import ParadoxFramer
+from pyparadox_alarm.alarm_transport import create_transport, release_transport
+from pyparadox_alarm.alarm_flow_control import reply_key
+from pyparadox_alarm.alarm_metrics import ParadoxMetrics
+from pyparadox_alarm.alarm_supervisor import ParadoxLinkSupervisor, SILENCE_TIMEOUT
 
 _LOGGER = logging.getLogger(__name__)
 
+REQUEST_INTERVAL = 2 #Conservative time (in seconds) to wait after every request
+PROBE_REQUEST = 'RA001' #Harmless request the panel always answers
+LINK_WAIT = 1 #Seconds the threads wait for a lost link before checking for shutdown
+JOIN_TIMEOUT = 1 #Seconds stop() waits for each thread
+DRAIN_TIMEOUT = 10 #Seconds stop(drain=True) waits for queued requests to be answered
+
 class ParadoxSerialComms:
     '''
     This manages serial communication with the paradox alarm panel by acting as message broker.
     It establishes the connection and handle requests and responses using threads.
-    The response thread places messages from the alarm panel on the response queue.
+    The connection is made through a transport: the serial port, or a TCP connection
+    for ports like "socket://host:port".
+    The response thread places messages from the alarm panel on the response queue,
+    together with the (monotonic) time they were read.
     The request thread submit requests found on the request queue to the alarm panel.
+    Requests are spaced by a fixed request interval unless a flow control is given,
+    in which case they are paced by the replies of the panel.
+    Traffic, round trip times and reconnects are counted in the metrics.
+    A ParadoxLinkSupervisor re-opens the connection when it is lost, writes the
+    unanswered requests again and then calls on_reconnect(outage in seconds).
     '''
-    def __init__(self, request_queue, response_queue, port, speed):
+    def __init__(self, request_queue, response_queue, port, speed,
+                 flow_control=None, request_interval=REQUEST_INTERVAL, transport=None,
+                 metrics=None, silence_timeout=SILENCE_TIMEOUT, on_reconnect=None):
         self._port = port
         self._speed = speed
-        self._pipe = None
+        self._pipe = transport
         self._lock = None
         self._shutdown = None
+        self._framer = ParadoxFramer()
+        self._flow_control = flow_control
+        self._request_interval = request_interval
+        self._metrics = metrics if metrics is not None else ParadoxMetrics()
+        self._sent_times = {} #Request command/number: times written, to measure round trips
+        self._reconnects = 0
+        self._metrics.set_gauge('reconnects', lambda: self._reconnects)
+        self._metrics.set_gauge('dropped_frames', lambda: self._framer.dropped)
+        self._on_reconnect = on_reconnect
+        self._stopping = threading.Event()
+        self._threads = []
+        self._writing = False
+        self._supervisor = ParadoxLinkSupervisor(self._reopen, self._probe, self._restored,
+                                                 silence_timeout)
         self.request_queue = request_queue
         self.response_queue = response_queue
 
     def connect(self):
         '''
-        Opens a serial connection to the Paradox Alarm Panel.
-        To do: Add a loop to attempt a connection several times before giving up.
+        Opens a connection to the Paradox Alarm Panel.
+        Returns False if it could not be opened: the supervisor keeps trying once started.
         '''
         self._lock = Lock() #Does this do anything?
-
+        self._shutdown = False
         try:
-            self._pipe = serial.Serial(self._port, self._speed, timeout=1)
-            self._pipe.flushInput() #Gets rid of /X0 after being disconnected for long?
-        except SerialException:
+            if self._pipe is None:
+                self._pipe = create_transport(self._port, self._speed)
+            self._pipe.open()
+            self._pipe.flush_input() #Gets rid of /X0 after being disconnected for long?
+            self._framer.reset()
+        except (OSError, ValueError) as err:
             if self._port is None:
                 _LOGGER.error(str.format('Port not configured yet.'))
             else:
-                self.reconnect()
-        else:
-            #Connection should now be open
-            self._shutdown = False
-            _LOGGER.info(str.format("Connected to Paradox on port: {0}, speed: {1}",
-                                    self._port, self._speed))
+                _LOGGER.error('Unable to connect to Paradox on port %s: %s', self._port, err)
+            return False
+        #Connection should now be open
+        _LOGGER.info(str.format("Connected to Paradox on port: {0}, speed: {1}",
+                                self._port, self._speed))
+        return True
 
     def reconnect(self):
-        '''Re-opens the serial connection to the Paradox Alarm Panel, only if not open.'''
-        if self.is_open() is False:
+        '''Has the supervisor re-open the connection to the Paradox Alarm Panel.'''
+        if self._pipe is None:
+            _LOGGER.error(str.format('Port not configured yet.'))
+        elif not self._supervisor.lost('Reconnect requested.'):
+            _LOGGER.info(str.format("Reconnect ignored, port {} is already reconnecting.",
+                                    self._port))
+
+    def _reopen(self):
+        '''Closes and opens the connection again (for the supervisor), raises OSError on failure.'''
+        if self._pipe is None:
             try:
-                self._pipe.open()
-            except SerialException:
-                if self._port is None:
-                    _LOGGER.error(str.format('Port not configured yet.'))
-                else:
-                    _LOGGER.error(str.format('Unable to re-open serial connection.'))
-        else:
-            _LOGGER.info(str.format("Reconnect ignored, port {} already open.", self._port))
+                self._pipe = create_transport(self._port, self._speed)
+            except ValueError as err:
+                raise OSError(str(err)) from err
+        self._pipe.close()
+        self._pipe.open()
+        self._pipe.flush_input()
+        self._framer.reset()
+        self._reconnects += 1
+
+    def _probe(self):
+        '''Asks the silent panel for something, to see whether the link is still alive.'''
+        self.request_queue.put(PROBE_REQUEST)
+
+    def _restored(self, outage, unanswered):
+        '''Writes the requests lost with the link again, then tells the client.'''
+        if self._flow_control is not None:
+            self._flow_control.reset()
+        for _request in unanswered:
+            self.request_queue.put(_request)
+        if self._on_reconnect is not None:
+            self._on_reconnect(outage)
 
     def disconnect(self):
         '''Closes the serial connection to the Paradox Alarm Panel..'''
-        self._pipe.close()
+        if self._pipe is not None:
+            release_transport(self._pipe)
 
     def start(self):
         '''Start threads to manage queues.'''
-        self.connect() #Open the serial port before starting the threads
-        response_thread = threading.Thread(target=self.get_response)
-        response_thread.start()
-        request_thread = threading.Thread(target=self.submit_request)
-        request_thread.start()
+        _connected = self.connect() #Open the serial port before starting the threads
+        self._stopping.clear()
+        self._supervisor.start(_connected)
+        self._threads = [threading.Thread(target=self.get_response, daemon=True),
+                         threading.Thread(target=self.submit_request, daemon=True)]
+        for _thread in self._threads:
+            _thread.start()
         _LOGGER.debug(str.format('Request and Response threads are running...'))
 
     def submit_request(self):
@@ -87,51 +147,144 @@ class ParadoxSerialComms:
         '''
         _LOGGER.debug(str.format('Waiting for requests...'))
         while not self._shutdown:
-            request = self.request_queue.get() + "\r"
-            _LOGGER.debug(str.format('TX > {0}', request.encode('ascii')))
-            with self._lock:
-                self._pipe.write(request.encode('ascii'))
-                time.sleep(2)
-            self.request_queue.task_done() # Notifies join() that each put() had a get()
+            request, priority = self.request_queue.take()
+            if request is None: #Wake-up sentinel of stop(), never written
+                continue
+            self._writing = True
+            try:
+                if not self._ready_to_write(request):
+                    #Stopped (or flow control closed) while waiting: keep it for the next start()
+                    self.request_queue.requeue(request, priority)
+                    break
+                self._write_request(request)
+            finally:
+                self._writing = False
+                self.request_queue.task_done() # Notifies join() that each put() had a get()
+            if self._flow_control is None:
+                self._stopping.wait(self._request_interval)
         _LOGGER.debug(str.format('Stop submitting requests...'))
 
+    def _ready_to_write(self, request):
+        '''Waits for the link and the flow control, returns False if stopped meanwhile.'''
+        while not self._supervisor.wait_up(LINK_WAIT):
+            if self._shutdown:
+                return False
+        if self._shutdown:
+            return False
+        return self._flow_control is None or self._flow_control.acquire(request)
+
+    def _write_request(self, request):
+        '''Writes a request, handing it to the supervisor to write again if the link fails.'''
+        _request = request
+        request = request + "\r"
+        _LOGGER.debug(str.format('TX > {0}', request.encode('ascii')))
+        with self._lock:
+            try:
+                self._pipe.write(request.encode('ascii'))
+            except OSError as err:
+                self._metrics.inc('write_errors')
+                _LOGGER.error('Unable to submit request %s: %s', _request, err)
+                self._supervisor.lost(err)
+                self._supervisor.written(_request) #Written again once reconnected
+            else:
+                self._supervisor.written(_request)
+                self._metrics.inc('tx_frames')
+                self._metrics.inc('tx_bytes', len(request))
+                _sent = self._sent_times.get(reply_key(request))
+                if _sent is None:
+                    _sent = self._sent_times.setdefault(reply_key(request), deque(maxlen=8))
+                _sent.append(time.monotonic())
+
     def get_response(self):
         '''Listen for messages from the panel and place them on the response queue (as thread).'''
         _LOGGER.debug(str.format('Listening for alarm panel messages/events...'))
         while not self._shutdown:
+            if not self._supervisor.wait_up(LINK_WAIT):
+                continue
             try:
-                response = self._pipe.readline().decode().strip() #remove white space
-                #time.sleep(0.1) #Keep this until we have the timing sorted
+                #Wait (up to the read timeout) for data, then take everything that is waiting
+                data = self._pipe.read()
             except EOFError:
-                response = "" #force it to ignore this response
-
-            if response != "":
-                _LOGGER.debug(str.format('RX > {0}', response.encode('ascii')))
-                #Responses may be multi-line...
-                responses = re.split('\r', response)
-                for item in responses:
-                    if item != "":
-                        self.response_queue.put(item, timeout=10)
+                data = b"" #force it to ignore this response
+            except OSError as err: #Unplugged, the port is gone
+                self._supervisor.lost(err)
+                continue
+            if not data and not self._pipe.is_open():
+                self._supervisor.lost('Connection closed.')
+                continue
+
+            if data:
+                rx_time = time.monotonic()
+                _LOGGER.debug('RX > %s', data)
+                self._metrics.inc('rx_bytes', len(data))
+                for item in self._framer.feed(data):
+                    self._metrics.inc('rx_frames')
+                    _sent = self._sent_times.get(reply_key(item))
+                    if _sent:
+                        self._metrics.observe('request_rtt_seconds', rx_time - _sent.popleft())
+                    if self._flow_control is not None:
+                        self._flow_control.acknowledge(item)
+                    self._supervisor.received(item)
+                    self.response_queue.put((item, rx_time), timeout=10)
         _LOGGER.debug(str.format('Stop listening to alarm panel messages/events...'))
         #self.responseQueue.task_done() # No need for this as we are only using put()
 
-    def stop(self):
+    def stop(self, drain=False, drain_timeout=DRAIN_TIMEOUT):
         '''
-        Stop the response and request threads as elegantly as possible.
-        To do: Wait for the queues to be empty?
-               Find a better way to stop the request thread.
-               .join() will not be reliable as it is acceptable to get out of sync .put()
+        Stops the response and request threads and closes the connection.
+        With drain, first waits (up to drain_timeout) for the queued requests to be
+        written and answered; otherwise requests still queued stay in the queue.
+        Every thread is woken up by an event or sentinel (nothing is written to the
+        panel) and joined for at most JOIN_TIMEOUT.
         '''
-        self._shutdown = True # this should kill the "listen" thread, but not the requester thread
-        # submit a dummy request to get the requester thread to evaluate shutdown boolean
-        self.request_queue.put("Dummy")
-        time.sleep(5) #Wait for the the dummy request to be processed before closing the connection
+        if drain:
+            self._drain(drain_timeout)
+        self._shutdown = True
+        self._stopping.set()
+        self._supervisor.stop()
+        if self._flow_control is not None:
+            self._flow_control.close()
+        self.request_queue.put(None) #Wakes the request thread up
+        if self._pipe is not None:
+            self._pipe.cancel_read() #Wakes the response thread up
+        for _thread in self._threads:
+            if _thread is not threading.current_thread():
+                _thread.join(JOIN_TIMEOUT)
+                if _thread.is_alive():
+                    _LOGGER.warning('Thread %s did not stop in time.', _thread.name)
+        self._threads = []
         self.disconnect()
-        #This won't work if some requests are pending;Do we need it?
-        #self.request_queue.join() #Can't we just kill the thread?
         _LOGGER.debug(str.format('Threads stopped...'))
 
+    def _drain(self, timeout):
+        '''Waits for the queued requests to be written and answered, up to the timeout.'''
+        _deadline = time.monotonic() + timeout
+        while time.monotonic() < _deadline and self._supervisor.is_up:
+            _in_flight = (self._supervisor.unanswered if self._flow_control is None
+                          else self._flow_control.in_flight) #The latter expires unanswered ones
+            if not self.request_queue.qsize() and not self._writing and not _in_flight:
+                return True
+            time.sleep(0.01)
+        _LOGGER.warning('Stopping with %d requests queued and %d unanswered.',
+                        self.request_queue.qsize(), self._supervisor.unanswered)
+        return False
+
+    @property
+    def metrics(self):
+        '''Returns the metrics of the connection.'''
+        return self._metrics
+
+    @property
+    def supervisor(self):
+        '''Returns the ParadoxLinkSupervisor watching the connection.'''
+        return self._supervisor
+
+    @property
+    def flow_control(self):
+        '''Returns the flow control pacing the requests, None when using the fixed interval.'''
+        return self._flow_control
+
     def is_open(self):
         '''Returns True if serial connection is open, otherwise false.'''
         #It's best to test it again rather that use the boolean we set ourselves.
-        return self._pipe.isOpen()
+        return self._pipe is not None and self._pipe.is_open()
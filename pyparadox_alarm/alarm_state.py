@@ -1,6 +1,12 @@
 '''Class that defines a dictionary to be used to mirror the alarm state.'''
 #Derived from https://github.com/Cinntax/pyenvisalink/blob/master/pyenvisalink/alarm_state.py
 
+import threading
+import time
+from array import array
+from collections import deque
+from collections.abc import Mapping
+
 class AlarmState:
     '''Helper class for alarm state functionality.'''
 
@@ -26,8 +32,570 @@ class AlarmState:
         for j in range(1, max_zones + 1):
             _default_zone_label = 'Zone ' + str(j) + ' label default'
             _alarm_state['zone'][j] = {'status': {'open': False, 'fault': False, 'alarm': False,
-                                                    'tamper': False},
+                                                    'tamper': False, 'bypass': False,
+                                                    'fire': False, 'low_battery': False,
+                                                    'supervision_lost': False},
                                        'last_fault': 0,
                                        'name': _default_zone_label}
 
         return _alarm_state
+
+
+#Status flags in the order of their bits in the compact alarm state
+ZONE_STATUS_FLAGS = ('open', 'fault', 'alarm', 'tamper', 'bypass', 'fire', 'low_battery',
+                     'supervision_lost')
+AREA_STATUS_FLAGS = ('alarm', 'alarm_in_memory', 'armed_away', 'ac_present', 'armed_bypass',
+                     'chime', 'armed_zero_entry_delay', 'alarm_fire_zone', 'trouble', 'ready',
+                     'fire', 'armed_stay', 'alpha', 'beep', 'exit_delay', 'entry_delay')
+ZONE_BIT = {flag: 1 << bit for bit, flag in enumerate(ZONE_STATUS_FLAGS)}
+AREA_BIT = {flag: 1 << bit for bit, flag in enumerate(AREA_STATUS_FLAGS)}
+STATE_HISTORY = 1024 #Changes kept for changes_since()
+
+def status_dict(kind, flags):
+    '''Returns the status bits of a zone or partition as a dictionary of flag: bool.'''
+    _bits = ZONE_BIT if kind == 'zone' else AREA_BIT
+    return {flag: bool(flags & bit) for flag, bit in _bits.items()}
+
+class _EntityRecord:
+    '''Name and timestamps of a single zone or partition.'''
+    __slots__ = ['name', 'last_fault', 'updated']
+
+    def __init__(self):
+        self.name = None
+        self.last_fault = 0
+        self.updated = 0.0
+
+def _name_key(name):
+    '''Returns the key a name is indexed by: case and padding do not matter.'''
+    return name.strip().casefold()
+
+class AlarmStateIndex:
+    '''
+    Secondary indexes of a CompactAlarmState, kept up to date by every change:
+    the zones that have each status flag set, the zones of every area (as told
+    by the zone events), the numbers by name and per area the number of zones
+    with each flag set. Queries return copies and never scan the state.
+    '''
+    def __init__(self):
+        self.zones_with = {flag: set() for flag in ZONE_STATUS_FLAGS}
+        self.area_zones = {}
+        self.zone_area = {}
+        self.area_counts = {}
+        self.names = {'zone': {}, 'partition': {}}
+
+    def zone_flags_changed(self, number, previous, flags):
+        '''Updates the flag sets and area counters for changed zone bits.'''
+        _changed = previous ^ flags
+        _counts = self.area_counts.get(self.zone_area.get(number))
+        for _flag, _bit in ZONE_BIT.items():
+            if _changed & _bit:
+                if flags & _bit:
+                    self.zones_with[_flag].add(number)
+                    if _counts is not None:
+                        _counts[_flag] += 1
+                else:
+                    self.zones_with[_flag].discard(number)
+                    if _counts is not None:
+                        _counts[_flag] -= 1
+
+    def zone_area_changed(self, number, area, flags):
+        '''Moves a zone (with its flags in the counters) to another area.'''
+        _previous = self.zone_area.get(number)
+        if _previous is not None:
+            self.area_zones[_previous].discard(number)
+            self._count(_previous, flags, -1)
+        self.zone_area[number] = area
+        self.area_zones.setdefault(area, set()).add(number)
+        self._count(area, flags, 1)
+
+    def name_changed(self, kind, number, previous, name):
+        '''Re-indexes a zone or partition under its new name.'''
+        _names = self.names[kind]
+        if previous is not None:
+            _numbers = _names.get(_name_key(previous))
+            if _numbers is not None:
+                _numbers.discard(number)
+                if not _numbers:
+                    del _names[_name_key(previous)]
+        if name is not None:
+            _names.setdefault(_name_key(name), set()).add(number)
+
+    def _count(self, area, flags, step):
+        '''Adds (or removes) the flags of a zone to the counters of an area.'''
+        _counts = self.area_counts.get(area)
+        if _counts is None:
+            _counts = self.area_counts[area] = dict.fromkeys(ZONE_STATUS_FLAGS, 0)
+            _counts['zones'] = 0
+        _counts['zones'] += step
+        for _flag, _bit in ZONE_BIT.items():
+            if flags & _bit:
+                _counts[_flag] += step
+
+class CompactAlarmState:
+    '''
+    Alarm state that keeps the status flags of all zones and partitions as bits in
+    one array per entity type, and names/timestamps in __slots__ records.
+    Updates are made in place, nothing is allocated per event.
+    The view property offers the same nested (read-only) mapping as
+    AlarmState.get_initial_alarm_state.
+    If set, on_change is called with (kind, number, old bits, new bits) for every
+    status that actually changed.
+    Every change of a status, name or last fault increments version and is kept
+    in a ring buffer of the last "history" changes, for changes_since().
+    The index (an AlarmStateIndex) answers which zones are open, in which area,
+    by what name... without scanning, see zones_with(), area_zones() etc.
+    '''
+    def __init__(self, max_zones, max_partitions, history=STATE_HISTORY):
+        self.max_zones = max_zones
+        self.max_partitions = max_partitions
+        #Index 0 is unused so zone/partition numbers can be used as index directly
+        self.zone_flags = array('H', bytes(2 * (max_zones + 1)))
+        self.partition_flags = array('L', bytes(array('L').itemsize * (max_partitions + 1)))
+        self.zones = [_EntityRecord() for _ in range(max_zones + 1)]
+        self.partitions = [_EntityRecord() for _ in range(max_partitions + 1)]
+        self.view = AlarmStateView(self)
+        self.on_change = None
+        self.index = AlarmStateIndex()
+        self.version = 0
+        self._history = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._shared = False #The flag arrays are part of a snapshot, copy before writing
+        self._snapshot = None
+        self._names = None #(zone names, partition names) of the last snapshot
+        self._faults = None
+
+    def zone_name(self, number):
+        '''Returns the name of the zone.'''
+        _name = self.zones[number].name
+        return ('Zone ' + str(number) + ' label default') if _name is None else _name
+
+    def partition_name(self, number):
+        '''Returns the name of the partition.'''
+        _name = self.partitions[number].name
+        return ('Area ' + str(number) + ' label default') if _name is None else _name
+
+    def zone_last_fault(self, number):
+        '''Returns the time of the last fault of the zone.'''
+        return self.zones[number].last_fault
+
+    def zone_updated(self, number):
+        '''Returns the time the status of the zone was last set, by an event or a reply.'''
+        return self.zones[number].updated
+
+    def partition_updated(self, number):
+        '''Returns the time the status of the partition was last set.'''
+        return self.partitions[number].updated
+
+    def set_zone_area(self, number, area):
+        '''Notes the area of the zone, returns True if it changed.'''
+        with self._lock:
+            if self.index.zone_area.get(number) == area:
+                return False
+            self.index.zone_area_changed(number, area, self.zone_flags[number])
+            return True
+
+    def zone_area(self, number):
+        '''Returns the area of the zone, None while it is not known.'''
+        return self.index.zone_area.get(number)
+
+    def zones_with(self, flag):
+        '''Returns the zones with a status flag set, e.g. zones_with('open').'''
+        with self._lock:
+            return frozenset(self.index.zones_with[flag])
+
+    def area_zones(self, area):
+        '''Returns the zones known to belong to the area.'''
+        with self._lock:
+            return frozenset(self.index.area_zones.get(area, ()))
+
+    def area_zone_counts(self, area):
+        '''Returns the number of zones of the area ('zones') and of those with each flag set.'''
+        with self._lock:
+            _counts = self.index.area_counts.get(area)
+            if _counts is None:
+                return dict.fromkeys(('zones',) + ZONE_STATUS_FLAGS, 0)
+            return dict(_counts)
+
+    def find_zone(self, name):
+        '''Returns the numbers of the zones with the name (ignoring case and padding).'''
+        with self._lock:
+            return sorted(self.index.names['zone'].get(_name_key(name), ()))
+
+    def find_partition(self, name):
+        '''Returns the numbers of the partitions with the name.'''
+        with self._lock:
+            return sorted(self.index.names['partition'].get(_name_key(name), ()))
+
+    def set_zone_name(self, number, name):
+        '''Sets the name of the zone.'''
+        self._set_record('zone', self.zones, number, 'name', name)
+
+    def set_partition_name(self, number, name):
+        '''Sets the name of the partition.'''
+        self._set_record('partition', self.partitions, number, 'name', name)
+
+    def set_zone_flags(self, number, flags):
+        '''Replaces all status bits of the zone, returns the previous bits.'''
+        with self._lock:
+            if self._shared:
+                self._unshare()
+            _previous = self.zone_flags[number]
+            self.zone_flags[number] = flags
+            self.zones[number].updated = time.time()
+            if flags == _previous:
+                return _previous
+            self.index.zone_flags_changed(number, _previous, flags)
+            self.version += 1
+            self._history.append((self.version, 'zone', number, 'status', flags))
+        if self.on_change is not None:
+            self.on_change('zone', number, _previous, flags)
+        return _previous
+
+    def set_partition_flags(self, number, flags, mask):
+        '''Replaces the partition status bits in mask by those of flags, returns the previous bits.'''
+        with self._lock:
+            if self._shared:
+                self._unshare()
+            _previous = self.partition_flags[number]
+            _flags = (_previous & ~mask) | (flags & mask)
+            self.partition_flags[number] = _flags
+            self.partitions[number].updated = time.time()
+            if _flags == _previous:
+                return _previous
+            self.version += 1
+            self._history.append((self.version, 'partition', number, 'status', _flags))
+        if self.on_change is not None:
+            self.on_change('partition', number, _previous, _flags)
+        return _previous
+
+    def set_zone_flag(self, number, flag, value):
+        '''Sets a single zone status flag, returns True if it changed.'''
+        return self._set_bits('zone', number, ZONE_BIT[flag], value)
+
+    def set_partition_flag(self, number, flag, value):
+        '''Sets a single partition status flag, returns True if it changed.'''
+        return self._set_bits('partition', number, AREA_BIT[flag], value)
+
+    def clear_zone_flags(self, number, bits):
+        '''Clears several zone status bits at once, returns True if any changed.'''
+        return self._set_bits('zone', number, bits, False)
+
+    def clear_partition_flags(self, number, bits):
+        '''Clears several partition status bits at once, returns True if any changed.'''
+        return self._set_bits('partition', number, bits, False)
+
+    def zone_flag(self, number, flag):
+        '''Returns a single zone status flag.'''
+        return bool(self.zone_flags[number] & ZONE_BIT[flag])
+
+    def partition_flag(self, number, flag):
+        '''Returns a single partition status flag.'''
+        return bool(self.partition_flags[number] & AREA_BIT[flag])
+
+    def set_zone_last_fault(self, number, last_fault):
+        '''Sets the time of the last fault of the zone.'''
+        self._set_record('zone', self.zones, number, 'last_fault', last_fault)
+
+    def snapshot(self):
+        '''
+        Returns an immutable AlarmStateSnapshot of the current state. The snapshot
+        shares the flag arrays with the state until the next status change copies
+        them, and names are only collected again after one of them changed, so
+        taking a snapshot costs (next to) nothing.
+        '''
+        with self._lock:
+            if self._snapshot is not None and self._snapshot.version == self.version:
+                return self._snapshot
+            if self._names is None:
+                self._names = (tuple(self.zone_name(i) for i in range(self.max_zones + 1)),
+                               tuple(self.partition_name(i)
+                                     for i in range(self.max_partitions + 1)))
+            if self._faults is None:
+                self._faults = tuple(record.last_fault for record in self.zones)
+            self._shared = True
+            self._snapshot = AlarmStateSnapshot(self.version, self.zone_flags,
+                                                self.partition_flags, self._names[0],
+                                                self._names[1], self._faults)
+            return self._snapshot
+
+    def resized(self, max_zones, max_partitions):
+        '''
+        Returns a state of another size holding the statuses, names, times and
+        areas of the zones and partitions both sizes have. Its version follows
+        on from this one with an empty history, so changes_since() callers start
+        over from a snapshot.
+        '''
+        _state = CompactAlarmState(max_zones, max_partitions, self._history.maxlen)
+        with self._lock:
+            for _kind, _flags, _records, _maximum in (
+                    ('zone', self.zone_flags, self.zones, min(max_zones, self.max_zones)),
+                    ('partition', self.partition_flags, self.partitions,
+                     min(max_partitions, self.max_partitions))):
+                _new_flags = _state.zone_flags if _kind == 'zone' else _state.partition_flags
+                _new_records = _state.zones if _kind == 'zone' else _state.partitions
+                for i in range(1, _maximum + 1):
+                    _new_flags[i] = _flags[i]
+                    _record = _new_records[i]
+                    _record.name = _records[i].name
+                    _record.last_fault = _records[i].last_fault
+                    _record.updated = _records[i].updated
+                    _state.index.name_changed(_kind, i, None, _record.name)
+            for i in range(1, min(max_zones, self.max_zones) + 1):
+                _state.index.zone_flags_changed(i, 0, _state.zone_flags[i])
+                if i in self.index.zone_area:
+                    _state.index.zone_area_changed(i, self.index.zone_area[i],
+                                                   _state.zone_flags[i])
+            _state.version = self.version + 1
+        _state.on_change = self.on_change
+        return _state
+
+    def changes_since(self, version, raw=False):
+        '''
+        Returns (current version, changes) where changes lists what changed after
+        the given version, oldest first and only the latest value per zone/partition
+        and field, as (version, (kind, number), field, value) tuples. Field is
+        'status' (with the status dictionary as value, the status bits if raw),
+        'name' or 'last_fault'.
+        Changes is None if the version is too old for the ring buffer: start over
+        from a snapshot() then.
+        '''
+        with self._lock:
+            _current = self.version
+            if version >= _current:
+                return _current, []
+            if not self._history or version < self._history[0][0] - 1:
+                return _current, None
+            _latest = {}
+            for _entry in reversed(self._history):
+                if _entry[0] <= version:
+                    break
+                _latest.setdefault((_entry[1], _entry[2], _entry[3]), _entry)
+        _changes = []
+        for _version, _kind, _number, _field, _value in _latest.values():
+            if _field == 'status' and not raw:
+                _value = status_dict(_kind, _value)
+            _changes.append((_version, (_kind, _number), _field, _value))
+        _changes.sort(key=lambda change: change[0])
+        return _current, _changes
+
+    def to_dict(self):
+        '''Returns a plain (deep) copy as built by AlarmState.get_initial_alarm_state.'''
+        return {kind: {number: {key: (dict(value) if key == 'status' else value)
+                                for key, value in entity.items()}
+                       for number, entity in table.items()}
+                for kind, table in self.view.items()}
+
+    def load_dict(self, alarm_state):
+        '''Copies names and statuses from a dictionary shaped like to_dict() returns.'''
+        for number, entity in alarm_state.get('zone', {}).items():
+            number = int(number)
+            if 0 < number <= self.max_zones:
+                self.set_zone_name(number, entity.get('name', self.zones[number].name))
+                self.set_zone_last_fault(number, entity.get('last_fault', 0))
+                for flag, value in entity.get('status', {}).items():
+                    if flag in ZONE_BIT:
+                        self.set_zone_flag(number, flag, value)
+        for number, entity in alarm_state.get('partition', {}).items():
+            number = int(number)
+            if 0 < number <= self.max_partitions:
+                self.set_partition_name(number, entity.get('name', self.partitions[number].name))
+                for flag, value in entity.get('status', {}).items():
+                    if flag in AREA_BIT:
+                        self.set_partition_flag(number, flag, value)
+        #Loaded statuses are not confirmed by the panel yet
+        for record in self.zones + self.partitions:
+            record.updated = 0.0
+
+    def _set_bits(self, kind, number, bits, value):
+        '''Sets or clears bits in place.'''
+        with self._lock:
+            if self._shared:
+                self._unshare()
+            if kind == 'zone':
+                flags, records = self.zone_flags, self.zones
+            else:
+                flags, records = self.partition_flags, self.partitions
+            _previous = flags[number]
+            _flags = (_previous | bits) if value else (_previous & ~bits)
+            flags[number] = _flags
+            records[number].updated = time.time()
+            if _flags == _previous:
+                return False
+            if kind == 'zone':
+                self.index.zone_flags_changed(number, _previous, _flags)
+            self.version += 1
+            self._history.append((self.version, kind, number, 'status', _flags))
+        if self.on_change is not None:
+            self.on_change(kind, number, _previous, _flags)
+        return True
+
+    def _set_record(self, kind, records, number, field, value):
+        '''Sets the name or last fault of a zone/partition.'''
+        with self._lock:
+            _previous = getattr(records[number], field)
+            if _previous == value:
+                return
+            setattr(records[number], field, value)
+            if field == 'name':
+                self.index.name_changed(kind, number, _previous, value)
+                self._names = None
+            else:
+                self._faults = None
+            self.version += 1
+            self._history.append((self.version, kind, number, field, value))
+
+    def _unshare(self):
+        '''Copies the flag arrays handed out to the last snapshot (lock held).'''
+        self.zone_flags = array('H', self.zone_flags)
+        self.partition_flags = array('L', self.partition_flags)
+        self._shared = False
+
+class AlarmStateSnapshot:
+    '''
+    Immutable copy of a CompactAlarmState at one version. The view property
+    offers the same nested mapping as the state, to_dict() a plain copy.
+    '''
+    __slots__ = ['version', 'max_zones', 'max_partitions', 'zone_flags', 'partition_flags',
+                 '_zone_names', '_partition_names', '_zone_faults', '_view']
+
+    def __init__(self, version, zone_flags, partition_flags, zone_names, partition_names,
+                 zone_faults):
+        self.version = version
+        self.max_zones = len(zone_flags) - 1
+        self.max_partitions = len(partition_flags) - 1
+        self.zone_flags = zone_flags
+        self.partition_flags = partition_flags
+        self._zone_names = zone_names
+        self._partition_names = partition_names
+        self._zone_faults = zone_faults
+        self._view = None
+
+    @property
+    def view(self):
+        '''Returns the snapshot as a read-only nested mapping.'''
+        if self._view is None:
+            self._view = AlarmStateView(self)
+        return self._view
+
+    def zone_name(self, number):
+        '''Returns the name of the zone.'''
+        return self._zone_names[number]
+
+    def partition_name(self, number):
+        '''Returns the name of the partition.'''
+        return self._partition_names[number]
+
+    def zone_last_fault(self, number):
+        '''Returns the time of the last fault of the zone.'''
+        return self._zone_faults[number]
+
+    def zone_flag(self, number, flag):
+        '''Returns a single zone status flag.'''
+        return bool(self.zone_flags[number] & ZONE_BIT[flag])
+
+    def partition_flag(self, number, flag):
+        '''Returns a single partition status flag.'''
+        return bool(self.partition_flags[number] & AREA_BIT[flag])
+
+    to_dict = CompactAlarmState.to_dict
+
+class _StatusView(Mapping):
+    '''Read-only mapping of flag name to bool for one zone or partition.'''
+    __slots__ = ['_state', '_kind', '_number', '_bits']
+
+    def __init__(self, state, kind, number):
+        self._state = state
+        self._kind = kind
+        self._number = number
+        self._bits = ZONE_BIT if kind == 'zone' else AREA_BIT
+
+    def __getitem__(self, flag):
+        _flags = self._state.zone_flags if self._kind == 'zone' else self._state.partition_flags
+        return bool(_flags[self._number] & self._bits[flag])
+
+    def __iter__(self):
+        return iter(self._bits)
+
+    def __len__(self):
+        return len(self._bits)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class _EntityView(Mapping):
+    '''Read-only mapping with the status, name (and last fault) of one zone or partition.'''
+    __slots__ = ['_state', '_kind', '_number']
+
+    def __init__(self, state, kind, number):
+        self._state = state
+        self._kind = kind
+        self._number = number
+
+    def __getitem__(self, key):
+        _state = self._state
+        if self._kind == 'zone':
+            if key == 'status':
+                return _StatusView(_state, 'zone', self._number)
+            if key == 'name':
+                return _state.zone_name(self._number)
+            if key == 'last_fault':
+                return _state.zone_last_fault(self._number)
+        else:
+            if key == 'status':
+                return _StatusView(_state, 'partition', self._number)
+            if key == 'name':
+                return _state.partition_name(self._number)
+        raise KeyError(key)
+
+    def __iter__(self):
+        if self._kind == 'zone':
+            return iter(('status', 'last_fault', 'name'))
+        return iter(('status', 'name'))
+
+    def __len__(self):
+        return 3 if self._kind == 'zone' else 2
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class _EntityTableView(Mapping):
+    '''Read-only mapping of zone/partition number to its entity view.'''
+    __slots__ = ['_state', '_kind', '_maximum']
+
+    def __init__(self, state, kind, maximum):
+        self._state = state
+        self._kind = kind
+        self._maximum = maximum
+
+    def __getitem__(self, number):
+        if not isinstance(number, int) or not 0 < number <= self._maximum:
+            raise KeyError(number)
+        return _EntityView(self._state, self._kind, number)
+
+    def __iter__(self):
+        return iter(range(1, self._maximum + 1))
+
+    def __len__(self):
+        return self._maximum
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class AlarmStateView(Mapping):
+    '''Read-only, live mapping view of a CompactAlarmState: view['zone'][n]['status']['open'].'''
+
+    def __init__(self, state):
+        self._tables = {'partition': _EntityTableView(state, 'partition', state.max_partitions),
+                        'zone': _EntityTableView(state, 'zone', state.max_zones)}
+
+    def __getitem__(self, kind):
+        return self._tables[kind]
+
+    def __iter__(self):
+        return iter(self._tables)
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __repr__(self):
+        return repr(dict(self))
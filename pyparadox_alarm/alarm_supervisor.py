@@ -0,0 +1,184 @@
+'''
+Watches the link to the panel and re-establishes it when it is lost.
+
+The link counts as lost when a read or write fails, the transport closes, or
+the panel stays silent and does not answer a probe request either. It is then
+re-opened with jittered exponential backoff. Requests written but not answered
+before the loss are handed back to be written again once the link is restored.
+'''
+
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from pyparadox_alarm.alarm_flow_control import reply_key
+
+_LOGGER = logging.getLogger(__name__)
+
+SILENCE_TIMEOUT = 30.0 #Seconds without a message before the panel is probed
+PROBE_TIMEOUT = 5.0 #Seconds the probe may take to be answered
+BACKOFF_MIN = 0.25 #First delay before re-opening, doubled after every failure...
+BACKOFF_MAX = 30.0 #...up to this
+MAX_UNANSWERED = 32 #Requests remembered for replay
+
+class ParadoxLinkSupervisor:
+    '''
+    Supervises a link on its own thread. reopen() must (re-)open the connection
+    and raise OSError if it cannot, probe() submits a request the panel will
+    answer, and restored(outage, unanswered) is called with the seconds the link
+    was down and the requests to write again once it is back up.
+    The connection threads report every message received, every request written
+    and every error (lost) and wait for the link with wait_up().
+    A silence_timeout of None disables probing.
+    '''
+    def __init__(self, reopen, probe, restored, silence_timeout=SILENCE_TIMEOUT,
+                 probe_timeout=PROBE_TIMEOUT, backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX):
+        self._reopen = reopen
+        self._probe = probe
+        self._restored = restored
+        self._silence_timeout = silence_timeout
+        self._probe_timeout = probe_timeout
+        self._backoff_min = backoff_min
+        self._backoff_max = backoff_max
+        self._lock = threading.Condition()
+        self._up = threading.Event()
+        self._stopped = True
+        self._thread = None
+        self._last_rx = time.monotonic()
+        self._probe_sent = None
+        self._lost_at = None
+        self._unanswered = OrderedDict()
+        self._unanswered_lock = threading.Lock() #Written and received on different threads
+        self.outages = 0
+        self.probes = 0
+
+    @property
+    def is_up(self):
+        '''Returns True while the link is up.'''
+        return self._up.is_set()
+
+    @property
+    def unanswered(self):
+        '''Returns the number of requests written that have not been answered yet.'''
+        return len(self._unanswered)
+
+    def start(self, up=True):
+        '''Starts supervising, reconnecting straight away if the link is not up yet.'''
+        with self._lock:
+            self._stopped = False
+            self._last_rx = time.monotonic()
+            self._probe_sent = None
+            if up:
+                self._up.set()
+            else:
+                self._up.clear()
+                self._lost_at = time.monotonic()
+            self._thread = threading.Thread(target=self._supervise, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        '''Stops supervising and releases threads waiting for the link.'''
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+        self._up.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(1)
+        self._thread = None
+
+    def wait_up(self, timeout=None):
+        '''Waits for the link to be up, returns False on timeout.'''
+        return self._up.wait(timeout)
+
+    def received(self, message):
+        '''Notes a message received, the link is alive.'''
+        self._last_rx = time.monotonic()
+        self._probe_sent = None
+        if self._unanswered:
+            with self._unanswered_lock:
+                self._unanswered.pop(reply_key(message), None)
+
+    def written(self, request):
+        '''Notes a request written, it is replayed if the link goes down before its reply.'''
+        _unanswered = self._unanswered
+        with self._unanswered_lock:
+            _unanswered[reply_key(request)] = request
+            if len(_unanswered) > MAX_UNANSWERED:
+                _unanswered.popitem(last=False)
+
+    def lost(self, reason):
+        '''Reports the link as lost, returns False if it was already known to be down.'''
+        with self._lock:
+            if self._stopped or not self._up.is_set():
+                return False
+            self._up.clear()
+            self._lost_at = time.monotonic()
+            self.outages += 1
+            self._lock.notify_all()
+        _LOGGER.warning('Link to Paradox lost: %s', reason)
+        return True
+
+    def _supervise(self):
+        '''Probes a silent link and re-opens a lost one (as thread).'''
+        _failures = 0
+        while True:
+            with self._lock:
+                if self._stopped:
+                    break
+                if self._up.is_set():
+                    _failures = 0
+                    self._lock.wait(self._check_silence()) #No silence timeout: until lost
+                    continue
+                #Down: back off, then try to re-open
+                _delay = min(self._backoff_max, self._backoff_min * 2 ** _failures)
+                self._lock.wait(_delay * random.uniform(0.5, 1.5))
+                if self._stopped:
+                    break
+            try:
+                self._reopen()
+            except OSError as err:
+                _failures += 1
+                _LOGGER.error('Unable to re-open the link to Paradox (%s), attempt %d.',
+                              err, _failures)
+                continue
+            with self._lock:
+                _outage = time.monotonic() - self._lost_at
+                with self._unanswered_lock:
+                    _unanswered = list(self._unanswered.values())
+                    self._unanswered.clear()
+                self._last_rx = time.monotonic()
+                self._probe_sent = None
+                self._up.set()
+            _LOGGER.info('Link to Paradox restored after %.1f s, replaying %d requests.',
+                         _outage, len(_unanswered))
+            try:
+                self._restored(_outage, _unanswered)
+            except Exception: #pylint: disable=broad-except
+                _LOGGER.exception('Restoring the link state failed.')
+
+    def _check_silence(self):
+        '''
+        Probes the panel after a silence, declares the link lost when the probe
+        goes unanswered. Returns the time to wait until the next check (lock held).
+        '''
+        if self._silence_timeout is None:
+            return None
+        _now = time.monotonic()
+        _probe_sent = self._probe_sent
+        if _probe_sent is None:
+            _silence = _now - self._last_rx
+            if _silence < self._silence_timeout:
+                return self._silence_timeout - _silence
+            self._probe_sent = _now
+            self.probes += 1
+            self._probe()
+            return self._probe_timeout
+        if _now - _probe_sent < self._probe_timeout:
+            return self._probe_timeout - (_now - _probe_sent)
+        self._up.clear()
+        self._lost_at = _probe_sent
+        self.outages += 1
+        _LOGGER.warning('Link to Paradox lost: no reply to a probe within %.1f s.',
+                        self._probe_timeout)
+        return 0
@@ -0,0 +1,293 @@
+'''
+Transports carrying the PRT3 byte stream between ParadoxSerialComms and the panel.
+
+A transport is either the local (usb) serial port or a TCP connection to an
+IP module or serial-to-TCP bridge (ser2net and the like), selected by the port:
+"/dev/ttyUSB0" opens the serial port, "socket://host:port" a TCP connection.
+'''
+
+import logging
+import selectors
+import socket
+import threading
+from abc import ABC, abstractmethod
+import serial
+
+_LOGGER = logging.getLogger(__name__)
+
+SOCKET_PREFIX = 'socket://'
+READ_TIMEOUT = 1 #Seconds a read waits for data before returning empty handed
+CONNECT_TIMEOUT = 5
+KEEPALIVE_IDLE = 10 #Seconds of silence before the first keepalive probe
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+class ParadoxTransport(ABC):
+    '''
+    Interface of a transport. Errors are raised as OSError (which includes
+    serial.SerialException).
+    '''
+    @abstractmethod
+    def open(self):
+        '''Opens the connection, if not open yet.'''
+
+    @abstractmethod
+    def close(self):
+        '''Closes the connection.'''
+
+    @abstractmethod
+    def is_open(self):
+        '''Returns True if the connection is open.'''
+
+    @abstractmethod
+    def read(self):
+        '''Returns the bytes received, waiting up to the read timeout for the first one.'''
+
+    @abstractmethod
+    def write(self, data):
+        '''Writes all bytes to the panel.'''
+
+    @abstractmethod
+    def flush_input(self):
+        '''Throws away anything received but not read yet.'''
+
+    @abstractmethod
+    def cancel_read(self):
+        '''Makes a read waiting in another thread return straight away.'''
+
+
+class SerialTransport(ParadoxTransport):
+    '''Transport over the local serial port, using pyserial.'''
+
+    def __init__(self, port, speed, timeout=READ_TIMEOUT):
+        self._port = port
+        self._speed = speed
+        self._timeout = timeout
+        self._serial = None
+
+    def open(self):
+        '''Opens the serial port, if not open yet.'''
+        if self._serial is None:
+            self._serial = serial.Serial(self._port, self._speed, timeout=self._timeout)
+        elif not self._serial.isOpen():
+            self._serial.open()
+
+    def close(self):
+        '''Closes the serial port.'''
+        if self._serial is not None:
+            self._serial.close()
+
+    def is_open(self):
+        '''Returns True if the serial port is open.'''
+        return self._serial is not None and self._serial.isOpen()
+
+    def read(self):
+        '''Waits for a byte, then takes everything that is waiting.'''
+        return self._serial.read(self._serial.in_waiting or 1)
+
+    def write(self, data):
+        '''Writes all bytes to the serial port.'''
+        self._serial.write(data)
+
+    def flush_input(self):
+        '''Throws away anything received but not read yet.'''
+        self._serial.flushInput()
+
+    def cancel_read(self):
+        '''Makes a read waiting in another thread return straight away.'''
+        if self._serial is not None and hasattr(self._serial, 'cancel_read'):
+            self._serial.cancel_read()
+
+
+class TcpTransport(ParadoxTransport):
+    '''
+    Transport over a non-blocking TCP socket with keepalive enabled.
+    A lost connection is dropped: is_open() turns False, reads return nothing and
+    writes raise ConnectionError. Re-opening it (and backing off) is left to the
+    ParadoxLinkSupervisor of the connection.
+    '''
+    def __init__(self, host, port, timeout=READ_TIMEOUT, connect_timeout=CONNECT_TIMEOUT):
+        self._address = (host, port)
+        self._timeout = timeout
+        self._connect_timeout = connect_timeout
+        self._socket = None
+        self._selector = selectors.DefaultSelector()
+        #Writing to the wake-up pair makes a read waiting in select() return
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._lock = threading.RLock()
+
+    @property
+    def address(self):
+        '''Returns the (host, port) connected to.'''
+        return self._address
+
+    def open(self):
+        '''Opens the connection, if not open yet.'''
+        with self._lock:
+            if self._socket is None:
+                self._connect()
+
+    def close(self):
+        '''Closes the connection.'''
+        with self._lock:
+            self._drop()
+
+    def is_open(self):
+        '''Returns True if connected.'''
+        return self._socket is not None
+
+    def read(self):
+        '''Waits (up to the read timeout) for data and returns what has been received.'''
+        _socket = self._socket
+        if _socket is None:
+            return b"" #Lost, for the supervisor to re-open
+        _events = self._selector.select(self._timeout)
+        if not _events:
+            return b""
+        if any(key.fileobj is self._wakeup_reader for key, _ in _events):
+            try:
+                self._wakeup_reader.recv(64)
+            except OSError:
+                pass
+            return b""
+        try:
+            data = _socket.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return b""
+        except OSError as err:
+            self._lost(_socket, err)
+            return b""
+        if not data:
+            self._lost(_socket, 'closed by peer')
+        return data
+
+    def write(self, data):
+        '''Writes all bytes, raises ConnectionError while the connection is lost.'''
+        with self._lock:
+            _socket = self._socket
+            if _socket is None:
+                raise ConnectionError(str.format('Not connected to {0}:{1}.', *self._address))
+            _view = memoryview(data)
+            try:
+                while _view:
+                    try:
+                        _view = _view[_socket.send(_view):]
+                    except (BlockingIOError, InterruptedError):
+                        with selectors.DefaultSelector() as _selector:
+                            _selector.register(_socket, selectors.EVENT_WRITE)
+                            if not _selector.select(self._connect_timeout):
+                                raise socket.timeout('Write timed out.')
+            except OSError as err:
+                self._lost(_socket, err)
+                raise
+
+    def flush_input(self):
+        '''Throws away anything received but not read yet.'''
+        _socket = self._socket
+        while _socket is not None:
+            try:
+                if not _socket.recv(4096):
+                    break
+            except OSError:
+                break
+
+    def cancel_read(self):
+        '''Makes a read waiting in another thread return straight away.'''
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError:
+            pass #Already woken up, the byte is still waiting
+
+    def _connect(self):
+        '''Connects and switches the socket to non-blocking mode (lock held).'''
+        _socket = socket.create_connection(self._address, self._connect_timeout)
+        _socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for _option, _value in [('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                                ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                                ('TCP_KEEPCNT', KEEPALIVE_COUNT)]:
+            if hasattr(socket, _option):
+                _socket.setsockopt(socket.IPPROTO_TCP, getattr(socket, _option), _value)
+        _socket.setblocking(False)
+        self._selector.register(_socket, selectors.EVENT_READ)
+        self._socket = _socket
+        _LOGGER.info('Connected to Paradox at %s:%d.', *self._address)
+
+    def _lost(self, lost_socket, reason):
+        '''Drops a connection that failed.'''
+        with self._lock:
+            if self._socket is lost_socket:
+                _LOGGER.warning('Connection to %s:%d lost: %s', self._address[0],
+                                self._address[1], reason)
+                self._drop()
+
+    def _drop(self):
+        '''Closes the socket (lock held).'''
+        if self._socket is not None:
+            self._selector.unregister(self._socket)
+            self._socket.close()
+            self._socket = None
+
+
+class ParadoxConnectionPool:
+    '''
+    Keeps one TCP connection per panel address open across stop()/start(), so a
+    restart does not have to connect again. A connection is only handed to one
+    ParadoxSerialComms at a time as it consumes everything received.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._in_use = set()
+
+    def acquire(self, host, port):
+        '''Returns the (pooled) transport for the address.'''
+        _address = (host, port)
+        with self._lock:
+            if _address in self._in_use:
+                raise ValueError(str.format('{0}:{1} is already in use by another panel.',
+                                            host, port))
+            _transport = self._connections.get(_address)
+            if _transport is None:
+                _transport = TcpTransport(host, port)
+                self._connections[_address] = _transport
+            self._in_use.add(_address)
+            return _transport
+
+    def release(self, transport):
+        '''Returns a transport to the pool, leaving its connection open.'''
+        with self._lock:
+            self._in_use.discard(transport.address)
+
+    def close_all(self):
+        '''Closes all idle pooled connections.'''
+        with self._lock:
+            for _address in list(self._connections):
+                if _address not in self._in_use:
+                    self._connections.pop(_address).close()
+
+CONNECTION_POOL = ParadoxConnectionPool()
+
+def parse_socket_port(port):
+    '''Splits a "socket://host:port" url into (host, port), returns None for other ports.'''
+    if not isinstance(port, str) or not port.startswith(SOCKET_PREFIX):
+        return None
+    _host, _, _tcp_port = port[len(SOCKET_PREFIX):].rpartition(':')
+    return _host, int(_tcp_port)
+
+def create_transport(port, speed):
+    '''Returns the transport for the port, pooled for TCP connections.'''
+    _address = parse_socket_port(port)
+    if _address is not None:
+        return CONNECTION_POOL.acquire(*_address)
+    return SerialTransport(port, speed)
+
+def release_transport(transport):
+    '''Closes a serial transport or hands a TCP transport back to the pool.'''
+    if isinstance(transport, TcpTransport):
+        CONNECTION_POOL.release(transport)
+    else:
+        transport.close()
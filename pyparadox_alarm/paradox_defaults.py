@@ -24,3 +24,43 @@ PARADOX_MODELS = {
     }
 
 
+
+
+#PRT3 system event groups, reported as G<group>N<event number>A<area number>
+EVENT_GROUPS = {
+    0: 'Zone is OK', 1: 'Zone is open', 2: 'Zone is tampered', 3: 'Zone is in fire loop trouble',
+    4: 'Non-reportable event', 5: 'User code entered on keypad',
+    6: 'User/card access on door', 7: 'Bypass programming access',
+    8: 'TX delay zone alarm', 9: 'Arming with master', 10: 'Arming with user code',
+    11: 'Arming with keyswitch', 12: 'Special arming', 13: 'Disarm with master',
+    14: 'Disarm with user code', 15: 'Disarm with keyswitch',
+    16: 'Disarm after alarm with master', 17: 'Disarm after alarm with user code',
+    18: 'Disarm after alarm with keyswitch', 19: 'Alarm cancelled with master',
+    20: 'Alarm cancelled with user code', 21: 'Alarm cancelled with keyswitch',
+    22: 'Special disarm events', 23: 'Zone bypassed', 24: 'Zone in alarm', 25: 'Fire alarm',
+    26: 'Zone alarm restore', 27: 'Fire alarm restore', 28: 'Special alarm',
+    29: 'Zone shutdown', 30: 'Zone tampered', 31: 'Zone tamper restore', 32: 'New trouble',
+    33: 'Trouble restored', 34: 'Module trouble', 35: 'Module trouble restore',
+    36: 'Fail to communicate on telephone number', 37: 'Low battery on zone',
+    38: 'Zone supervision trouble', 39: 'Low battery on zone restored',
+    40: 'Zone supervision trouble restored', 41: 'Special events',
+    42: 'Early to disarm by user', 43: 'Late to disarm by user', 44: 'Utility key',
+    45: 'Request for exit', 46: 'Access denied', 47: 'Door left open alarm',
+    48: 'Door forced alarm', 49: 'Door left open restore', 50: 'Door forced restore',
+    51: 'Intellizone triggered', 52: 'Zone excluded on force arming',
+    53: 'Zone went back to arm status', 54: 'New module assigned on combus',
+    55: 'Module manually removed from combus', 64: 'Status 1', 65: 'Status 2', 66: 'Status 3'
+    }
+EVENT_GROUP_COUNT = 67
+
+#Event numbers of the trouble groups (032/033) and status groups (064-066)
+TROUBLE_AC_FAILURE = 1
+STATUS_1 = {2: 'armed_stay', 6: 'alarm', 7: 'fire'}
+STATUS_2 = {0: 'ready', 1: 'exit_delay', 2: 'entry_delay', 3: 'trouble', 4: 'alarm_in_memory',
+            5: 'armed_bypass'}
+STATUS_3 = {1: 'alarm_fire_zone'}
+#The status groups only report flags coming on: the area flags each one rules out
+STATUS_CLEARS = {'ready': ('exit_delay', 'entry_delay'),
+                 'exit_delay': ('ready', 'entry_delay'),
+                 'entry_delay': ('ready', 'exit_delay'),
+                 'armed_stay': ('alpha', 'armed_away')}
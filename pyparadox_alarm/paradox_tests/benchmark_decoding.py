@@ -0,0 +1,53 @@
+'''Benchmarks the table driven decoder against the old if/elif chain.'''
+
+import logging
+import time
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+
+BENCH_ROUNDS = 20000
+#Messages both decoders understand, and a mix from the rest of the event catalogue
+MESSAGES = ['G001N005A001', 'G000N005A001', 'G010N001A001', 'G014N001A001', 'G099N001A001',
+            'RZ017COOOO', 'RA001D', 'ZL003Garage', 'AL001House']
+CATALOGUE = ['G024N017A002', 'G026N017A002', 'G023N004A001', 'G032N001A000', 'G033N001A000',
+             'G065N000A001', 'G016N001A001', 'G037N009A001', 'G045N001A001']
+
+def legacy_decode(panel, response):
+    '''The decoder as it was: if/elif chains with a list literal per comparison.'''
+    _msg_type = response[:2]
+    if response[:1] == "G":
+        _event_group = response[1:4]
+        _event_number = int(response[5:8])
+        _area_number = int(response[9:12])
+        if _event_group in ['000']:
+            panel.update_zone_status(_event_number, 'C')
+        elif _event_group in ['001']:
+            panel.update_zone_status(_event_number, 'O')
+        elif _event_group in ['009', '010', '011', '012']:
+            panel.update_area_status(_area_number, 'A')
+        elif _event_group in ['014']:
+            panel.update_area_status(_area_number, 'D')
+    elif response[:2] == "ZL":
+        panel.update_zone_name(int(response[2:5]), response[5:])
+    elif _msg_type == "RZ":
+        panel.update_zone_status(int(response[2:5]), response[5:])
+    elif response[:2] == "AL":
+        panel.update_area_name(int(response[2:5]), response[5:])
+    elif _msg_type == "RA":
+        panel.update_area_status(int(response[2:5]), response[5:])
+
+def bench(name, decode, messages):
+    '''Prints the number of messages decoded per second.'''
+    start = time.perf_counter()
+    for _ in range(BENCH_ROUNDS):
+        for message in messages:
+            decode(message)
+    elapsed = time.perf_counter() - start
+    print(str.format('{0:<10} {1:>12,.0f} messages/s', name,
+                     BENCH_ROUNDS * len(messages) / elapsed))
+
+if __name__ == '__main__':
+    logging.disable(logging.DEBUG)
+    PANEL = ParadoxAlarmPanel()
+    bench('legacy', lambda message: legacy_decode(PANEL, message), MESSAGES)
+    bench('table', PANEL.decode_response, MESSAGES)
+    bench('catalogue', PANEL.decode_response, CATALOGUE)
@@ -0,0 +1,57 @@
+'''Benchmarks the PRT3 framer against the old readline() based receive path.'''
+
+import os
+import pty
+import re
+import time
+import tty
+import serial
+from pyparadox_alarm.alarm_framing import ParadoxFramer
+
+BENCH_FRAMES = 200000
+BENCH_LATENCY_SAMPLES = 5
+FRAME = b'G001N005A001\r'
+
+def readline_split(data):
+    '''The old receive path: decode, strip and split every line.'''
+    return [item for item in re.split('\r', data.decode().strip()) if item != ""]
+
+def bench_throughput():
+    '''Prints the frames per second both paths are able to split.'''
+    chunks = [FRAME * 64] * (BENCH_FRAMES // 64)
+
+    start = time.perf_counter()
+    total = sum(len(readline_split(chunk)) for chunk in chunks)
+    elapsed = time.perf_counter() - start
+    print(str.format('readline/re.split: {0:>12,.0f} frames/s', total / elapsed))
+
+    framer = ParadoxFramer()
+    start = time.perf_counter()
+    total = sum(len(framer.feed(chunk)) for chunk in chunks)
+    elapsed = time.perf_counter() - start
+    print(str.format('ParadoxFramer:     {0:>12,.0f} frames/s', total / elapsed))
+
+def bench_latency():
+    '''Prints the time from writing a frame on a pty to it being released.'''
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    pipe = serial.Serial(os.ttyname(slave), 57600, timeout=1)
+    framer = ParadoxFramer()
+    for name in ['readline', 'framer']:
+        worst = 0.0
+        for _ in range(BENCH_LATENCY_SAMPLES):
+            start = time.perf_counter()
+            os.write(master, FRAME)
+            if name == 'readline':
+                pipe.readline()
+            else:
+                while not framer.feed(pipe.read(pipe.in_waiting or 1)):
+                    pass
+            worst = max(worst, time.perf_counter() - start)
+        print(str.format('{0:<10} worst frame release latency: {1:8.3f} ms', name, worst * 1000))
+    pipe.close()
+    os.close(master)
+
+if __name__ == '__main__':
+    bench_throughput()
+    bench_latency()
@@ -0,0 +1,62 @@
+'''Benchmarks ParadoxPanelManager with 1, 10 and 100 simulated panels on one event loop.'''
+
+import asyncio
+import logging
+import threading
+import time
+from pyparadox_alarm.alarm_manager import ParadoxPanelManager
+
+BENCH_PANELS = [1, 10, 100]
+BENCH_EVENTS = 2000 #Per panel
+
+async def simulated_panel(ready, go):
+    '''Starts a server that streams zone events once go is set, returns it.'''
+    async def handle(_reader, writer):
+        ready.release()
+        await go.wait()
+        for i in range(BENCH_EVENTS):
+            writer.write(str.format('G00{0}N{1:03d}A001\r', i % 2, i % 48 + 1).encode('ascii'))
+            if i % 100 == 0:
+                await writer.drain()
+        await writer.drain()
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+async def bench(panel_count):
+    '''Prints the events per second and latency for the number of panels.'''
+    ready = asyncio.Semaphore(0)
+    go = asyncio.Event()
+    servers = [await simulated_panel(ready, go) for _ in range(panel_count)]
+    manager = ParadoxPanelManager()
+    for number, server in enumerate(servers):
+        manager.add_panel(str(number), prt_port=str.format('socket://127.0.0.1:{0}',
+                                                            server.sockets[0].getsockname()[1]))
+    done = asyncio.Event()
+    total = panel_count * BENCH_EVENTS
+    last_seen = {}
+    def listener(name, _message):
+        last_seen[name] = time.perf_counter()
+        if manager.dispatched == total:
+            done.set()
+    manager.add_listener(listener)
+    await manager.start()
+    for _ in servers:
+        await ready.acquire()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    go.set()
+    await done.wait()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    finish = sorted(seen - start for seen in last_seen.values())
+    print(str.format('{0:>4} panels: {1:>9,.0f} events/s, {2:6.1f} us CPU/event, '
+                     'first/last panel done after {3:.3f}/{4:.3f} s, {5} threads',
+                     panel_count, total / elapsed, cpu / total * 1e6, finish[0], finish[-1],
+                     threading.active_count()))
+    await manager.stop()
+    for server in servers:
+        server.close()
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    for count in BENCH_PANELS:
+        asyncio.run(bench(count))
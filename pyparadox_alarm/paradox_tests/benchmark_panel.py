@@ -0,0 +1,70 @@
+'''
+End-to-end benchmarks of ParadoxAlarmPanel against the PRT3 emulator: event to
+callback latency, events per second, CPU time per event and label sync time.
+'''
+
+import logging
+import threading
+import time
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_serial_comms import REQUEST_INTERVAL
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+
+BENCH_EVENTS = 5000
+BENCH_RATES = [100, 1000, None] #Events per second, None for as fast as 57600 baud allows
+BENCH_REPLY_DELAY = 0.005 #Time the emulated panel takes to answer a request
+TEST_TIMEOUT = 60
+
+def percentile(values, fraction):
+    '''Returns the value below which the fraction of (sorted) values fall.'''
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def bench_events(rate):
+    '''Prints latency percentiles, throughput and CPU per event for an event storm.'''
+    emulator = ParadoxPanelEmulator().start()
+    panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True)
+    callback_times = []
+    done = threading.Event()
+    def zone_changed(_zone):
+        callback_times.append(time.monotonic())
+        if len(callback_times) == BENCH_EVENTS:
+            done.set()
+    panel.callback_zone_state_change = zone_changed
+    panel.start()
+    cpu_start = time.process_time()
+    emulator.event_storm(BENCH_EVENTS, rate, seed=1)
+    done.wait(TEST_TIMEOUT)
+    cpu = time.process_time() - cpu_start
+    latencies = sorted(callback - sent for callback, sent
+                       in zip(callback_times, emulator.event_times))
+    elapsed = callback_times[-1] - emulator.event_times[0]
+    print(str.format('{0:>10} ev/s offered: {1:>7,.0f} ev/s handled, latency p50 {2:6.2f} ms, '
+                     'p99 {3:6.2f} ms, max {4:6.2f} ms, {5:5.1f} us CPU/event',
+                     rate or 'max', len(callback_times) / elapsed,
+                     percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+                     latencies[-1] * 1000, cpu / len(callback_times) * 1e6))
+    panel.stop()
+    emulator.stop()
+
+def bench_label_sync(paradox_model, max_zones, max_areas):
+    '''Prints the time needed to request all labels of a panel.'''
+    emulator = ParadoxPanelEmulator(max_zones, max_areas, reply_delay=BENCH_REPLY_DELAY).start()
+    panel = ParadoxAlarmPanel(paradox_model, prt_port=emulator.port, adaptive_pacing=True)
+    panel.start()
+    start = time.monotonic()
+    replies = [panel.request_zone_label(i) for i in range(1, max_zones + 1)]
+    replies += [panel.request_area_label(i) for i in range(1, max_areas + 1)]
+    for reply in replies:
+        reply.result(TEST_TIMEOUT)
+    elapsed = time.monotonic() - start
+    print(str.format('{0:>10} label sync: {1:6.2f} s ({2} requests, fixed pacing needs >= {3} s)',
+                     paradox_model, elapsed, len(replies), len(replies) * REQUEST_INTERVAL))
+    panel.stop()
+    emulator.stop()
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    for bench_rate in BENCH_RATES:
+        bench_events(bench_rate)
+    bench_label_sync('EVO48', 48, 4)
+    bench_label_sync('EVO192', 192, 8)
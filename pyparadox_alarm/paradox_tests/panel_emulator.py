@@ -0,0 +1,159 @@
+'''
+A software PRT3 on a pseudo-terminal, so ParadoxAlarmPanel can be tested and
+benchmarked without an alarm panel on /dev/ttyUSB0.
+'''
+
+import os
+import pty
+import random
+import threading
+import time
+import tty
+from collections import deque
+
+BITS_PER_BYTE = 10 #8N1
+
+class ParadoxPanelModel:
+    '''The state of an emulated panel and the replies it gives to requests.'''
+
+    def __init__(self, max_zones=48, max_areas=4):
+        self.max_zones = max_zones
+        self.max_areas = max_areas
+        self.zone_labels = {i: str.format('Zone {0:03d}', i) for i in range(1, max_zones + 1)}
+        self.area_labels = {i: str.format('Area {0:03d}', i) for i in range(1, max_areas + 1)}
+        self.zones_open = set()
+        self.areas_armed = set()
+
+    def reply(self, request):
+        '''Returns the reply to a request, None if the request is not answered.'''
+        _command = request[:2]
+        try:
+            _number = int(request[2:5])
+        except ValueError:
+            return None
+        if _command == 'ZL':
+            _label = self.zone_labels.get(_number)
+            return request[:5] + (_label if _label is not None else '&fail')
+        if _command == 'AL':
+            _label = self.area_labels.get(_number)
+            return request[:5] + (_label if _label is not None else '&fail')
+        if _command == 'RZ':
+            if not 0 < _number <= self.max_zones:
+                return request[:5] + '&fail'
+            return request[:5] + ('O' if _number in self.zones_open else 'C') + 'OOOO'
+        if _command == 'RA':
+            if not 0 < _number <= self.max_areas:
+                return request[:5] + '&fail'
+            return request[:5] + ('A' if _number in self.areas_armed else 'D') + 'OOOOOOO'
+        if _command in ['AA', 'AQ', 'AS']: #Arm, quick arm, stay arm
+            self.areas_armed.add(_number)
+            return request[:5] + '&ok'
+        if _command == 'AD': #Disarm
+            self.areas_armed.discard(_number)
+            return request[:5] + '&ok'
+        if _command in ['PE', 'PM', 'PF', 'UK']: #Panic and utility keys
+            return request[:5] + '&ok'
+        return None
+
+    def zone_event(self, zone, is_open):
+        '''Updates the zone and returns the matching system event.'''
+        if is_open:
+            self.zones_open.add(zone)
+        else:
+            self.zones_open.discard(zone)
+        return str.format('G{0:03d}N{1:03d}A001', 1 if is_open else 0, zone)
+
+
+class ParadoxPanelEmulator:
+    '''
+    Emulates a PRT3 on a pty; pass port to ParadoxAlarmPanel(prt_port=...).
+    Everything sent is paced to what the baud rate can carry, replies can be
+    delayed to model the processing time of the panel.
+    The time every system event went on the wire is kept in event_times.
+    '''
+    def __init__(self, max_zones=48, max_areas=4, speed=57600, reply_delay=0.0):
+        self.model = ParadoxPanelModel(max_zones, max_areas)
+        self._byte_time = BITS_PER_BYTE / speed
+        self._reply_delay = reply_delay
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._write_lock = threading.Lock()
+        self._wire_free_at = 0.0
+        self._shutdown = False
+        self._reader = threading.Thread(target=self._read_requests, daemon=True)
+        self.requests = []
+        self.event_times = deque()
+
+    def start(self):
+        '''Starts answering requests.'''
+        self._reader.start()
+        return self
+
+    def stop(self):
+        '''Stops the emulator and closes the pty.'''
+        self._shutdown = True
+        for _fd in [self._master, self._slave]:
+            try:
+                os.close(_fd)
+            except OSError:
+                pass
+
+    def send(self, message):
+        '''Sends a message at the speed of the emulated serial link.'''
+        _data = message.encode('ascii') + b'\r'
+        with self._write_lock:
+            _now = time.monotonic()
+            self._wire_free_at = max(self._wire_free_at, _now) + len(_data) * self._byte_time
+            if self._wire_free_at - _now > 0.001:
+                time.sleep(self._wire_free_at - _now)
+            os.write(self._master, _data)
+            return time.monotonic()
+
+    def send_event(self, event):
+        '''Sends a system event and notes when it was sent.'''
+        self.event_times.append(self.send(event))
+
+    def play(self, script):
+        '''Sends a script of (delay in seconds, event) pairs.'''
+        for _delay, _event in script:
+            if _delay > 0:
+                time.sleep(_delay)
+            self.send_event(_event)
+
+    def event_storm(self, count, rate=None, seed=None):
+        '''
+        Sends count random zone open/close events at rate events per second, or
+        as fast as the baud rate allows if no rate is given.
+        '''
+        _random = random.Random(seed)
+        _interval = 1.0 / rate if rate else 0.0
+        _next = time.monotonic()
+        for _ in range(count):
+            _zone = _random.randint(1, self.model.max_zones)
+            self.send_event(self.model.zone_event(_zone, _zone not in self.model.zones_open))
+            if _interval:
+                _next += _interval
+                _wait = _next - time.monotonic()
+                if _wait > 0:
+                    time.sleep(_wait)
+
+    def _read_requests(self):
+        '''Answers requests from the panel (as thread).'''
+        _buffer = b''
+        while not self._shutdown:
+            try:
+                _data = os.read(self._master, 1024)
+            except OSError:
+                break
+            _buffer += _data
+            while b'\r' in _buffer:
+                _request, _buffer = _buffer.split(b'\r', 1)
+                _request = _request.decode('ascii', 'replace')
+                self.requests.append(_request)
+                _reply = self.model.reply(_request)
+                if _reply is not None:
+                    if self._reply_delay:
+                        time.sleep(self._reply_delay)
+                    self.send(_reply)
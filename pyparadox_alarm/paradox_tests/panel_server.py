@@ -0,0 +1,88 @@
+'''A local TCP stand-in for a PRT3 behind a serial-to-TCP bridge, used by the tests.'''
+
+import socket
+import socketserver
+import threading
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelModel
+
+class _PanelHandler(socketserver.BaseRequestHandler):
+    '''Answers label and status requests the way a PRT3 would.'''
+
+    def handle(self):
+        self.server.clients.append(self.request)
+        try:
+            self._answer()
+        finally: #Closed by socketserver once we return, no more events for it
+            if self.request in self.server.clients:
+                self.server.clients.remove(self.request)
+
+    def _answer(self):
+        '''Answers the requests until the connection closes.'''
+        buffer = b''
+        while True:
+            try:
+                data = self.request.recv(1024)
+            except OSError: #Dropped by drop_clients()
+                break
+            if not data:
+                break
+            buffer += data
+            while b'\r' in buffer:
+                request, buffer = buffer.split(b'\r', 1)
+                self.server.requests.append(request.decode('ascii'))
+                reply = self.server.reply(request.decode('ascii'))
+                if reply:
+                    try:
+                        self.request.sendall(reply.encode('ascii') + b'\r')
+                    except OSError:
+                        return
+
+class ParadoxStandInServer(socketserver.ThreadingTCPServer):
+    '''
+    Listens on a free local port, use "socket://127.0.0.1:<port>" to connect.
+    Every request received is kept in requests.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _PanelHandler)
+        self.model = ParadoxPanelModel()
+        self.requests = []
+        self.clients = []
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        '''Returns the port to pass to the panel.'''
+        return str.format('socket://127.0.0.1:{0}', self.server_address[1])
+
+    def start(self):
+        '''Starts serving in the background.'''
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stops serving and drops all clients.'''
+        self.drop_clients()
+        self.shutdown()
+        self.server_close()
+
+    def drop_clients(self):
+        '''Closes all client connections, as a bridge restart would.'''
+        for client in list(self.clients):
+            try:
+                client.shutdown(socket.SHUT_RDWR) #Wakes the handler up, close() alone does not
+            except OSError:
+                pass
+            client.close()
+        del self.clients[:]
+
+    def send_event(self, event):
+        '''Sends a system event to all clients.'''
+        for client in list(self.clients):
+            client.sendall(event.encode('ascii') + b'\r')
+
+    def reply(self, request):
+        '''Returns the reply to a request, None if the request is not answered.'''
+        return self.model.reply(request)
@@ -1,7 +1,6 @@
 '''Some code to help test Paradox alarm interface.'''
 
 import logging
-import time
 from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
 
 _LOGGER = logging.getLogger(__name__)
@@ -23,12 +22,12 @@ _LOGGER.info('Alarm State before:')
 #print(panel.alarm_state['zone'])
 print(panel.alarm_state)
 panel.start()
-panel.request_all_labels(TEST_TOT_AREA, TEST_TOT_ZONE)
-time.sleep(TEST_TOT_WAIT) #Wait because we're using threading
+replies = [panel.request_zone_label(i, TEST_TOT_WAIT) for i in range(1, TEST_TOT_ZONE + 1)]
+replies += [panel.request_area_label(i, TEST_TOT_WAIT) for i in range(1, TEST_TOT_AREA + 1)]
+for reply in replies:
+    _LOGGER.info('Reply: %s', reply.result()) #Wait for exactly the replies we need
 _LOGGER.info('Alarm State after:')
 print(panel.alarm_state)
 _LOGGER.info('Disconnecting...')
-panel.stop()
-_LOGGER.info('Waiting for all to stop:')
-time.sleep(10)
+panel.stop() #Returns once all threads have stopped
 _LOGGER.info('End test:')
@@ -0,0 +1,41 @@
+'''Checks the bulk statistics against a small, hand-made capture.'''
+
+import pytest
+
+np = pytest.importorskip('numpy')
+from pyparadox_alarm import alarm_analytics #pylint: disable=wrong-import-position
+
+CAPTURE = b'\r\n'.join([
+    b'100.0 G001N005A001', #Zone 5 opens...
+    b'105.0 G001N005A001', #...again, still counts from 100
+    b'110.0 RZ005OOOOO',
+    b'130.0 G000N005A001', #...and closes after 30 s
+    b'140.0 G001N006A001', #Zone 6 never closes
+    b'150.0 G009N001A002', #Area 2 armed
+    b'160.0 G010N001A002', #Armed again, no change
+    b'170.0 G013N001A002', #Disarmed
+    b'G999N001A001',
+    b'garbage'])
+
+def test_parse_capture():
+    '''Replies, unknown groups and garbage are skipped.'''
+    events = alarm_analytics.parse_capture(CAPTURE)
+    assert events['group'].tolist() == [1, 1, 0, 1, 9, 10, 13]
+    assert events['number'][0] == 5 and events['area'][-1] == 2
+
+def test_parse_capture_malformed_time():
+    '''A line with a time that is not a number is skipped, not the whole capture.'''
+    events = alarm_analytics.parse_capture(CAPTURE + b'\r\n12:00 G001N007A001\r\nG001N008A001')
+    assert events['group'].tolist() == [1, 1, 0, 1, 9, 10, 13, 1]
+    assert events['number'][-1] == 8 and np.isnan(events['time'][-1])
+
+def test_statistics():
+    '''Open durations, triggers and the arm/disarm timeline.'''
+    events = alarm_analytics.parse_capture(CAPTURE)
+    durations = alarm_analytics.open_durations(events)
+    assert durations.tolist() == [(5, 100.0, 30.0)]
+    zones, counts = alarm_analytics.triggers_per_hour(events)
+    assert zones.tolist() == [5, 6] and counts[:, 0].tolist() == [2, 1]
+    timeline = alarm_analytics.area_timeline(events)
+    assert [(row['time'], row['armed']) for row in timeline] == [(150.0, True), (170.0, False)]
+    assert alarm_analytics.chattering_zones(events, count=2, window=10)['zone'].tolist() == [5]
@@ -0,0 +1,86 @@
+'''Drives the asyncio panel against the emulated PRT3.'''
+
+import asyncio
+from pyparadox_alarm.alarm_async import AsyncParadoxAlarmPanel
+from pyparadox_alarm.alarm_scheduler import PRIORITY_CONTROL
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+
+TEST_TIMEOUT = 5
+
+async def _wait_for(condition):
+    '''Waits on the event loop until the condition is met.'''
+    _loop = asyncio.get_running_loop()
+    _deadline = _loop.time() + TEST_TIMEOUT
+    while not condition():
+        assert _loop.time() < _deadline
+        await asyncio.sleep(0.01)
+
+def test_requests_go_through_the_scheduler():
+    '''Synchronous callers queue requests too, in priority order and without duplicates.'''
+    async def _run(emulator):
+        panel = AsyncParadoxAlarmPanel(prt_port=emulator.port, request_interval=0.01)
+        #Queued before start(): label requests, then a control command overtaking them
+        panel.request_all_labels(1, 3)
+        assert not panel.submit_zone_label_request(2)
+        assert await panel.async_submit_request('AA001', PRIORITY_CONTROL)
+        async with panel:
+            await _wait_for(lambda: panel.alarm_state['partition'][1]['name'] == 'Area 001')
+            assert await asyncio.wait_for(panel.async_request('ZL009'), TEST_TIMEOUT)
+        assert emulator.requests[0] == 'AA001'
+        assert emulator.requests.count('ZL002') == 1
+        assert panel.alarm_state['zone'][3]['name'] == 'Zone 003'
+    emulator = ParadoxPanelEmulator().start()
+    try:
+        asyncio.run(_run(emulator))
+    finally:
+        emulator.stop()
+
+def test_restart():
+    '''A stopped panel answers requests again after the next start().'''
+    async def _run(emulator):
+        panel = AsyncParadoxAlarmPanel(prt_port=emulator.port, request_interval=0.01)
+        for zone in [1, 2]:
+            async with panel:
+                reply = await asyncio.wait_for(
+                    asyncio.wrap_future(panel.request_zone_label(zone)), TEST_TIMEOUT)
+                assert reply == str.format('ZL{0:03d}Zone {0:03d}', zone)
+        assert not panel.is_connected
+    emulator = ParadoxPanelEmulator().start()
+    try:
+        asyncio.run(_run(emulator))
+    finally:
+        emulator.stop()
+
+def test_stop_keeps_queued_requests():
+    '''Requests queued while the writer waits out the interval are written after a restart.'''
+    async def _run(emulator):
+        panel = AsyncParadoxAlarmPanel(prt_port=emulator.port, request_interval=TEST_TIMEOUT)
+        async with panel:
+            panel.submit_request('ZL001')
+            await _wait_for(lambda: 'ZL001' in emulator.requests)
+            panel.submit_request('ZL002') #Waits for the interval to pass
+            await asyncio.sleep(0.1)
+        assert panel._to_alarm.qsize() == 1 and 'ZL002' not in emulator.requests
+        async with panel:
+            await _wait_for(lambda: 'ZL002' in emulator.requests)
+    emulator = ParadoxPanelEmulator().start()
+    try:
+        asyncio.run(_run(emulator))
+    finally:
+        emulator.stop()
+
+def test_discovery_on_start():
+    '''Without a model or speed start() probes the speed and discovers the panel.'''
+    async def _run(emulator):
+        panel = AsyncParadoxAlarmPanel(paradox_model=None, prt_port=emulator.port,
+                                       prt_speed=None, request_interval=0.01)
+        async with panel:
+            assert panel.paradox_model == 'EVO48' and panel.enrolled_zones == (1, 3)
+            assert len(panel.alarm_state['zone']) == 3
+    emulator = ParadoxPanelEmulator().start()
+    emulator.model.zone_labels[1] = 'Front door'
+    emulator.model.zone_labels[3] = 'Garage'
+    try:
+        asyncio.run(_run(emulator))
+    finally:
+        emulator.stop()
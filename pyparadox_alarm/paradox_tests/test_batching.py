@@ -0,0 +1,43 @@
+'''Delivers state changes only when they change something, folded per window.'''
+
+from pyparadox_alarm.alarm_batching import ParadoxChangeBatcher
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+
+def test_changes_folded_per_window():
+    '''Repeated changes fold into one delta, a change undone within the window is left out.'''
+    batches = []
+    scheduled = []
+    panel = ParadoxAlarmPanel(coalesce_window=1.0)
+    panel.callback_state_changes = batches.append
+    panel._batcher._schedule = lambda delay, function: scheduled.append((delay, function))
+    panel.update_zone_status(3, 'O')
+    panel.update_zone_status(3, 'OA')
+    panel.update_zone_status(4, 'O')
+    panel.update_zone_status(4, 'C')
+    panel.update_area_status(1, 'A')
+    assert len(scheduled) == 1 and scheduled[0][0] == 1.0 and not batches
+    scheduled[0][1]()
+    [batch] = batches
+    deltas = {entity: (old, new) for entity, old, new in batch}
+    assert set(deltas) == {('zone', 3), ('partition', 1)}
+    old, new = deltas[('zone', 3)]
+    assert not old['open'] and new['open'] and new['alarm']
+    assert deltas[('partition', 1)][1]['armed_away']
+
+def test_no_window_delivers_each_change():
+    '''With a window of 0 every change is its own batch, straight away.'''
+    batches = []
+    batcher = ParadoxChangeBatcher(batches.append, 0, None)
+    batcher.changed('zone', 1, 0, 1)
+    batcher.changed('zone', 1, 1, 0)
+    assert [len(batch) for batch in batches] == [1, 1] and batcher.batches == 2
+
+def test_change_only_callbacks():
+    '''With change_only a status reply that changes nothing calls nobody.'''
+    calls = []
+    panel = ParadoxAlarmPanel(change_only=True)
+    panel.callback_zone_state_change = calls.append
+    panel.update_zone_status(5, 'O')
+    panel.update_zone_status(5, 'O')
+    panel.update_zone_status(5, 'C')
+    assert calls == [5, 5]
@@ -0,0 +1,47 @@
+'''Saves the alarm state to disk and warm starts from it.'''
+
+import tempfile
+from pyparadox_alarm.alarm_cache import ParadoxStateCache
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_state import CompactAlarmState
+
+PORT = 'socket://panel:1'
+
+def test_round_trip_and_label_ttl():
+    '''Labels and statuses come back; only labels older than the TTL are stale.'''
+    with tempfile.TemporaryDirectory() as directory:
+        state = CompactAlarmState(48, 4)
+        state.set_zone_name(3, 'Garage')
+        state.set_zone_flag(3, 'open', True)
+        state.set_partition_name(1, 'House')
+        cache = ParadoxStateCache(directory, PORT, 'EVO48', label_ttl=60)
+        cache.label_updated('zone', 3)
+        assert cache.save(state)
+        loaded = CompactAlarmState(48, 4)
+        cache = ParadoxStateCache(directory, PORT, 'EVO48', label_ttl=60)
+        assert cache.load(loaded)
+        assert loaded.view['zone'][3]['name'] == 'Garage'
+        assert loaded.view['zone'][3]['status']['open']
+        assert loaded.view['partition'][1]['name'] == 'House'
+        assert loaded.zone_updated(3) == 0 #Not confirmed by the panel yet
+        assert cache.stale_labels('zone', [1, 3]) == [1]
+
+def test_snapshot_of_another_panel_ignored():
+    '''A snapshot is only loaded for the port and model it was taken from.'''
+    with tempfile.TemporaryDirectory() as directory:
+        state = CompactAlarmState(48, 4)
+        state.set_zone_name(3, 'Garage')
+        ParadoxStateCache(directory, PORT, 'EVO48').save(state)
+        assert not ParadoxStateCache(directory, 'socket://other:1', 'EVO48').load(state)
+        assert not ParadoxStateCache(directory, PORT, 'EVO96').load(CompactAlarmState(96, 8))
+
+def test_panel_warm_start():
+    '''A panel with a cache_dir starts from what the previous one saved.'''
+    with tempfile.TemporaryDirectory() as directory:
+        panel = ParadoxAlarmPanel(prt_port=PORT, cache_dir=directory)
+        panel.update_zone_name(7, 'Hall')
+        panel.update_area_status(2, 'A')
+        assert panel.save_snapshot()
+        panel = ParadoxAlarmPanel(prt_port=PORT, cache_dir=directory)
+        assert panel.alarm_state['zone'][7]['name'] == 'Hall'
+        assert panel.alarm_state['partition'][2]['status']['armed_away']
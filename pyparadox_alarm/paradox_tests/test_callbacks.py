@@ -0,0 +1,81 @@
+'''Runs client callbacks on the executor: ordered per entity, bounded, with lag.'''
+
+import threading
+import time
+from pyparadox_alarm.alarm_callbacks import (ParadoxCallbackExecutor, OVERFLOW_COALESCE,
+                                             OVERFLOW_DROP_OLDEST)
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+
+TEST_TIMEOUT = 5
+
+def test_order_per_entity():
+    '''One slow zone does not hold up the others, each zone sees its calls in order.'''
+    calls = []
+    release = threading.Event()
+    executor = ParadoxCallbackExecutor(workers=2)
+    executor.start()
+    slow = lambda number: release.wait(TEST_TIMEOUT) and calls.append(('slow', number))
+    executor.submit(('zone', 1), 'zone_state_change', slow, 1)
+    for i in range(5):
+        executor.submit(('zone', 1), 'zone_state_change', lambda n, i=i: calls.append((n, i)), 1)
+        executor.submit(('zone', 2), 'zone_state_change', lambda n, i=i: calls.append((n, i)), 2)
+    _deadline = time.monotonic() + TEST_TIMEOUT
+    while len(calls) < 5 and time.monotonic() < _deadline:
+        time.sleep(0.01)
+    assert calls == [(2, i) for i in range(5)]
+    release.set()
+    executor.stop()
+    assert [call for call in calls if call[0] != 2] == [('slow', 1)] + [(1, i) for i in range(5)]
+    assert executor.lag['max'] > 0
+
+def test_lag_counted_by_all_workers():
+    '''Every callback run by any of the workers is counted in the lag.'''
+    executor = ParadoxCallbackExecutor(workers=8, queue_size=4000)
+    executor.start()
+    for i in range(4000):
+        executor.submit(('zone', i % 64), 'zone_state_change', lambda n: None, i % 64)
+    executor.stop()
+    assert executor.lag['count'] == 4000
+
+def test_overflow_policies():
+    '''A full queue drops the oldest callbacks, or merges identical ones.'''
+    for overflow in [OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE]:
+        calls = []
+        release = threading.Event()
+        executor = ParadoxCallbackExecutor(workers=1, queue_size=3, overflow=overflow)
+        executor.start()
+        executor.submit(('zone', 1), 'zone_state_change', lambda n: release.wait(TEST_TIMEOUT), 1)
+        time.sleep(0.05) #The worker is now blocked
+        for i in range(10):
+            executor.submit(('zone', 1), 'zone_state_change',
+                            calls.append if overflow == OVERFLOW_COALESCE else
+                            lambda n, i=i: calls.append(i), 1)
+        release.set()
+        executor.stop()
+        if overflow == OVERFLOW_COALESCE:
+            assert calls == [1] and executor.coalesced == 9
+        else:
+            assert calls == [7, 8, 9] and executor.dropped == 7
+
+def test_slow_callback_does_not_stall_decoding():
+    '''Events keep being decoded while a client callback blocks.'''
+    emulator = ParadoxPanelEmulator().start()
+    release = threading.Event()
+    try:
+        panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True,
+                                  callback_workers=2)
+        panel.callback_zone_state_change = lambda number: number != 1 or release.wait(TEST_TIMEOUT)
+        panel.start()
+        emulator.send_event('G001N001A001')
+        for zone in range(2, 11):
+            emulator.send_event(str.format('G001N{0:03d}A001', zone))
+        _deadline = time.monotonic() + TEST_TIMEOUT
+        while panel.alarm_state['zone'][10]['status']['open'] is not True:
+            assert time.monotonic() < _deadline
+            time.sleep(0.01)
+        assert panel.callback_lag['waiting'] <= 1
+        release.set()
+        panel.stop()
+    finally:
+        emulator.stop()
@@ -0,0 +1,121 @@
+'''Discovers the speed, model and enrolled zones/areas and sizes the state to them.'''
+
+import functools
+import tempfile
+import threading
+from concurrent.futures import Future
+import pytest
+from pyparadox_alarm import alarm_panel
+from pyparadox_alarm.alarm_cache import ParadoxStateCache
+from pyparadox_alarm.alarm_discovery import (DiscoveryResult, discover, discover_enrolled,
+                                             is_default_label, probe_speed)
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_requests import ParadoxRequestTimeout
+from pyparadox_alarm.alarm_state import CompactAlarmState
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+
+def _emulator():
+    '''Returns a started emulator with zones 1, 2, 5 and 30 and area 2 programmed.'''
+    emulator = ParadoxPanelEmulator().start()
+    for number, label in [(1, 'Front door'), (2, 'Kitchen'), (5, 'Garage'), (30, 'Attic')]:
+        emulator.model.zone_labels[number] = label
+    emulator.model.area_labels[2] = 'Garden'
+    return emulator
+
+def test_default_labels():
+    '''Only the labels a panel starts with count as not programmed.'''
+    assert is_default_label('Zone 012') and is_default_label('Area 1 ')
+    assert not is_default_label('Front door') and not is_default_label('Zone 1 upstairs')
+
+def test_discover_model_and_enrolled():
+    '''The model follows from the &fail replies, the search stops after the gap.'''
+    emulator = _emulator()
+    try:
+        panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True)
+        panel.start()
+        result = discover(panel.request)
+        assert result == ('EVO48', (1, 2, 5, 30), (1, 2))
+        assert discover(panel.request, 'EVO48', max_gap=8).zones == (1, 2, 5)
+        panel.stop()
+    finally:
+        emulator.stop()
+
+def test_panel_sized_to_enrolled():
+    '''Without a model or speed the panel probes both and keeps only what is in use.'''
+    emulator = _emulator()
+    try:
+        assert probe_speed(emulator.port) == 57600
+        panel = ParadoxAlarmPanel(paradox_model=None, prt_port=emulator.port, prt_speed=None,
+                                  adaptive_pacing=True)
+        panel.start()
+        panel.stop()
+        assert panel.paradox_model == 'EVO48'
+        assert panel.enrolled_zones == (1, 2, 5, 30) and panel.enrolled_areas == (1, 2)
+        assert len(panel.alarm_state['zone']) == 30 and len(panel.alarm_state['partition']) == 2
+        assert panel.alarm_state['zone'][30]['name'] == 'Attic'
+        assert panel.find_zone('kitchen') == [2]
+        assert panel.resync(0) == 2 #Both areas, every zone is idle
+    finally:
+        emulator.stop()
+
+def test_discover_with_fixed_pacing():
+    '''Requests queued behind the window get the pacing in front of them on top of the timeout.'''
+    emulator = _emulator()
+    try:
+        panel = ParadoxAlarmPanel(prt_port=emulator.port, request_interval=0.05)
+        panel.start()
+        #16 labels queued at once go out over 0.8 s, far beyond the timeout
+        result = discover(panel.request, 'EVO48', timeout=0.2, interval=0.05,
+                          cancel=panel.cancel_requests)
+        panel.stop()
+        assert result == ('EVO48', (1, 2, 5, 30), (1, 2))
+    finally:
+        emulator.stop()
+
+def test_unanswered_label_kept_and_cancelled():
+    '''A label not read in time counts as enrolled and its request is cancelled.'''
+    def request(request, timeout, retries):
+        future = Future()
+        if request == 'ZL003':
+            future.set_exception(ParadoxRequestTimeout('No reply'))
+        else:
+            future.set_result(request + ('Hall' if request == 'ZL001' else 'Zone ' + request[2:]))
+        return future
+    cancelled = []
+    assert discover_enrolled(request, 'ZL', 48, max_gap=4, cancel=cancelled.append) == [1, 3]
+    assert cancelled == ['ZL003']
+
+def test_cached_labels_not_read_stay_stale():
+    '''Once the model is known the snapshot is loaded, without overwriting what it holds.'''
+    with tempfile.TemporaryDirectory() as directory:
+        state = CompactAlarmState(48, 4)
+        state.set_zone_name(3, 'Attic')
+        ParadoxStateCache(directory, 'socket://panel:1', 'EVO48').save(state)
+        panel = ParadoxAlarmPanel(paradox_model=None, prt_port='socket://panel:1',
+                                  cache_dir=directory)
+        panel.update_zone_name(1, 'Hall') #Read during discovery
+        panel._apply_discovery(DiscoveryResult('EVO48', (1, 3), (1,)))
+        assert panel.alarm_state['zone'][1]['name'] == 'Hall'
+        assert panel.alarm_state['zone'][3]['name'] == 'Attic'
+        panel.revalidate_labels()
+        assert panel.cancel_requests() == 2 #ZL003 and AL001, not ZL001
+
+def test_failed_discovery_stops_the_panel(monkeypatch):
+    '''start() leaves nothing running when discovery fails, and can be retried.'''
+    monkeypatch.setattr(alarm_panel, 'discover', functools.partial(discover, timeout=0.2))
+    emulator = _emulator()
+    try:
+        _threads = set(threading.enumerate())
+        emulator.model.reply = lambda request: None #Silent panel
+        panel = ParadoxAlarmPanel(paradox_model=None, prt_port=emulator.port,
+                                  adaptive_pacing=True)
+        with pytest.raises(OSError, match='did not answer'):
+            panel.start()
+        assert not [thread for thread in set(threading.enumerate()) - _threads
+                    if thread.is_alive() and not thread.name.startswith('ThreadPoolExecutor')]
+        del emulator.model.reply
+        panel.start()
+        panel.stop()
+        assert panel.paradox_model == 'EVO48'
+    finally:
+        emulator.stop()
@@ -0,0 +1,42 @@
+'''Dispatches responses on the monitoring thread and traces their latency.'''
+
+import time
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+
+TEST_TIMEOUT = 5
+
+def test_event_latency():
+    '''The time from reading a message to the end of its callbacks is counted and kept.'''
+    panel = ParadoxAlarmPanel()
+    assert panel.event_latency == {'count': 0, 'last': 0.0, 'max': 0.0, 'average': 0.0}
+    panel._dispatch_response(('G001N005A001', time.monotonic() - 0.5))
+    panel._dispatch_response(('G000N005A001', time.monotonic() - 0.1))
+    panel._dispatch_response('G001N006A001') #Without read time, not counted
+    latency = panel.event_latency
+    assert latency['count'] == 2
+    assert 0.1 <= latency['last'] < 0.5 <= latency['max']
+    assert latency['average'] == (latency['last'] + latency['max']) / 2
+    assert panel.alarm_state['zone'][6]['status']['open']
+
+def test_failing_callback_keeps_monitoring():
+    '''A callback or listener raising on a message does not end the monitoring thread.'''
+    emulator = ParadoxPanelEmulator().start()
+    panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True)
+    def _fail(zone):
+        raise RuntimeError(str.format('Callback failed on zone {0}.', zone))
+    panel.callback_zone_state_change = _fail
+    panel.add_listener(_fail)
+    panel.start()
+    try:
+        emulator.send_event('G001N005A001')
+        assert panel.request_zone_label(1).result(TEST_TIMEOUT) == 'ZL001Zone 001'
+        assert panel.alarm_state['zone'][5]['status']['open']
+        _deadline = time.monotonic() + TEST_TIMEOUT
+        while panel.event_latency['count'] < 2: #Counted once the reply is decoded
+            assert time.monotonic() < _deadline
+            time.sleep(0.01)
+        assert panel._monitor_thread.is_alive()
+    finally:
+        panel.stop()
+        emulator.stop()
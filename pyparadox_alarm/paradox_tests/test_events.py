@@ -0,0 +1,76 @@
+'''Feeds system events to the decoder and checks the zone and area flags they leave.'''
+
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+
+def _panel(*events):
+    '''Returns a panel that decoded the events.'''
+    panel = ParadoxAlarmPanel()
+    for event in events:
+        panel.decode_response(event)
+    return panel
+
+def _zone(panel, zone):
+    '''Returns the status flags of a zone.'''
+    return panel.alarm_state['zone'][zone]['status']
+
+def _area(panel, area):
+    '''Returns the status flags of an area.'''
+    return panel.alarm_state['partition'][area]['status']
+
+def test_zone_ok_clears_tamper_and_fault():
+    '''G000 after an open, tamper (G002) or fault (G003) leaves the zone OK.'''
+    panel = _panel('G001N005A001', 'G002N005A001', 'G003N005A001')
+    assert _zone(panel, 5)['open'] and _zone(panel, 5)['tamper'] and _zone(panel, 5)['fault']
+    assert panel.alarm_state['zone'][5]['last_fault'] > 0
+    panel.decode_response('G000N005A001')
+    assert not any(_zone(panel, 5)[flag] for flag in ['open', 'tamper', 'fault'])
+
+def test_zone_events():
+    '''Tamper, bypass, alarm, fire, low battery and supervision, and their restores.'''
+    panel = _panel('G030N007A001', 'G023N007A001', 'G024N007A001', 'G025N008A001',
+                   'G037N009A001', 'G038N009A001')
+    assert _zone(panel, 7)['tamper'] and _zone(panel, 7)['bypass'] and _zone(panel, 7)['alarm']
+    assert _zone(panel, 8)['fire'] and _area(panel, 1)['fire'] and _area(panel, 1)['alarm']
+    assert _zone(panel, 9)['low_battery'] and _zone(panel, 9)['supervision_lost']
+    for event in ['G031N007A001', 'G053N007A001', 'G026N007A001', 'G027N008A001',
+                  'G039N009A001', 'G040N009A001']:
+        panel.decode_response(event)
+    assert not any(_zone(panel, 7)[flag] for flag in ['tamper', 'bypass', 'alarm'])
+    assert not _zone(panel, 8)['fire'] and not _area(panel, 1)['fire']
+    assert not _zone(panel, 9)['low_battery'] and not _zone(panel, 9)['supervision_lost']
+    assert panel._state.zone_area(7) == 1
+
+def test_trouble_and_ac_loss():
+    '''New trouble and AC failure (G032), restored by G033; area 0 means all areas.'''
+    panel = _panel('G032N001A000', 'G032N003A002')
+    assert not _area(panel, 1)['ac_present'] and not _area(panel, 2)['ac_present']
+    assert _area(panel, 2)['trouble'] and not _area(panel, 1)['trouble']
+    panel.decode_response('G033N001A000')
+    panel.decode_response('G033N003A002')
+    assert _area(panel, 1)['ac_present'] and not _area(panel, 2)['trouble']
+
+def test_status_groups_set_and_clear():
+    '''Status events set their flag and clear the ones it rules out.'''
+    panel = _panel('G065N000A001')
+    assert _area(panel, 1)['ready']
+    panel.decode_response('G001N005A001') #An open zone: not ready
+    assert not _area(panel, 1)['ready']
+    panel.decode_response('G065N000A001')
+    panel.decode_response('G065N001A001') #Exit delay
+    assert _area(panel, 1)['exit_delay'] and not _area(panel, 1)['ready']
+    panel.decode_response('G065N002A001') #Entry delay
+    assert _area(panel, 1)['entry_delay'] and not _area(panel, 1)['exit_delay']
+    panel.decode_response('G064N002A001') #Stay armed
+    assert _area(panel, 1)['armed_stay'] and not _area(panel, 1)['alpha']
+
+def test_arm_and_disarm_clear_memory_and_bypass():
+    '''Arming clears the alarm memory, disarming the armed-with-bypass flag.'''
+    panel = _panel('G065N004A001', 'G065N005A001')
+    assert _area(panel, 1)['alarm_in_memory'] and _area(panel, 1)['armed_bypass']
+    panel.decode_response('G009N001A001')
+    assert _area(panel, 1)['armed_away'] and not _area(panel, 1)['alarm_in_memory']
+    panel.decode_response('G064N006A001') #Audible alarm
+    assert _area(panel, 1)['alarm']
+    panel.decode_response('G016N001A001') #Disarmed after an alarm
+    assert not _area(panel, 1)['alarm'] and not _area(panel, 1)['armed_bypass']
+    assert _area(panel, 1)['alpha'] and not _area(panel, 1)['armed_away']
@@ -0,0 +1,90 @@
+'''Shares one emulated PRT3 with several subscribers of the fan-out server.'''
+
+import os
+import tempfile
+import pytest
+from pyparadox_alarm.alarm_fanout import (ParadoxFanoutServer, ParadoxFanoutClient, Message,
+                                          StatusChange, NameChange, decode_snapshot,
+                                          encode_snapshot, split_frames)
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_state import AlarmStateSnapshot
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+
+TEST_TIMEOUT = 5
+
+def _read_until(client, condition):
+    '''Returns the frames read until one meets the condition.'''
+    frames = []
+    while not frames or not condition(frames[-1]):
+        frames.append(client.read())
+    return frames
+
+def test_snapshot_round_trip():
+    '''Names, statuses and faults survive the binary encoding.'''
+    panel = ParadoxAlarmPanel()
+    panel.update_zone_name(3, 'Garage door')
+    panel.update_zone_status(3, 'OA')
+    panel.update_area_status(2, 'S')
+    buffer = bytearray(encode_snapshot(panel.snapshot()))
+    [(_type, payload)] = split_frames(buffer)
+    snapshot = decode_snapshot(payload)
+    assert not buffer
+    assert snapshot.version == panel.state_version
+    assert snapshot.view['zone'][3]['name'] == 'Garage door'
+    assert snapshot.view['zone'][3]['status']['alarm']
+    assert snapshot.view['zone'][3]['last_fault'] == panel.alarm_state['zone'][3]['last_fault']
+    assert snapshot.view['partition'][2]['status']['armed_stay']
+
+def test_subscribers_share_the_panel():
+    '''Every subscriber sees the events, identical requests are written once.'''
+    emulator = ParadoxPanelEmulator().start()
+    with tempfile.TemporaryDirectory() as directory:
+        panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True)
+        server = ParadoxFanoutServer(panel, os.path.join(directory, 'paradox.sock'))
+        try:
+            server.start()
+            clients = [ParadoxFanoutClient(server.address, TEST_TIMEOUT).connect()
+                       for _ in range(3)]
+            for client in clients:
+                assert isinstance(client.read(), AlarmStateSnapshot)
+            emulator.send_event('G001N005A001')
+            for client in clients:
+                frames = _read_until(client, lambda frame: isinstance(frame, StatusChange))
+                assert frames[0] == Message(frames[0].time, 'G001N005A001')
+                assert frames[-1].number == 5 and frames[-1].status['open']
+            for client in clients:
+                client.submit_request('ZL007')
+            for client in clients:
+                frames = _read_until(client, lambda frame: isinstance(frame, NameChange))
+                assert frames[-1].name == 'Zone 007'
+            assert emulator.requests.count('ZL007') == 1
+            for client in clients:
+                client.close()
+        finally:
+            server.stop()
+            emulator.stop()
+
+def test_invalid_priority_drops_only_that_subscriber():
+    '''A priority beyond the classes disconnects the subscriber, the server carries on.'''
+    emulator = ParadoxPanelEmulator().start()
+    with tempfile.TemporaryDirectory() as directory:
+        panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True)
+        server = ParadoxFanoutServer(panel, os.path.join(directory, 'paradox.sock'))
+        try:
+            server.start()
+            bad = ParadoxFanoutClient(server.address, TEST_TIMEOUT).connect()
+            good = ParadoxFanoutClient(server.address, TEST_TIMEOUT).connect()
+            assert isinstance(bad.read(), AlarmStateSnapshot)
+            assert isinstance(good.read(), AlarmStateSnapshot)
+            bad.submit_request('RZ001', priority=7)
+            with pytest.raises(ConnectionError):
+                bad.read()
+            good.submit_request('ZL007')
+            frames = _read_until(good, lambda frame: isinstance(frame, NameChange))
+            assert frames[-1].name == 'Zone 007'
+            assert 'RZ001' not in emulator.requests
+            bad.close()
+            good.close()
+        finally:
+            server.stop()
+            emulator.stop()
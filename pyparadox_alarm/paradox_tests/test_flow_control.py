@@ -0,0 +1,49 @@
+'''Paces requests by the replies: window growth, halving on failures and timeouts.'''
+
+import threading
+from pyparadox_alarm.alarm_flow_control import ParadoxFlowControl
+
+TEST_TIMEOUT = 5
+
+def test_window_grows_with_acks_and_halves_on_fail():
+    '''Each ack widens the window up to max_in_flight, &fail halves it.'''
+    flow = ParadoxFlowControl(57600, max_in_flight=4)
+    assert flow.window == 1 and flow.acquire('ZL001')
+    assert flow.in_flight == 1
+    assert flow.acknowledge('ZL001Front door') and flow.window == 2
+    assert not flow.acknowledge('ZL002Kitchen') #Never sent
+    for i in range(2, 6):
+        assert flow.acquire(str.format('ZL{0:03d}', i))
+        assert flow.acknowledge(str.format('ZL{0:03d}Zone', i))
+    assert flow.window == 4 and flow.acknowledged == 5
+    assert flow.acquire('AA001') and flow.acknowledge('AA001&fail')
+    assert flow.window == 2 and flow.failed == 1
+    assert flow.rtt is not None and flow.ack_timeout >= 0.25
+
+def test_full_window_blocks_until_reply():
+    '''A request waits while the window is full and goes out on the reply.'''
+    flow = ParadoxFlowControl(57600)
+    assert flow.acquire('ZL001')
+    acquired = threading.Event()
+    writer = threading.Thread(target=lambda: flow.acquire('ZL002') and acquired.set())
+    writer.start()
+    assert not acquired.wait(0.1)
+    flow.acknowledge('ZL001Front door')
+    assert acquired.wait(TEST_TIMEOUT)
+    writer.join(TEST_TIMEOUT)
+    flow.close()
+
+def test_unanswered_request_times_out():
+    '''Without a reply the request is given up after the ack timeout, the window halves.'''
+    flow = ParadoxFlowControl(57600, max_in_flight=4, ack_timeout=0.05, min_ack_timeout=0.01)
+    for i in range(3):
+        flow.acquire(str.format('RZ{0:03d}', i + 1))
+        flow.acknowledge(str.format('RZ{0:03d}COOOO', i + 1))
+    assert flow.window == 4
+    for i in range(10, 14):
+        assert flow.acquire(str.format('RZ{0:03d}', i))
+    closer = threading.Timer(TEST_TIMEOUT, flow.close) #Rather than hang on a failure
+    closer.start()
+    assert flow.acquire('RZ014') #Only once the four in flight expired
+    closer.cancel()
+    assert flow.timed_out == 4 and flow.window == 1 and flow.in_flight == 1
@@ -0,0 +1,40 @@
+'''Splits the byte stream of the PRT3 into messages on carriage returns.'''
+
+from pyparadox_alarm.alarm_framing import ParadoxFramer, MAX_FRAME_LENGTH
+
+def test_frame_split_across_feeds():
+    '''A message completes only once its carriage return arrives.'''
+    framer = ParadoxFramer()
+    assert framer.feed(b'G001N0') == []
+    assert framer.pending == 6
+    assert framer.feed(b'05A0') == []
+    assert framer.feed(b'01\r') == ['G001N005A001']
+    assert framer.pending == 0 and framer.frames == 1
+
+def test_several_frames_in_one_chunk():
+    '''All complete messages come out in order, the rest waits; empty lines and line feeds go.'''
+    framer = ParadoxFramer()
+    assert framer.feed(b'ZL001Front door\r\n\rRZ001COOOO\rG000N') == [
+        'ZL001Front door', 'RZ001COOOO']
+    assert framer.feed(b'005A001\r') == ['G000N005A001']
+    assert framer.frames == 3
+
+def test_overflow_dropped():
+    '''Bytes without a terminator beyond MAX_FRAME_LENGTH are dropped, framing carries on.'''
+    framer = ParadoxFramer()
+    assert framer.feed(b'X' * MAX_FRAME_LENGTH) == []
+    assert framer.feed(b'X') == [] and framer.dropped == 1 and framer.pending == 0
+    assert framer.feed(b'G001N005A001\r') == ['G001N005A001']
+
+def test_reset():
+    '''reset() throws away a partial message, e.g. after a reconnect.'''
+    framer = ParadoxFramer()
+    framer.feed(b'ZL001Fro')
+    framer.reset()
+    assert framer.pending == 0
+    assert framer.feed(b'RA001DOOOOOO\r') == ['RA001DOOOOOO']
+
+def test_non_ascii_bytes():
+    '''Bytes that are not ASCII are replaced, the message and the next one survive.'''
+    framer = ParadoxFramer()
+    assert framer.feed(b'ZL002K\xfcche\rZL003Hall\r') == ['ZL002K\ufffdche', 'ZL003Hall']
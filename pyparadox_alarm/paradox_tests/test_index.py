@@ -0,0 +1,35 @@
+'''Answers open zones, zones by area and by name from the indexes.'''
+
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+
+def test_indexes_follow_the_state():
+    '''Events, replies and labels keep every index up to date.'''
+    panel = ParadoxAlarmPanel('EVO192')
+    panel.update_zone_name(12, 'Garage          ')
+    panel.update_zone_name(13, 'Kitchen         ')
+    panel.update_area_name(3, 'Upstairs        ')
+    for zone in [12, 13, 14]:
+        panel.decode_response(str.format('G000N{0:03d}A003', zone)) #Zone OK, in area 3
+    panel.decode_response('G001N012A003')
+    panel.decode_response('G024N013A003')
+    panel.decode_response('G030N014A003')
+    panel.update_zone_status(20, 'OAOOO') #No event yet, area unknown
+    assert panel.open_zones() == {12, 20}
+    assert panel.alarm_zones() == {13, 20}
+    assert panel.tamper_zones() == {14}
+    assert panel.zones_in_area(3) == {12, 13, 14}
+    assert panel.zone_area(20) is None
+    assert panel.find_zone('garage') == [12]
+    assert panel.find_area('UPSTAIRS') == [3]
+    counts = panel.area_zone_counts(3)
+    assert (counts['zones'], counts['open'], counts['alarm'], counts['tamper']) == (3, 1, 1, 1)
+
+    panel.decode_response('G000N012A003')
+    panel.update_zone_name(12, 'Garage door')
+    panel.decode_response('G001N013A004') #Zone 13 turns out to be in area 4
+    assert panel.open_zones() == {13, 20}
+    assert panel.find_zone('Garage') == [] and panel.find_zone('Garage door') == [12]
+    assert panel.zones_in_area(3) == {12, 14} and panel.zones_in_area(4) == {13}
+    counts = panel.area_zone_counts(3)
+    assert (counts['zones'], counts['open'], counts['alarm']) == (2, 0, 0)
+    assert panel.area_zone_counts(4)['alarm'] == 1
@@ -0,0 +1,60 @@
+'''Writes decoded messages to the event journal and queries them back.'''
+
+import os
+import time
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_journal import RECORD, ParadoxJournalReader
+
+TEST_TIMEOUT = 5
+
+def test_zone_history_across_segments(tmp_path):
+    '''A zone query finds its records in every segment, and only those.'''
+    panel = ParadoxAlarmPanel(journal_dir=str(tmp_path))
+    panel.journal._segment_size = 100 * RECORD.size
+    for i in range(1000):
+        panel.decode_response(str.format('G{0:03d}N{1:03d}A001', i % 2, i % 48 + 1))
+    panel.decode_response('RZ017OOOOO')
+    assert len(os.listdir(str(tmp_path))) == 10
+    records = panel.journal.query(zone=17, since=time.time() - 30 * 86400)
+    assert len(records) == 22
+    assert all(record.zone == 17 for record in records)
+    assert records[-1].type == 'RZ' and records[-1].status == 'OOOOO'
+    assert panel.alarm_state['zone'][17]['last_fault'] > 0
+
+def test_journal_survives_restart(tmp_path):
+    '''A new journal continues the last segment of the previous one.'''
+    panel = ParadoxAlarmPanel(journal_dir=str(tmp_path))
+    panel.decode_response('G001N005A002')
+    panel.journal.close()
+    panel = ParadoxAlarmPanel(journal_dir=str(tmp_path))
+    panel.decode_response('G000N005A002')
+    assert [record.group for record in panel.journal.query(area=2)] == [1, 0]
+    assert len(os.listdir(str(tmp_path))) == 1
+
+def test_quiet_panel_flushed_on_timer(tmp_path):
+    '''A buffered record is written batch_interval later, without another message.'''
+    panel = ParadoxAlarmPanel(journal_dir=str(tmp_path))
+    panel.journal._batch_interval = 0.05
+    panel.decode_response('G001N005A002')
+    _deadline = time.monotonic() + TEST_TIMEOUT
+    while sum(os.path.getsize(os.path.join(str(tmp_path), name))
+              for name in os.listdir(str(tmp_path))) < RECORD.size:
+        assert time.monotonic() < _deadline
+        time.sleep(0.01)
+    panel.journal.close()
+
+def test_saved_index_reused(tmp_path):
+    '''Full segments save their index, a new reader only indexes what was added since.'''
+    panel = ParadoxAlarmPanel(journal_dir=str(tmp_path))
+    panel.journal._segment_size = 100 * RECORD.size
+    for i in range(250):
+        panel.decode_response(str.format('G000N{0:03d}A001', i % 48 + 1))
+    assert len(panel.journal.query(zone=17)) == 5
+    assert len([name for name in os.listdir(str(tmp_path)) if name.endswith('.idx')]) == 2
+    reader = ParadoxJournalReader(str(tmp_path))
+    assert len(reader.query(zone=17)) == 5 and reader.indexed == 50
+    reader.close() #Saves the index of the last segment too
+    reader = ParadoxJournalReader(str(tmp_path))
+    assert len(reader.query(zone=17)) == 5 and reader.indexed == 0
+    reader.close()
+    panel.journal.close()
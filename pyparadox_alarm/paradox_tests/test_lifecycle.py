@@ -0,0 +1,108 @@
+'''Stops and restarts the panel against the emulated PRT3 and times it.'''
+
+import threading
+import time
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_transport import CONNECTION_POOL
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+from pyparadox_alarm.paradox_tests.panel_server import ParadoxStandInServer
+
+TEST_TIMEOUT = 5
+MAX_STOP_TIME = 1.0 #Seconds stop() and start() may each take
+
+def _timed(function, *args):
+    '''Returns the seconds the call took.'''
+    _start = time.monotonic()
+    function(*args)
+    return time.monotonic() - _start
+
+def _check_restart(panel):
+    '''Stops, restarts and stops the started panel, each quickly and without leftovers.'''
+    _threads = set(threading.enumerate())
+    assert panel.request_zone_label(1).result(TEST_TIMEOUT)
+    assert _timed(panel.stop) < MAX_STOP_TIME
+    assert _timed(panel.start) < MAX_STOP_TIME
+    assert panel.request_zone_label(2).result(TEST_TIMEOUT)
+    assert _timed(panel.stop) < MAX_STOP_TIME
+    _leftover = [thread for thread in set(threading.enumerate()) - _threads
+                 if thread.is_alive() and not thread.name.startswith('ThreadPoolExecutor')]
+    assert not _leftover
+
+def test_restart_over_serial():
+    '''Both with the fixed request interval and with adaptive pacing.'''
+    emulator = ParadoxPanelEmulator().start()
+    try:
+        for adaptive_pacing in [False, True]:
+            panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=adaptive_pacing)
+            panel.start()
+            _check_restart(panel)
+        assert 'Dummy' not in emulator.requests
+    finally:
+        emulator.stop()
+
+def test_restart_over_tcp():
+    '''The pooled TCP connection is re-used by the restarted panel.'''
+    server = ParadoxStandInServer().start()
+    try:
+        panel = ParadoxAlarmPanel(prt_port=server.url, adaptive_pacing=True)
+        panel.start()
+        _check_restart(panel)
+    finally:
+        CONNECTION_POOL.close_all()
+        server.stop()
+
+def test_drain_and_context_manager():
+    '''stop(drain=True) writes and decodes what is still queued.'''
+    emulator = ParadoxPanelEmulator().start()
+    try:
+        with ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True) as panel:
+            panel.request_all_labels(4, 48)
+            panel.stop(drain=True)
+            assert panel.alarm_state['zone'][48]['name'] == 'Zone 048'
+            assert panel.alarm_state['partition'][4]['name'] == 'Area 004'
+            panel.start()
+    finally:
+        emulator.stop()
+
+def test_failing_callback_keeps_monitoring():
+    '''An exception in a callback is logged, later messages and start-up work still run.'''
+    emulator = ParadoxPanelEmulator().start()
+    try:
+        with ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True) as panel:
+            def _fail(number):
+                raise RuntimeError(str.format('Callback for zone {0} failed.', number))
+            panel.callback_zone_name = _fail
+            assert panel.request_zone_label(1).result(TEST_TIMEOUT)
+            assert panel.request_zone_label(2).result(TEST_TIMEOUT)
+            assert panel.alarm_state['zone'][2]['name'] == 'Zone 002'
+            ran = []
+            panel._run_on_monitor(lambda: ran.append(threading.current_thread()))
+            assert ran and ran[0] is not threading.current_thread()
+    finally:
+        emulator.stop()
+
+def test_request_taken_but_not_written_stays_queued():
+    '''A request waiting for the flow control when stop() comes is written after the restart.'''
+    emulator = ParadoxPanelEmulator().start()
+    try:
+        emulator.model.reply = lambda request: None #Nothing answered, the window stays full
+        panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True)
+        panel.start()
+        panel.submit_request('ZL001')
+        panel.submit_request('ZL002')
+        _deadline = time.monotonic() + TEST_TIMEOUT
+        while not ('ZL001' in emulator.requests and panel._to_alarm.qsize() == 0 and
+                   panel._panel._writing):
+            assert time.monotonic() < _deadline
+            time.sleep(0.01)
+        panel.stop()
+        assert panel._to_alarm.qsize() == 1 and not panel._panel._writing
+        assert 'ZL002' not in emulator.requests
+        del emulator.model.reply
+        panel.start()
+        while panel.alarm_state['zone'][2]['name'] != 'Zone 002':
+            assert time.monotonic() < _deadline
+            time.sleep(0.01)
+        panel.stop()
+    finally:
+        emulator.stop()
@@ -0,0 +1,68 @@
+'''Runs several emulated panels on one event loop through the manager.'''
+
+import asyncio
+from pyparadox_alarm.alarm_manager import ParadoxPanelManager
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+from pyparadox_alarm.paradox_tests.panel_server import ParadoxStandInServer
+
+TEST_TIMEOUT = 5
+PANELS = 50
+PACING = 0.5
+
+def test_failing_listener_keeps_dispatching():
+    '''A listener raising does not stop the dispatcher of the other panels and listeners.'''
+    async def _run(emulators):
+        manager = ParadoxPanelManager()
+        for i, emulator in enumerate(emulators):
+            manager.add_panel(str(i), prt_port=emulator.port, request_interval=0.01)
+        seen = []
+        def _fail(name, message):
+            raise RuntimeError(str.format('Listener failed on {0}.', message))
+        manager.add_listener(_fail)
+        manager.add_listener(lambda name, message: seen.append((name, message)))
+        await manager.start()
+        try:
+            assert all(panel.loop is asyncio.get_running_loop()
+                       for panel in manager.panels.values())
+            for emulator in emulators:
+                emulator.send_event('G001N005A001')
+                emulator.send_event('G000N005A001')
+            _deadline = asyncio.get_running_loop().time() + TEST_TIMEOUT
+            while len(seen) < 4:
+                assert asyncio.get_running_loop().time() < _deadline
+                await asyncio.sleep(0.01)
+        finally:
+            await manager.stop()
+        assert sorted(seen) == [('0', 'G000N005A001'), ('0', 'G001N005A001'),
+                                ('1', 'G000N005A001'), ('1', 'G001N005A001')]
+        assert not manager.alarm_states['1']['zone'][5]['status']['open']
+    emulators = [ParadoxPanelEmulator().start() for _ in range(2)]
+    try:
+        asyncio.run(_run(emulators))
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+
+def test_control_request_with_many_panels():
+    '''With many idle panels on the loop a control request goes out within one pacing slot.'''
+    async def _run(server):
+        manager = ParadoxPanelManager()
+        for i in range(PANELS):
+            manager.add_panel(str(i), prt_port=server.url, request_interval=PACING)
+        await manager.start()
+        try:
+            assert all(panel.is_connected for panel in manager.panels.values())
+            await asyncio.sleep(PACING) #Idle writers, waiting for requests
+            _loop = asyncio.get_running_loop()
+            _sent = _loop.time()
+            assert manager.panels[str(PANELS - 1)].submit_request('AA001A1234')
+            while 'AA001A1234' not in server.requests:
+                assert _loop.time() - _sent < PACING
+                await asyncio.sleep(0.01)
+        finally:
+            await manager.stop()
+    server = ParadoxStandInServer().start()
+    try:
+        asyncio.run(_run(server))
+    finally:
+        server.stop()
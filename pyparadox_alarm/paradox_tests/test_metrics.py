@@ -0,0 +1,50 @@
+'''Counts, samples and exports the metrics of a panel.'''
+
+import time
+from pyparadox_alarm.alarm_metrics import ParadoxMetrics
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+
+TEST_TIMEOUT = 5
+
+def test_snapshot_and_prometheus():
+    '''Counters, labelled counters, gauges and cumulative histogram buckets.'''
+    metrics = ParadoxMetrics(sample_every=4)
+    metrics.inc('tx_frames')
+    metrics.inc('tx_bytes', 6)
+    metrics.inc('undecoded_frames', label='XX')
+    metrics.set_gauge('request_queue_depth', lambda: 3)
+    metrics.observe('request_rtt_seconds', 0.003)
+    metrics.observe('request_rtt_seconds', 0.3)
+    snapshot = metrics.snapshot()
+    assert snapshot['tx_frames'] == 1 and snapshot['tx_bytes'] == 6
+    assert snapshot['undecoded_frames'] == {'XX': 1}
+    assert snapshot['request_queue_depth'] == 3
+    rtt = snapshot['request_rtt_seconds']
+    assert rtt['count'] == 2 and rtt['buckets'][0.005] == 1 and rtt['buckets'][0.5] == 2
+    text = metrics.prometheus(panel='home')
+    assert '# TYPE paradox_tx_frames counter' in text
+    assert 'paradox_undecoded_frames{panel="home",type="XX"} 1' in text
+    assert 'paradox_request_rtt_seconds_bucket{panel="home",le="+Inf"} 2' in text
+    assert [metrics.sample('decode_seconds') for _ in range(8)].count(True) == 2
+
+def test_panel_traffic_counted():
+    '''A request and its reply show up as bytes, frames and a round trip.'''
+    emulator = ParadoxPanelEmulator().start()
+    try:
+        panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True)
+        panel.start()
+        try:
+            assert panel.request_zone_label(1).result(TEST_TIMEOUT)
+            _deadline = time.monotonic() + TEST_TIMEOUT
+            while 'request_rtt_seconds' not in panel.metrics.snapshot():
+                assert time.monotonic() < _deadline
+                time.sleep(0.01)
+            snapshot = panel.metrics.snapshot()
+        finally:
+            panel.stop()
+        assert snapshot['tx_frames'] >= 1 and snapshot['tx_bytes'] >= len('ZL001\r')
+        assert snapshot['rx_frames'] >= 1 and snapshot['rx_bytes'] >= len('ZL001Zone 001\r')
+        assert snapshot['request_rtt_seconds']['count'] >= 1
+    finally:
+        emulator.stop()
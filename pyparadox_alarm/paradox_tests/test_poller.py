@@ -0,0 +1,57 @@
+'''Polls stale statuses within the budget and decodes the full status replies.'''
+
+import time
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_poller import ParadoxStatusPoller
+from pyparadox_alarm.alarm_scheduler import PRIORITY_BACKGROUND
+from pyparadox_alarm.alarm_state import CompactAlarmState
+from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+
+TEST_TIMEOUT = 5
+
+def test_area_status_reply():
+    '''All conditions of an RA reply are kept, the arm status replaces the previous one.'''
+    panel = ParadoxAlarmPanel()
+    panel.update_area_status(1, 'AOOOOOO')
+    panel.update_area_status(1, 'SMTNOAO')
+    status = panel.alarm_state['partition'][1]['status']
+    assert status['armed_stay'] and not status['armed_away']
+    assert status['alarm_in_memory'] and status['trouble'] and status['alarm']
+    assert not status['ready']
+    panel.update_area_status(1, 'D')
+    status = panel.alarm_state['partition'][1]['status']
+    assert not status['armed_stay'] and status['alarm'] #Only the arm status given
+
+def test_stalest_first_within_budget():
+    '''Recently confirmed entities are skipped, one background request at a time.'''
+    state = CompactAlarmState(8, 2)
+    state.set_zone_flag(5, 'open', True) #Confirmed by an event just now
+    submitted = []
+    queued = []
+    poller = ParadoxStatusPoller(state, lambda request, priority: submitted.append(
+        (request, priority)) or queued.append(request), lambda: bool(queued), rate=100)
+    assert [request for _, request in poller.stale()][:2] == ['RA001', 'RA002']
+    poller.start()
+    for _ in range(10):
+        time.sleep(0.03)
+        queued.clear() #The request went out
+    poller.stop()
+    requests = [request for request, _ in submitted]
+    assert 'RZ005' not in requests and len(requests) == len(set(requests)) == 9
+    assert all(priority == PRIORITY_BACKGROUND for _, priority in submitted)
+
+def test_poll_picks_up_missed_change():
+    '''A zone that opened without an event is found by polling.'''
+    emulator = ParadoxPanelEmulator().start()
+    emulator.model.zones_open.add(7)
+    try:
+        panel = ParadoxAlarmPanel(prt_port=emulator.port, adaptive_pacing=True, poll_share=0.5)
+        panel.start()
+        _deadline = time.monotonic() + TEST_TIMEOUT
+        while not panel.alarm_state['zone'][7]['status']['open']:
+            assert time.monotonic() < _deadline
+            time.sleep(0.01)
+        panel.stop()
+        assert panel.poller.polls >= 7
+    finally:
+        emulator.stop()
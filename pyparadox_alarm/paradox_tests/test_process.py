@@ -0,0 +1,60 @@
+'''Runs the panel in a child process against the emulated PRT3.'''
+
+import threading
+import pytest
+import time
+from pyparadox_alarm.alarm_process import ParadoxProcessPanel, SharedAlarmState
+
+TEST_TIMEOUT = 10
+
+def test_seqlock_layout():
+    '''What is written between write_begin() and write_end() reads back in place.'''
+    buffer = bytearray(SharedAlarmState.size(8, 2))
+    writer = SharedAlarmState(buffer, 8, 2)
+    reader = SharedAlarmState(buffer)
+    writer.write_begin()
+    writer.set_flags('zone', 8, 0x05)
+    writer.set_flags('partition', 2, 0x8000)
+    writer.set_name('zone', 8, 'Back door')
+    writer.set_last_fault(8, 1234.5)
+    writer.write_end(7)
+    assert reader.view['zone'][8]['status']['open'] and reader.view['zone'][8]['status']['alarm']
+    assert reader.view['zone'][8]['name'] == 'Back door'
+    assert reader.view['zone'][1]['name'] == 'Zone 1 label default'
+    assert reader.view['partition'][2]['status']['entry_delay']
+    snapshot = reader.snapshot()
+    assert snapshot.version == 7 and snapshot.zone_last_fault(8) == 1234.5
+    writer.release()
+    reader.release()
+
+def test_panel_in_child_process():
+    '''Events decoded in the child show in the shared state before the callback.'''
+    from pyparadox_alarm.paradox_tests.panel_emulator import ParadoxPanelEmulator
+    emulator = ParadoxPanelEmulator().start()
+    seen = []
+    called = threading.Event()
+    try:
+        with ParadoxProcessPanel(prt_port=emulator.port, adaptive_pacing=True) as panel:
+            def zone_changed(number):
+                seen.append((number, panel.alarm_state['zone'][number]['status']['open']))
+                called.set()
+            panel.callback_zone_state_change = zone_changed
+            emulator.send_event('G001N009A001')
+            assert called.wait(TEST_TIMEOUT)
+            assert seen == [(9, True)]
+            panel.submit_request('ZL009')
+            _deadline = time.monotonic() + TEST_TIMEOUT
+            while panel.alarm_state['zone'][9]['name'] != 'Zone 009':
+                assert time.monotonic() < _deadline
+                time.sleep(0.01)
+            assert panel.snapshot().version == panel.state_version
+    finally:
+        emulator.stop()
+
+def test_state_before_start():
+    '''Reading the state or submitting before start() raises a clear RuntimeError.'''
+    panel = ParadoxProcessPanel()
+    for read in (lambda: panel.alarm_state, lambda: panel.state_version, panel.snapshot,
+                 lambda: panel.submit_request('ZL001')):
+        with pytest.raises(RuntimeError, match='start'):
+            read()
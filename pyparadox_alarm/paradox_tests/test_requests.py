@@ -1,7 +1,6 @@
 '''Some code to help test Paradox alarm interface by manually supplying commands.'''
 
 import logging
-import time
 from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
 
 _LOGGER = logging.getLogger(__name__)
@@ -30,7 +29,5 @@ while True:
 _LOGGER.info('Alarm State after:')
 print(panel.alarm_state)
 _LOGGER.info('Disconnecting...')
-panel.stop()
-_LOGGER.info('Waiting for all to stop:')
-time.sleep(10)
+panel.stop() #Returns once all threads have stopped
 _LOGGER.info('End test:')
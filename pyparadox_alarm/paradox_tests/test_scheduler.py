@@ -0,0 +1,38 @@
+'''Orders, deduplicates, cancels and ages requests in the scheduler.'''
+
+import time
+from pyparadox_alarm.alarm_scheduler import (ParadoxRequestScheduler, PRIORITY_LABEL,
+                                             PRIORITY_STATUS)
+
+def test_control_before_backlog():
+    '''An arm command overtakes a bulk label refresh, status polls are merged.'''
+    scheduler = ParadoxRequestScheduler()
+    for zone in range(1, 193):
+        scheduler.put(str.format('ZL{0:03d}', zone))
+    assert scheduler.put('RZ017')
+    assert not scheduler.put('RZ017')
+    scheduler.put('AA001A1234')
+    assert [scheduler.get(), scheduler.get(), scheduler.get()] == ['AA001A1234', 'RZ017', 'ZL001']
+    assert len(scheduler.cancel(priority=PRIORITY_LABEL)) == 191
+    assert scheduler.qsize() == 0
+
+def test_aging():
+    '''Labels waiting long enough are not starved by new status requests.'''
+    scheduler = ParadoxRequestScheduler(aging_interval=0.05)
+    scheduler.put('ZL001')
+    scheduler.put('ZL002', priority=PRIORITY_STATUS) #Moved up, no longer waits for ZL001
+    time.sleep(0.12)
+    scheduler.put('RZ001')
+    assert [scheduler.get(), scheduler.get(), scheduler.get()] == ['ZL001', 'ZL002', 'RZ001']
+
+def test_requeue_and_on_put():
+    '''A request taken but not written goes back first in its class; every put is announced.'''
+    puts = []
+    scheduler = ParadoxRequestScheduler(on_put=lambda: puts.append(scheduler.qsize()))
+    scheduler.put('ZL001')
+    scheduler.put('ZL002')
+    request, priority = scheduler.take()
+    assert (request, priority) == ('ZL001', PRIORITY_LABEL)
+    scheduler.requeue(request, priority)
+    assert puts == [1, 2, 2]
+    assert [scheduler.get(), scheduler.get()] == ['ZL001', 'ZL002']
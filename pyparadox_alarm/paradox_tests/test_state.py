@@ -0,0 +1,43 @@
+'''Versions the alarm state: snapshots and the changes since a version.'''
+
+from pyparadox_alarm.alarm_state import CompactAlarmState
+
+def test_snapshot_is_immutable():
+    '''A snapshot keeps its version and values while the state moves on.'''
+    state = CompactAlarmState(8, 2)
+    state.set_zone_flag(2, 'open', True)
+    state.set_zone_name(2, 'Hall')
+    snapshot = state.snapshot()
+    assert state.snapshot() is snapshot #Nothing changed, nothing copied
+    state.set_zone_flag(2, 'open', False)
+    state.set_zone_name(2, 'Kitchen')
+    assert snapshot.version == 2 and state.version == 4
+    assert snapshot.view['zone'][2]['status']['open'] and snapshot.zone_name(2) == 'Hall'
+    assert not state.view['zone'][2]['status']['open']
+
+def test_changes_since():
+    '''Only the latest value per entity and field, oldest first; None once out of history.'''
+    state = CompactAlarmState(8, 2, history=4)
+    state.set_zone_flag(1, 'open', True)
+    version = state.version
+    state.set_zone_flag(3, 'open', True)
+    state.set_zone_flag(3, 'alarm', True)
+    state.set_partition_name(1, 'House')
+    current, changes = state.changes_since(version)
+    assert current == state.version == 4
+    assert [(entity, field) for _, entity, field, _ in changes] == [
+        (('zone', 3), 'status'), (('partition', 1), 'name')]
+    assert changes[0][3]['open'] and changes[0][3]['alarm']
+    assert state.changes_since(current) == (current, [])
+    state.set_zone_flag(4, 'open', True)
+    state.set_zone_flag(5, 'open', True)
+    assert state.changes_since(0) == (6, None) #Start over from a snapshot
+
+def test_unchanged_write_keeps_version():
+    '''Setting what is already set is not a change.'''
+    state = CompactAlarmState(8, 2)
+    state.set_zone_flag(1, 'bypass', True)
+    state.set_zone_flag(1, 'bypass', True)
+    state.set_zone_name(1, 'Hall')
+    state.set_zone_name(1, 'Hall')
+    assert state.version == 2
@@ -0,0 +1,78 @@
+'''Loses the link to the stand-in server and checks how the panel recovers.'''
+
+import threading
+import time
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_transport import CONNECTION_POOL
+from pyparadox_alarm.alarm_supervisor import MAX_UNANSWERED, PROBE_TIMEOUT, ParadoxLinkSupervisor
+from pyparadox_alarm.paradox_tests.panel_server import ParadoxStandInServer
+
+TEST_TIMEOUT = 5
+
+def _wait_for(condition, timeout=TEST_TIMEOUT):
+    '''Waits until the condition holds, fails the test after the timeout.'''
+    _deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < _deadline
+        time.sleep(0.01)
+
+def test_replay_and_resync_after_link_loss():
+    '''Unanswered requests are written again, only the active zones are resynced.'''
+    server = ParadoxStandInServer().start()
+    panel = ParadoxAlarmPanel(prt_port=server.url, adaptive_pacing=True)
+    reconnected = threading.Event()
+    panel.start()
+    _restored = panel._panel.supervisor._restored
+    panel._panel.supervisor._restored = lambda *args: (_restored(*args), reconnected.set())
+    try:
+        server.send_event('G001N007A001') #Zone 7 opens
+        _wait_for(lambda: panel.alarm_state['zone'][7]['status']['open'])
+        server.reply = lambda request: None #Requests go unanswered...
+        label = panel.request_zone_label(5, timeout=TEST_TIMEOUT)
+        _wait_for(lambda: 'ZL005' in server.requests)
+        del server.requests[:]
+        server.reply = server.model.reply
+        server.drop_clients() #...until the link is lost and restored
+        assert reconnected.wait(TEST_TIMEOUT)
+        assert label.result(TEST_TIMEOUT) == 'ZL005Zone 005'
+        _wait_for(lambda: 'RA004' in server.requests and 'RZ007' in server.requests)
+        assert not [request for request in server.requests if request[:2] == 'RZ' and
+                    request != 'RZ007']
+    finally:
+        panel.stop()
+        CONNECTION_POOL.close_all()
+        server.stop()
+
+def test_silent_link_is_probed():
+    '''A link that stays silent and does not answer the probe is re-opened.'''
+    server = ParadoxStandInServer().start()
+    panel = ParadoxAlarmPanel(prt_port=server.url, adaptive_pacing=True, silence_timeout=0.2)
+    panel.start()
+    try:
+        server.reply = lambda request: None #The panel has hung
+        _wait_for(lambda: panel._panel.supervisor.outages >= 1, 2 * PROBE_TIMEOUT)
+        server.reply = server.model.reply
+        _wait_for(lambda: panel._panel.supervisor.is_up)
+        assert panel.request_area_label(1).result(TEST_TIMEOUT) == 'AL001Area 001'
+    finally:
+        panel.stop()
+        CONNECTION_POOL.close_all()
+        server.stop()
+
+def test_written_and_received_on_different_threads():
+    '''The unanswered requests stay consistent with a writer and a reader thread.'''
+    supervisor = ParadoxLinkSupervisor(None, None, None, silence_timeout=None)
+    errors = []
+    def _run(function, message):
+        try:
+            for i in range(20000):
+                function(str.format(message, i % 100))
+        except Exception as err: #pylint: disable=broad-except
+            errors.append(err)
+    threads = [threading.Thread(target=_run, args=(supervisor.written, 'ZL{0:03d}')),
+               threading.Thread(target=_run, args=(supervisor.received, 'ZL{0:03d}Zone'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(TEST_TIMEOUT)
+    assert not errors and supervisor.unanswered <= MAX_UNANSWERED
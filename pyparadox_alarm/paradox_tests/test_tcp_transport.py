@@ -0,0 +1,72 @@
+'''Drives ParadoxAlarmPanel over TCP against the local stand-in server.'''
+
+import threading
+import pytest
+from pyparadox_alarm.alarm_panel import ParadoxAlarmPanel
+from pyparadox_alarm.alarm_transport import (CONNECTION_POOL, ParadoxTransport, TcpTransport,
+                                             parse_socket_port)
+from pyparadox_alarm.paradox_tests.panel_server import ParadoxStandInServer
+
+TEST_TIMEOUT = 5
+
+def test_requests_over_tcp():
+    '''Labels requested over TCP end up in the alarm state.'''
+    server = ParadoxStandInServer().start()
+    panel = ParadoxAlarmPanel(prt_port=server.url, adaptive_pacing=True)
+    panel.start()
+    try:
+        for reply in [panel.request_zone_label(i) for i in range(1, 11)]:
+            reply.result(TEST_TIMEOUT)
+        assert panel.alarm_state['zone'][10]['name'] == 'Zone 010'
+    finally:
+        panel.stop()
+        CONNECTION_POOL.close_all()
+        server.stop()
+
+def test_reconnect_after_bridge_restart():
+    '''The link supervisor re-opens the TCP transport when the bridge drops the connection.'''
+    server = ParadoxStandInServer().start()
+    panel = ParadoxAlarmPanel(prt_port=server.url, adaptive_pacing=True)
+    zone_opened = threading.Event()
+    panel.callback_zone_state_change = lambda zone: zone_opened.set()
+    panel.start()
+    try:
+        panel.request_zone_label(1).result(TEST_TIMEOUT)
+        server.drop_clients()
+        assert panel.request_zone_label(2, timeout=1).result(TEST_TIMEOUT) == 'ZL002Zone 002'
+        server.send_event('G001N003A001')
+        assert zone_opened.wait(TEST_TIMEOUT)
+        assert panel._panel._supervisor.outages >= 1
+    finally:
+        panel.stop()
+        CONNECTION_POOL.close_all()
+        server.stop()
+
+def test_lost_connection_left_to_the_supervisor():
+    '''A dropped TCP transport stays closed: reads return nothing and writes raise.'''
+    server = ParadoxStandInServer().start()
+    transport = TcpTransport(*parse_socket_port(server.url))
+    try:
+        transport.open()
+        transport._drop()
+        assert not transport.is_open()
+        assert transport.read() == b''
+        with pytest.raises(ConnectionError):
+            transport.write(b'ZL001\r')
+        assert not transport.is_open()
+        transport.open()
+        assert transport.is_open()
+    finally:
+        transport.close()
+        server.stop()
+
+def test_transport_interface_is_abstract():
+    '''ParadoxTransport can't be used without implementing it.'''
+    with pytest.raises(TypeError):
+        ParadoxTransport() #pylint: disable=abstract-class-instantiated
+
+if __name__ == '__main__':
+    test_requests_over_tcp()
+    test_reconnect_after_bridge_restart()
+    test_lost_connection_left_to_the_supervisor()
+    test_transport_interface_is_abstract()
@@ -0,0 +1,50 @@
+'''Matches replies to requests, retries on &fail and times requests out.'''
+
+import pytest
+from pyparadox_alarm.alarm_requests import (ParadoxRequestTracker, ParadoxRequestFailed,
+                                            ParadoxRequestTimeout)
+
+TEST_TIMEOUT = 5
+
+def _tracker(**kwargs):
+    '''Returns a tracker and the list its requests are submitted to.'''
+    submitted = []
+    return ParadoxRequestTracker(submitted.append, **kwargs), submitted
+
+def test_reply_matching():
+    '''A reply completes the oldest request of its command and number, and identical ones.'''
+    tracker, submitted = _tracker()
+    labels = [tracker.request('ZL001'), tracker.request('ZL001')]
+    status = tracker.request('RZ001')
+    assert tracker.resolve('ZL001Front door')
+    assert [future.result(0) for future in labels] == ['ZL001Front door'] * 2
+    assert not status.done() and tracker.pending == 1
+    assert not tracker.resolve('ZL002Kitchen') #Nobody asked
+    assert tracker.resolve('RZ001COOOO') and status.result(0) == 'RZ001COOOO'
+    assert submitted == ['ZL001', 'ZL001', 'RZ001']
+    tracker.close()
+
+def test_fail_is_retried_in_place():
+    '''&fail re-submits the request, which is still answered before the ones behind it.'''
+    tracker, submitted = _tracker(retries=1)
+    arm = tracker.request('AA001')
+    arm_with_code = tracker.request('AA0011234')
+    assert tracker.resolve('AA001&fail')
+    assert submitted == ['AA001', 'AA0011234', 'AA001'] and not arm.done()
+    assert tracker.resolve('AA001&fail')
+    with pytest.raises(ParadoxRequestFailed):
+        arm.result(0)
+    assert tracker.resolve('AA001&ok') and arm_with_code.result(0) == 'AA001&ok'
+    tracker.close()
+
+def test_timeout_behind_a_younger_head():
+    '''A request times out (after its retries) even while an older one still waits.'''
+    tracker, submitted = _tracker()
+    patient = tracker.request('AA001', timeout=TEST_TIMEOUT, retries=0)
+    hasty = tracker.request('AA0011234', timeout=0.05, retries=1)
+    with pytest.raises(ParadoxRequestTimeout):
+        hasty.result(TEST_TIMEOUT)
+    assert submitted == ['AA001', 'AA0011234', 'AA0011234']
+    assert not patient.done() and tracker.pending == 1
+    assert tracker.resolve('AA001&ok') and patient.result(0) == 'AA001&ok'
+    tracker.close()
@@ -11,6 +11,7 @@ setup(name='pyparadox_alarm',
       license='MIT',
       packages=['pyparadox_alarm'],
       install_requires=['pyserial'],
+      extras_require={'analytics': ['numpy']},
       classifiers=['Development Status :: 4 - Beta', 'Programming Language :: Python :: 3.4','Programming Language :: Python :: 3.5']
   )
 